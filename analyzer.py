@@ -0,0 +1,430 @@
+"""
+    Static analysis of a ROM: follows every path from 0x200 through the same
+    opcode tables the CPU decodes with, without running anything. It finds
+    the instructions (and the basic blocks and subroutines they make up),
+    the bytes Dxyn draws as sprites or Fx33, Fx55 and Fx65 use as data, and
+    the unknown opcodes that would raise UnknownOpcodeException if they ran.
+
+        python analyzer.py rom
+        python analyzer.py rom --disassemble
+
+    The result is cached on disk by the hash of the ROM and the quirks, so
+    the engines can warm up from it and the debugger and batch.py can use it
+    for free the second time round. Jumps through Bnnn can't be followed
+    statically, they're listed as indirect.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import config
+from cpu import OPCODE_FIELDS
+import headless
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'chipy38')
+# Different values of I tracked per address before giving up on knowing it
+MAX_I_VALUES = 16
+
+# How control carries on after an instruction, by handler name
+JUMPS = {'jmp_to_addr'}
+CALLS = {'call_subroutine'}
+SKIPS = {'branch_if_equal_val', 'branch_if_not_equal_val',
+         'branch_if_equal_reg', 'skip_if_regs_not_equal',
+         'skip_if_key_pressed', 'skip_if_key_not_pressed'}
+STOPS = {'ret_from_subroutine', 'exit_interpreter', 'jmp_to_val_plus_v0'}
+
+MNEMONICS = {
+    'ignore_opcode': 'SYS {nnn:#05x}',
+    'clear_screen': 'CLS',
+    'ret_from_subroutine': 'RET',
+    'exit_interpreter': 'EXIT',
+    'jmp_to_addr': 'JP {nnn:#05x}',
+    'call_subroutine': 'CALL {nnn:#05x}',
+    'branch_if_equal_val': 'SE V{x:X}, {kk:#04x}',
+    'branch_if_not_equal_val': 'SNE V{x:X}, {kk:#04x}',
+    'branch_if_equal_reg': 'SE V{x:X}, V{y:X}',
+    'set_reg_to_val': 'LD V{x:X}, {kk:#04x}',
+    'add_to_reg': 'ADD V{x:X}, {kk:#04x}',
+    'set_reg_to_reg': 'LD V{x:X}, V{y:X}',
+    'bitwise_or': 'OR V{x:X}, V{y:X}',
+    'bitwise_and': 'AND V{x:X}, V{y:X}',
+    'bitwise_xor': 'XOR V{x:X}, V{y:X}',
+    'add_reg_to_reg': 'ADD V{x:X}, V{y:X}',
+    'sub_reg_from_reg': 'SUB V{x:X}, V{y:X}',
+    'right_shift': 'SHR V{x:X}',
+    'right_shift_quirk': 'SHR V{x:X}, V{y:X}',
+    'subn_reg_from_reg': 'SUBN V{x:X}, V{y:X}',
+    'left_shift': 'SHL V{x:X}',
+    'left_shift_quirk': 'SHL V{x:X}, V{y:X}',
+    'skip_if_regs_not_equal': 'SNE V{x:X}, V{y:X}',
+    'set_I_to_address': 'LD I, {nnn:#05x}',
+    'jmp_to_val_plus_v0': 'JP V0, {nnn:#05x}',
+    'generate_random_number': 'RND V{x:X}, {kk:#04x}',
+    'draw_pixel_to_display': 'DRW V{x:X}, V{y:X}, {n}',
+    'skip_if_key_pressed': 'SKP V{x:X}',
+    'skip_if_key_not_pressed': 'SKNP V{x:X}',
+    'set_reg_to_delay_timer': 'LD V{x:X}, DT',
+    'wait_for_keypress': 'LD V{x:X}, K',
+    'set_delay_timer_to_reg': 'LD DT, V{x:X}',
+    'set_sound_timer_to_reg': 'LD ST, V{x:X}',
+    'add_reg_to_I': 'ADD I, V{x:X}',
+    'load_sprite_from_memory': 'LD F, V{x:X}',
+    'bin_coded_dec': 'LD B, V{x:X}',
+    'load_registers_in_memory': 'LD [I], V{x:X}',
+    'load_registers_in_memory_quirk': 'LD [I], V{x:X}',
+    'load_mem_to_registers': 'LD V{x:X}, [I]',
+    'load_mem_to_registers_quirk': 'LD V{x:X}, [I]'
+}
+
+
+def rom_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def cache_name(data):
+    """
+        Returns the name of the cache file of the ROM in data. The quirks
+        change which handlers run and how Fx55 and Fx65 move I, so they're
+        part of it.
+    """
+    return '{}-shift{:d}-load{:d}.json'.format(
+        rom_hash(data), config.shift_quirk, config.load_quirk)
+
+
+def disassemble(opcode, name):
+    """
+        Returns the mnemonic of opcode, name is the name of its handler or
+        None when it's unknown.
+    """
+    if name is None or (name == 'ignore_opcode' and opcode >> 12):
+        # Unknown, or an Exkk the keypad handler ignores
+        return 'DW {:#06x}'.format(opcode)
+    fields = {field: extract(opcode)
+              for field, extract in OPCODE_FIELDS.items()}
+    return MNEMONICS[name].format(**fields)
+
+
+def ranges(addresses):
+    """
+        Turns a set of addresses into sorted [start, end) pairs.
+    """
+    merged = []
+    for address in sorted(addresses):
+        if merged and merged[-1][1] == address:
+            merged[-1][1] = address + 1
+        else:
+            merged.append([address, address + 1])
+    return merged
+
+
+class Analysis:
+    """
+        What analyze found. Addresses are absolute, blocks and subroutines
+        are [start, end) with end the address after their last instruction.
+    """
+    def __init__(self, rom, offset, size):
+        self.rom = rom  # The hash of the ROM
+        self.offset = offset
+        self.size = size
+        self.code = []  # Every instruction address, sorted
+        self.blocks = []  # [start, end, successors, call target or None]
+        self.subroutines = []  # [entry, start, end]
+        self.sprites = []  # [start, end)
+        self.data = []  # [start, end)
+        self.unknown = []  # [address, opcode]
+        self.indirect = []  # Addresses of Bnnn
+        self.listing = {}  # Mnemonics by address
+
+    def block_starts(self):
+        return [block[0] for block in self.blocks]
+
+    def memory_map(self):
+        """
+            Returns [start, end, kind] runs covering the ROM, kind is code,
+            sprite, data or unused (nothing reachable touches it).
+        """
+        kinds = ['unused'] * self.size
+        for kind, regions in (('data', self.data), ('sprite', self.sprites)):
+            for start, end in regions:
+                for address in range(max(start, self.offset),
+                                     min(end, self.offset + self.size)):
+                    kinds[address - self.offset] = kind
+        for address in self.code:
+            for byte in (address, address + 1):
+                if byte < self.offset + self.size:
+                    kinds[byte - self.offset] = 'code'
+        runs = []
+        for index, kind in enumerate(kinds):
+            if runs and runs[-1][2] == kind:
+                runs[-1][1] += 1
+            else:
+                runs.append([self.offset + index, self.offset + index + 1,
+                             kind])
+        return runs
+
+    def to_json(self):
+        state = dict(vars(self))
+        state['version'] = CACHE_VERSION
+        # JSON keys are strings
+        state['listing'] = sorted(self.listing.items())
+        return state
+
+    @classmethod
+    def from_json(cls, state):
+        analysis = cls(state['rom'], state['offset'], state['size'])
+        for name in ('code', 'blocks', 'subroutines', 'sprites', 'data',
+                     'unknown', 'indirect'):
+            setattr(analysis, name, state[name])
+        analysis.listing = dict(
+            (address, text) for address, text in state['listing'])
+        return analysis
+
+
+def walk(memory, start, lookup_handler):
+    """
+        Follows every path from start, carrying the value of I along when it
+        is known. Returns the successors and call target of every
+        instruction reached, the bytes used as sprites and data, and the
+        handler names.
+    """
+    seen = {}  # Values of I every address was reached with
+    successors = {}
+    calls = {}
+    names = {}
+    sprites = set()
+    data = set()
+    pending = [(start, None)]
+    while pending:
+        address, i = pending.pop()
+        if address + 1 >= len(memory):
+            continue
+        values = seen.setdefault(address, set())
+        if len(values) >= MAX_I_VALUES:
+            i = None
+        if i in values:
+            continue
+        values.add(i)
+        opcode = memory[address] << 8 | memory[address + 1]
+        handler = lookup_handler(opcode)
+        name = handler.__name__ if handler is not None else None
+        names[address] = (opcode, name)
+        x = (opcode & 0x0F00) >> 8
+        after = address + 2
+
+        if name == 'set_I_to_address':
+            i = opcode & 0x0FFF
+        elif name in ('add_reg_to_I', 'load_sprite_from_memory'):
+            i = None
+        elif i is not None:
+            if name == 'draw_pixel_to_display':
+                sprites.update(range(i, i + (opcode & 0xF)))
+            elif name == 'bin_coded_dec':
+                data.update(range(i, i + 3))
+            elif name in ('load_registers_in_memory',
+                          'load_mem_to_registers'):
+                data.update(range(i, i + x + 1))
+            elif name in ('load_registers_in_memory_quirk',
+                          'load_mem_to_registers_quirk'):
+                data.update(range(i, i + x + 1))
+                i += x + 1
+
+        if name is None or name in STOPS:
+            targets = ()
+        elif name in JUMPS:
+            targets = (opcode & 0x0FFF,)
+        elif name in CALLS:
+            calls[address] = opcode & 0x0FFF
+            # The subroutine may have changed I by the time it returns
+            pending.append((opcode & 0x0FFF, i))
+            targets = (after,)
+            i = None
+        elif name in SKIPS:
+            targets = (after, after + 2)
+        else:
+            targets = (after,)
+        successors[address] = targets
+        for target in targets:
+            pending.append((target, i))
+    return successors, calls, names, sprites, data
+
+
+def analyze(data, offset=headless.OFFSET):
+    """
+        Analyzes the ROM in data, loaded at offset.
+    """
+    cpu = headless.make_machine()
+    memory = cpu.memory
+    digest = rom_hash(data)
+    data = data[:len(memory) - offset]
+    memory[offset:offset + len(data)] = data
+    successors, calls, names, sprites, used = walk(
+        memory, offset, cpu.lookup_handler)
+
+    analysis = Analysis(digest, offset, len(data))
+    analysis.code = sorted(successors)
+    for address, (opcode, name) in names.items():
+        analysis.listing[address] = disassemble(opcode, name)
+        if name is None:
+            analysis.unknown.append([address, opcode])
+        elif name == 'jmp_to_val_plus_v0':
+            analysis.indirect.append(address)
+    analysis.unknown.sort()
+    analysis.indirect.sort()
+    analysis.sprites = ranges(sprites)
+    analysis.data = ranges(used)
+
+    # A block starts at every target of a jump, skip or call and wherever
+    # control doesn't just fall through from the previous instruction
+    leaders = {offset} | set(calls.values())
+    for address, targets in successors.items():
+        if targets != (address + 2,) or address in calls:
+            leaders.update(targets)
+    for address in successors:
+        previous = successors.get(address - 2)
+        if previous != (address,) or address - 2 in calls:
+            leaders.add(address)
+    blocks = {}
+    for start in sorted(leaders & set(successors)):
+        end = start
+        while successors[end] == (end + 2,) and end not in calls \
+                and end + 2 in successors and end + 2 not in leaders:
+            end += 2
+        blocks[start] = [start, end + 2, list(successors[end]),
+                         calls.get(end)]
+    analysis.blocks = [blocks[start] for start in sorted(blocks)]
+
+    # A subroutine is every block reachable from its entry without going
+    # into the subroutines it calls
+    for entry in sorted(set(calls.values()) & set(blocks)):
+        reached = set()
+        pending = [entry]
+        while pending:
+            start = pending.pop()
+            if start in reached or start not in blocks:
+                continue
+            reached.add(start)
+            pending.extend(blocks[start][2])
+        analysis.subroutines.append([
+            entry,
+            min(reached),
+            max(blocks[start][1] for start in reached)])
+    return analysis
+
+
+def load_analysis(rom, cache_dir=CACHE_DIR):
+    """
+        Returns the analysis of the ROM file at rom, from the cache when it
+        was analyzed before. A cache_dir of None turns caching off.
+    """
+    with open(rom, 'rb') as file:
+        data = file.read()
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, cache_name(data))
+        try:
+            with open(path) as file:
+                state = json.load(file)
+            if state.get('version') == CACHE_VERSION:
+                return Analysis.from_json(state)
+        except (IOError, ValueError, KeyError):
+            pass
+    analysis = analyze(data)
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written aside and moved over, batch.py workers share the cache
+            handle, temporary = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(handle, 'w') as file:
+                json.dump(analysis.to_json(), file)
+            os.replace(temporary, path)
+        except OSError as error:
+            logger.warning("Couldn't cache the analysis: {}".format(error))
+    return analysis
+
+
+def write_listing(analysis, data, file):
+    """
+        Writes the disassembly of the ROM in data, with the bytes nothing
+        executes as DB lines.
+    """
+    entries = {entry for entry, _, _ in analysis.subroutines}
+    starts = set(analysis.block_starts())
+    for start, end, kind in analysis.memory_map():
+        if kind != 'code':
+            file.write('; {}\n'.format(kind))
+            for line in range(start, end, 8):
+                values = data[line - analysis.offset:
+                              min(line + 8, end) - analysis.offset]
+                file.write('    {:03x}  DB {}\n'.format(line, ', '.join(
+                    '{:#04x}'.format(value) for value in values)))
+            continue
+        for address in range(start, end, 2):
+            if address in entries:
+                file.write('\nsub_{:03x}:\n'.format(address))
+            elif address in starts:
+                file.write('label_{:03x}:\n'.format(address))
+            file.write('    {:03x}  {}\n'.format(
+                address, analysis.listing.get(address, '')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="analyzes a rom without running it")
+    parser.add_argument("rom", help="path to rom", type=str)
+    parser.add_argument(
+        "--disassemble",
+        help="prints the disassembly",
+        action='store_true',
+        dest='disassemble',
+        default=False)
+    parser.add_argument(
+        "--json",
+        help="prints the whole analysis as JSON",
+        action='store_true',
+        dest='json',
+        default=False)
+    parser.add_argument(
+        "--cache-dir",
+        help="where analyses are cached",
+        dest="cache_dir",
+        type=str,
+        default=CACHE_DIR)
+    parser.add_argument(
+        "--no-cache",
+        help="analyzes again and doesn't cache",
+        action='store_true',
+        dest='no_cache',
+        default=False)
+    args = parser.parse_args(argv)
+
+    analysis = load_analysis(
+        args.rom, None if args.no_cache else args.cache_dir)
+    if args.json:
+        json.dump(analysis.to_json(), sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    if args.disassemble:
+        with open(args.rom, 'rb') as file:
+            write_listing(analysis, file.read(), sys.stdout)
+        return
+    sys.stdout.write(
+        "{} instructions in {} blocks, {} subroutines\n".format(
+            len(analysis.code), len(analysis.blocks),
+            len(analysis.subroutines)))
+    for start, end, kind in analysis.memory_map():
+        sys.stdout.write("  {:#05x}-{:#05x} {}\n".format(start, end - 1, kind))
+    for address, opcode in analysis.unknown:
+        sys.stdout.write("unknown opcode {:#06x} at {:#05x}\n".format(
+            opcode, address))
+    for address in analysis.indirect:
+        sys.stdout.write("indirect jump at {:#05x}\n".format(address))
+
+
+if __name__ == '__main__':
+    main()
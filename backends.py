@@ -0,0 +1,112 @@
+"""
+    What the CPU needs from the outside world. None of this imports pygame,
+    the pygame versions live in pygame_backends.py.
+"""
+
+
+class Keypad:
+    """
+        The 16 key hexadecimal keypad.
+    """
+    def is_pressed(self, key):
+        """
+            Returns True if key (0x0 - 0xF) is currently held down.
+        """
+        raise NotImplementedError
+
+    def wait_for_key(self):
+        """
+            Returns the next key that gets pressed, or None if there isn't
+            one yet. Fx0A executes again until a key comes back.
+        """
+        raise NotImplementedError
+
+    def next_frame(self):
+        """
+            Called after every frame, the keys only change in between.
+        """
+
+
+class KeyState(Keypad):
+    """
+        The keypad as a 16-bit mask, bit n is key n. Whoever owns it updates
+        it between frames, the CPU only does bit tests.
+    """
+    def __init__(self):
+        self.mask = 0
+        # Keys that went down since the last frame, for Fx0A
+        self.pressed = 0
+
+    def is_pressed(self, key):
+        return 0 <= key < 16 and (self.mask >> key) & 1 == 1
+
+    def wait_for_key(self):
+        if not self.pressed:
+            return None
+        key = (self.pressed & -self.pressed).bit_length() - 1
+        self.pressed &= ~(1 << key)
+        return key
+
+    def press(self, key):
+        self.pressed |= ~self.mask & (1 << key)
+        self.mask |= 1 << key
+
+    def release(self, key):
+        self.mask &= ~(1 << key)
+
+    def set_mask(self, mask):
+        self.pressed |= mask & ~self.mask
+        self.mask = mask
+
+    def next_frame(self):
+        self.pressed = 0
+
+
+class ScriptedKeypad(KeyState):
+    """
+        Plays back a mask per frame, from a script or a recording. The last
+        mask stays held once the script runs out.
+    """
+    def __init__(self, masks):
+        super(ScriptedKeypad, self).__init__()
+        self.masks = list(masks)
+        self.frame = 0
+        if self.masks:
+            self.set_mask(self.masks[0])
+
+    def next_frame(self):
+        super(ScriptedKeypad, self).next_frame()
+        self.frame += 1
+        if self.frame < len(self.masks):
+            self.set_mask(self.masks[self.frame])
+
+
+class Audio:
+    """
+        Plays the tone. The CPU only calls it when the sound timer starts or
+        stops, not on every tick.
+    """
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class NullKeypad(Keypad):
+    """
+        A keypad nobody touches.
+    """
+    def is_pressed(self, key):
+        return False
+
+    def wait_for_key(self):
+        return None
+
+
+class NullAudio(Audio):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
@@ -0,0 +1,176 @@
+"""
+    Runs a whole directory of ROMs headless across all cores and writes a
+    report with the final screen of each one, to use the emulator as a
+    regression oracle:
+
+        python batch.py roms/ -n 100000 -o report.json
+        python batch.py manifest.txt --frames 600 -o report.csv
+
+    A manifest is a text file with one ROM path per line, relative to the
+    manifest, lines starting with # are skipped.
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import time
+from cpu import UnknownOpcodeException
+import analyzer
+import headless
+
+FIELDS = ('rom', 'status', 'error', 'framebuffer', 'cycles',
+          'instructions_per_second', 'wall_time')
+
+
+def find_roms(path):
+    """
+        Returns the ROMs in a directory or listed in a manifest.
+    """
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if not name.startswith('.')
+                and os.path.isfile(os.path.join(path, name))]
+    base = os.path.dirname(path)
+    with open(path) as manifest:
+        return [os.path.join(base, line.strip()) for line in manifest
+                if line.strip() and not line.startswith('#')]
+
+
+def run_rom(rom, instructions, engine='interpreter', warm_up=False):
+    """
+        Runs a ROM for the given number of instructions, or until it exits,
+        and returns its row of the report. Runs in the worker processes.
+        With warm_up the engine decodes or compiles the code analyzer.py
+        found before running.
+    """
+    result = dict.fromkeys(FIELDS)
+    result['rom'] = rom
+    start = time.perf_counter()
+    cpu = None
+    try:
+        cpu = headless.make_machine(rom, engine)
+        if warm_up:
+            cpu.warm_up(analyzer.load_analysis(rom))
+        # A frame at a time so 00FD is noticed
+        while cpu.cycles < instructions and not cpu.exited:
+            cpu.run_cycles(
+                min(cpu.cycles_per_tick, instructions - cpu.cycles))
+        result['status'] = 'exited' if cpu.exited else 'ok'
+    except UnknownOpcodeException as error:
+        result['status'] = 'unknown_opcode'
+        result['error'] = str(error)
+    except Exception as error:
+        result['status'] = 'crashed'
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    elapsed = time.perf_counter() - start
+    result['wall_time'] = round(elapsed, 6)
+    if cpu is not None:
+        result['framebuffer'] = headless.framebuffer_hash(cpu.display)
+        result['cycles'] = cpu.cycles
+        result['instructions_per_second'] = \
+            round(cpu.cycles / elapsed) if elapsed else 0
+    return result
+
+
+def run_batch(roms, instructions, engine='interpreter', workers=None,
+              warm_up=False):
+    """
+        Runs every ROM in its own process and returns the results in the
+        order of roms.
+    """
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(
+            run_rom,
+            roms,
+            [instructions] * len(roms),
+            [engine] * len(roms),
+            [warm_up] * len(roms)))
+
+
+def write_report(results, file, fmt):
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    else:
+        json.dump(results, file, indent=2)
+        file.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="runs a directory or manifest of roms headless")
+    parser.add_argument(
+        "roms",
+        help="directory of roms or a manifest listing them",
+        type=str)
+    parser.add_argument(
+        "-n",
+        help="number of instructions to execute per rom",
+        dest="instructions",
+        type=int,
+        default=100000)
+    parser.add_argument(
+        "--frames",
+        help="number of 60 Hz frames to run per rom instead of -n",
+        dest="frames",
+        type=int)
+    parser.add_argument(
+        "-e",
+        help="sets the execution engine",
+        dest="engine",
+        choices=sorted(headless.ENGINES),
+        default="interpreter")
+    parser.add_argument(
+        "-j",
+        help="number of worker processes, defaults to the number of cores",
+        dest="workers",
+        type=int)
+    parser.add_argument(
+        "-o",
+        help="where the report gets written, defaults to stdout",
+        dest="output",
+        type=str)
+    parser.add_argument(
+        "--format",
+        help="report format, guessed from -o when not given",
+        dest="format",
+        choices=["json", "csv"])
+    parser.add_argument(
+        "--warm-up",
+        help="analyzes every rom, or loads the cached analysis, and decodes "
+             "its code before running it",
+        action='store_true',
+        dest='warm_up',
+        default=False)
+    args = parser.parse_args(argv)
+
+    instructions = args.instructions
+    if args.frames is not None:
+        instructions = args.frames * headless.make_machine().cycles_per_tick
+    fmt = args.format
+    if fmt is None:
+        fmt = 'csv' if args.output and args.output.endswith('.csv') \
+            else 'json'
+
+    start = time.perf_counter()
+    results = run_batch(
+        find_roms(args.roms), instructions, args.engine, args.workers,
+        args.warm_up)
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            write_report(results, file, fmt)
+    else:
+        write_report(results, sys.stdout, fmt)
+    failed = sum(result['status'] not in ('ok', 'exited')
+                 for result in results)
+    sys.stderr.write("{} roms in {:.3f}s, {} failed\n".format(
+        len(results), elapsed, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""
+    Benchmarks for the hot paths: every opcode handler on its own, whole
+    synthetic ROMs on every engine and the display redraw. Results are JSON
+    and can be compared against a stored baseline:
+
+        python bench.py --save-baseline bench_baseline.json
+        python bench.py --baseline bench_baseline.json
+
+    which exits with 1 when something got slower than the tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import headless
+
+# Small ROMs that each lean on one part of the CPU
+SYNTHETIC_ROMS = {
+    'draw': [
+        0x6000,  # 0x200 V0 = 0
+        0x6100,  # 0x202 V1 = 0
+        0xF229,  # 0x204 I = sprite of V2
+        0xD015,  # 0x206 draw it at (V0, V1)
+        0x7003,  # 0x208 V0 += 3
+        0x7101,  # 0x20A V1 += 1
+        0x7201,  # 0x20C V2 += 1
+        0x1204   # 0x20E jump 0x204
+    ],
+    'arithmetic': [
+        0x6001,  # 0x200 V0 = 1
+        0x6103,  # 0x202 V1 = 3
+        0x8014,  # 0x204 V0 += V1
+        0x8215,  # 0x206 V2 -= V1
+        0x8312,  # 0x208 V3 &= V1
+        0x8313,  # 0x20A V3 ^= V1
+        0x8401,  # 0x20C V4 |= V0
+        0x8506,  # 0x20E V5 = V5 >> 1
+        0x8600,  # 0x210 V6 = V0
+        0x860E,  # 0x212 V6 = V6 << 1
+        0x8617,  # 0x214 V6 = V1 - V6
+        0x7001,  # 0x216 V0 += 1
+        0x1204   # 0x218 jump 0x204
+    ],
+    'calls': [
+        0x2206,  # 0x200 call 0x206
+        0x1200,  # 0x202 jump 0x200
+        0x0000,  # 0x204
+        0x220C,  # 0x206 call 0x20C
+        0x7001,  # 0x208 V0 += 1
+        0x00EE,  # 0x20A return
+        0x7101,  # 0x20C V1 += 1
+        0x00EE   # 0x20E return
+    ],
+    'memory': [
+        0xA300,  # 0x200 I = 0x300
+        0xF755,  # 0x202 store V0-V7 at I
+        0xF765,  # 0x204 load V0-V7 from I
+        0xF033,  # 0x206 BCD of V0 at I
+        0xF01E,  # 0x208 I += V0
+        0x7001,  # 0x20A V0 += 1
+        0x1200   # 0x20C jump 0x200
+    ]
+}
+
+
+def rom_bytes(program):
+    return b''.join(opcode.to_bytes(2, 'big') for opcode in program)
+
+
+def result(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def micro_opcodes(cpu):
+    """
+        Returns a representative opcode for every handler the CPU can
+        dispatch to.
+    """
+    opcodes = [0x00E0, 0x00FD, 0x1300, 0x2300, 0x3012, 0x4012, 0x5010,
+               0x6012, 0x7012, 0x9010, 0xA300, 0xB300, 0xC0FF, 0xD015]
+    opcodes += [0x8010 | low for low in sorted(cpu.logical_operation_lookup)]
+    opcodes += [0xE000 | low for low in sorted(cpu.input_operation_lookup)]
+    opcodes += [0xF700 | low for low in sorted(cpu.other_operation_lookup)]
+    return opcodes
+
+
+def bench_micro(iterations=20000):
+    """
+        Times every handler called straight from its decoded entry, in
+        nanoseconds per call.
+    """
+    cpu = headless.make_machine()
+    cpu.load_fontset()
+    results = {}
+    for opcode in micro_opcodes(cpu):
+        operation = cpu.decode(opcode)
+        cpu.I = 0x300
+        start = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        elapsed = time.perf_counter() - start
+        name = 'micro.{:04X}.{}'.format(
+            opcode, cpu.resolve_handler(opcode).__name__)
+        results[name] = result(elapsed / iterations * 1e9, 'ns', 'lower')
+
+    # 00EE needs something on the stack, so it is timed with its call
+    call = cpu.decode(0x2300)
+    ret = cpu.decode(0x00EE)
+    cpu.stack.clear()
+    cpu.stack_pointer = -1
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call()
+        ret()
+    elapsed = time.perf_counter() - start
+    results['micro.2300+00EE.call_and_return'] = result(
+        elapsed / iterations * 1e9, 'ns', 'lower')
+    return results
+
+
+def bench_macro(frames=3000):
+    """
+        Runs every synthetic ROM on every engine a frame at a time and
+        reports instructions per second and the time a frame takes, and how
+        many times faster than the interpreter the block engine runs a frame.
+    """
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for name, program in sorted(SYNTHETIC_ROMS.items()):
+            path = os.path.join(directory, name + '.ch8')
+            with open(path, 'wb') as rom:
+                rom.write(rom_bytes(program))
+            medians = {}
+            for engine in sorted(headless.ENGINES):
+                cpu = headless.make_machine(path, engine)
+                cpu.rng.seed(0)
+                cpu.run_ticks(10)  # Warm up the caches
+                times = []
+                for _ in range(frames):
+                    start = time.perf_counter()
+                    cpu.run_ticks(1)
+                    times.append(time.perf_counter() - start)
+                total = sum(times)
+                times.sort()
+                key = 'macro.{}.{}'.format(name, engine)
+                results[key + '.ips'] = result(
+                    frames * cpu.cycles_per_tick / total, 'instr/s', 'higher')
+                results[key + '.frame_mean'] = result(
+                    total / frames * 1e6, 'us', 'lower')
+                results[key + '.frame_p99'] = result(
+                    times[int(frames * 0.99)] * 1e6, 'us', 'lower')
+                medians[engine] = times[frames // 2]
+            # The median, a few slow frames from the machine skew the mean
+            results['macro.{}.block_speedup'.format(name)] = result(
+                medians['interpreter'] / medians['block'], 'x', 'higher')
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return results
+
+
+def bench_render(iterations=500):
+    """
+        Times Display.update_display on a dummy video driver, redrawing the
+        whole screen and redrawing after a single sprite.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame
+    except ImportError:
+        return {}
+    from display import Display
+    pygame.display.init()
+    pygame.font.init()
+    try:
+        display = Display(headless.WIDTH, headless.HEIGHT, 10)
+        display.display_setup()
+        rng = random.Random(0)
+        display.load_rows(
+            rng.getrandbits(display.width) for _ in range(display.height))
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            display.dirty_rows = display.all_rows
+            display.update_display()
+        full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            display.draw_sprite(i % 60, i % 27, [0xF0, 0x90, 0x90, 0x90, 0xF0])
+            display.update_display()
+        sprite = time.perf_counter() - start
+
+        # The -d register overlay, where a frame changes pc and a register
+        display = Display(headless.WIDTH, headless.HEIGHT, 10, debug=True)
+        display.display_setup()
+        registers = [0] * 16
+        start = time.perf_counter()
+        for i in range(iterations):
+            registers[i % 16] = i & 0xFF
+            display.draw_registers(registers, 0x200 + i % 64 * 2, 0x300, i)
+            display.flip()
+        overlay = time.perf_counter() - start
+    finally:
+        pygame.display.quit()
+    return {
+        'render.full_screen': result(full / iterations * 1e6, 'us', 'lower'),
+        'render.one_sprite': result(sprite / iterations * 1e6, 'us', 'lower'),
+        'render.debug_overlay': result(
+            overlay / iterations * 1e6, 'us', 'lower')
+    }
+
+
+def bench_vector(machines=1000, instructions=300):
+    """
+        Runs every synthetic ROM on many machines at once with VectorCPU and
+        reports the instructions per second summed over all of them.
+    """
+    try:
+        from vector import VectorCPU
+    except ImportError:
+        return {}
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for name, program in sorted(SYNTHETIC_ROMS.items()):
+            path = os.path.join(directory, name + '.ch8')
+            with open(path, 'wb') as rom:
+                rom.write(rom_bytes(program))
+            vector = VectorCPU(machines, path, range(machines))
+            start = time.perf_counter()
+            vector.run_cycles(instructions)
+            elapsed = time.perf_counter() - start
+            results['vector.{}.ips'.format(name)] = result(
+                machines * instructions / elapsed, 'instr/s', 'higher')
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return results
+
+
+def bench_startup(runs=5):
+    """
+        Times starting main.py on a dummy video and audio driver and running
+        a single frame, in milliseconds. The fastest run counts, the others
+        are noise from the machine.
+    """
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    environment = dict(os.environ, SDL_VIDEODRIVER='dummy',
+                       SDL_AUDIODRIVER='dummy')
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'draw.ch8')
+    try:
+        with open(path, 'wb') as rom:
+            rom.write(rom_bytes(SYNTHETIC_ROMS['draw']))
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, main, path, '--frames', '1', '--turbo'],
+                env=environment, cwd=directory, check=True,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+    except (OSError, subprocess.CalledProcessError):
+        return {}  # No pygame
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return {'startup.main': result(min(times) * 1000, 'ms', 'lower')}
+
+
+SUITES = {'micro': bench_micro, 'macro': bench_macro, 'render': bench_render,
+          'vector': bench_vector, 'startup': bench_startup}
+
+
+def compare(results, baseline, tolerance):
+    """
+        Returns the (name, baseline, value, change) of every result that got
+        worse than the baseline by more than tolerance (0.1 is 10%).
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None or not previous['value']:
+            continue
+        change = current['value'] / previous['value'] - 1
+        if current['better'] == 'higher':
+            change = -change
+        if change > tolerance:
+            regressions.append(
+                (name, previous['value'], current['value'], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmarks the emulator")
+    parser.add_argument(
+        "--suite",
+        help="runs only these suites",
+        dest="suites",
+        choices=sorted(SUITES),
+        action="append")
+    parser.add_argument(
+        "-o",
+        help="where the results get written, defaults to stdout",
+        dest="output",
+        type=str)
+    parser.add_argument(
+        "--baseline",
+        help="compares the results against a saved run",
+        dest="baseline",
+        type=str)
+    parser.add_argument(
+        "--save-baseline",
+        help="saves the results as the baseline",
+        dest="save_baseline",
+        type=str)
+    parser.add_argument(
+        "--tolerance",
+        help="how much slower than the baseline is still fine, default 0.1",
+        dest="tolerance",
+        type=float,
+        default=0.1)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for suite in args.suites or sorted(SUITES):
+        results.update(SUITES[suite]())
+
+    text = json.dumps(results, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        sys.stdout.write(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            file.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, change in regressions:
+            sys.stderr.write("{} got {:.0%} worse: {:.2f} -> {:.2f}\n".format(
+                name, change, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
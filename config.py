@@ -17,7 +17,22 @@ keys = {
         0xF: 'v'
 }
 
-timers_delay = 17
+# Instructions executed between two 60 Hz timer ticks
+cycles_per_tick = 10
+
+# Runs common instruction sequences as a single handler
+fusion = True
+
+# Skips busy-wait loops on the delay timer or the keypad up to the next tick
+idle_skip = True
+
+# Seconds of history kept for rewinding, 0 turns it off
+rewind_seconds = 10
+
+# The beep is a square wave
+beep_frequency = 440
+beep_volume = 0.2
+sample_rate = 44100
 
 shift_quirk = False
 load_quirk = False
@@ -1,20 +1,36 @@
 from collections import deque
+import functools
 import logging
 import bit_utils
 import math
 import random
-import pygame
+import struct
 import config
+from backends import NullKeypad, NullAudio
 
-pygame.init()
-bleep = pygame.mixer.Sound('bleep.wav')
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
-fh = logging.FileHandler('last.log', mode='w')
-fh.setLevel(logging.INFO)
-logger.addHandler(fh)
+# Save states: the fixed header, then the memory, the framebuffer rows and
+# the state of the random number generator
+STATE_MAGIC = b'C8SS'
+STATE_VERSION = 2
+# magic, version, pc, I, delay timer, sound timer, stack pointer, stack depth,
+# exited, cycles, next tick, cycles per tick, registers, stack, memory size,
+# screen height. The stack pointer keeps counting past the 16 entries of the
+# stack, 8xy5, 8xy7 and 8xyE don't wrap the registers and the timers can be
+# set from them, so all of those get signed 64 bit fields like VectorCPU
+STATE_HEADER = struct.Struct('<4sBHIqqqB?QQI16q16HHB')
+# What a register wider than 64 bits gets wrapped to when it's saved
+INT64 = 1 << 64
+# Mersenne Twister state, version, key and position, gauss_next when set
+STATE_RNG = struct.Struct('<B625I?d')
+
+# The longest idiom fuse_at recognises, in instructions
+MAX_FUSED_LENGTH = 3
+FUSED_IDIOMS = ('load_store', 'sprite_setup', 'loop_counter', 'zero_register')
+# The longest busy-wait loop idle_loop_at recognises, in instructions
+MAX_IDLE_LENGTH = 4
 
 
 class UnknownOpcodeException(Exception):
@@ -24,22 +40,84 @@ class UnknownOpcodeException(Exception):
         logger.error("The opcode isn't valid {}".format(hex(opcode)))
 
 
+# How to pull every operand a handler can ask for out of an opcode
+OPCODE_FIELDS = {
+    'x': lambda opcode: (opcode & 0x0F00) >> 8,
+    'y': lambda opcode: (opcode & 0x00F0) >> 4,
+    'n': lambda opcode: opcode & 0x000F,
+    'kk': lambda opcode: opcode & 0x00FF,
+    'nnn': lambda opcode: opcode & 0x0FFF
+}
+
+
+def extract_fields(opcode, fields):
+    """
+        Returns a tuple with the requested fields of an opcode.
+
+        >>> extract_fields(0x8231, ('x', 'y'))
+        (2, 3)
+    """
+    return tuple(OPCODE_FIELDS[field](opcode) for field in fields)
+
+
+def operands(*fields):
+    """
+        Declares which opcode fields a handler takes as arguments. The decoder
+        extracts them once per address, calling the handler without arguments
+        extracts them from self.opcode like before.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(self, *args):
+            if not args:
+                args = extract_fields(self.opcode, fields)
+            return handler(self, *args)
+        wrapper.fields = fields
+        return wrapper
+    return decorator
+
+
 class CPU:
-    def __init__(self, ram, display):
+    def __init__(self, ram, display, keypad=None, audio=None):
         self.registers = [0] * 16  # The CHIP8 has 16 registers
         self.ram = ram
         self.memory = ram.memory
         self.fontset = ram.fontset
         self.display = display
+        self.keypad = keypad if keypad is not None else NullKeypad()
+        self.audio = audio if audio is not None else NullAudio()
         self.offset = ram.offset
         self.I = 0  # Adress register
         self.pc = 0  # Currently executing address
         self.delay_timer = 0  # 8-bit timer register
         self.sound_timer = 0  # When this isn't zero there should be a beep
+        self.sound_playing = False
         # The chip8 supports 16 levels of nested subroutines
         self.stack = deque(maxlen=16)
         self.stack_pointer = -1  # Points to the top-level stack instruction
         self.opcode = 0
+        self.exited = False  # Set by 00FD
+        # Set by Fx0A when there's no key, the rest of run_cycles is idle
+        self.waiting_for_key = False
+        # The timers tick every cycles_per_tick executed instructions
+        self.cycles = 0
+        self.cycles_per_tick = config.cycles_per_tick
+        self.next_tick = self.cycles_per_tick
+        # Cxkk draws from here, seed it for reproducible runs
+        self.rng = random.Random()
+        # Decoded (opcode, operation) pairs indexed by address
+        self.decode_cache = [None] * len(self.memory)
+        # What run_instructions runs at every address, the decode cache
+        # entries with common idioms fused into a single operation
+        self.fusion = config.fusion
+        self.fused = [None] * len(self.memory)
+        # Instructions executed by the fused handlers, by idiom
+        self.fusion_counts = dict.fromkeys(FUSED_IDIOMS, 0)
+        # Busy-wait loops by the addresses they run through, see
+        # match_idle_loop. False elsewhere and None where not looked at
+        self.idle_skip = config.idle_skip
+        self.idle_loops = [None] * len(self.memory)
+        self.idle_instructions = 0  # Skipped so far
 
         # Opcode lookup table decyphered by looking at the first byte
 
@@ -87,50 +165,546 @@ class CPU:
             0x0A: self.wait_for_keypress
         }
 
+        # Opcodes starting with 0 are matched whole, anything else is 0nnn
+        self.zero_operation_lookup = {
+            0x00E0: self.clear_screen,
+            0x00EE: self.ret_from_subroutine,
+            0x00FD: self.exit_interpreter
+        }
+
+        self.input_operation_lookup = {
+            0x9E: self.skip_if_key_pressed,
+            0xA1: self.skip_if_key_not_pressed
+        }
+
     def load_fontset(self):
-        for i, (_, _) in enumerate(zip(self.memory, self.fontset)):
-                self.memory[i] = self.fontset[i]
+        self.memory[:len(self.fontset)] = bytes(self.fontset)
+        self.invalidate_code(0, len(self.fontset))
 
     def load_rom(self, filename):
-        cart = open(filename, 'rb')
-        rom = cart.read()
-        i = 0
-        while i < len(rom):
-            self.memory[i + self.offset] = rom[i]
-            i += 1
-        cart.close()
+        """
+            Reads the rom straight into memory at the offset.
+        """
+        with open(filename, 'rb') as cart:
+            size = cart.readinto(memoryview(self.memory)[self.offset:])
+            if cart.read(1):
+                raise ValueError("{} doesn't fit in memory".format(filename))
+        self.invalidate_code(self.offset, size)
+
+    def memory_at_I(self, length):
+        """
+            Returns the slice of memory starting at I that is length bytes
+            long, raises IndexError when it runs past the end of memory.
+        """
+        end = self.I + length
+        if end > len(self.memory):
+            raise IndexError("{} is past the end of memory".format(hex(end)))
+        return slice(self.I, end)
+
+    def register_bytes(self, count):
+        """
+            Returns V0 to Vcount-1 as bytes, memory is 8 bits so registers
+            that overflowed get wrapped.
+        """
+        registers = self.registers[:count]
+        try:
+            return bytes(registers)
+        except ValueError:
+            return bytes(value & 0xFF for value in registers)
+
+    def invalidate_code(self, address, length=1):
+        """
+            Drops the decoded instructions overlapping memory[address:address +
+            length]. Has to be called after anything writes to memory, an
+            instruction starting one byte earlier also covers address.
+        """
+        start = max(address - 1, 0)
+        end = min(address + length, len(self.decode_cache))
+        if start < end:
+            self.decode_cache[start:end] = [None] * (end - start)
+        # A fused idiom starting a few instructions earlier covers it too
+        start = max(address - MAX_FUSED_LENGTH * 2 + 1, 0)
+        if start < end:
+            self.fused[start:end] = [None] * (end - start)
+        # And so does an idle loop running through any address around it
+        start = max(address - MAX_IDLE_LENGTH * 2 + 1, 0)
+        end = min(address + length + MAX_IDLE_LENGTH * 2 - 1,
+                  len(self.idle_loops))
+        if start < end:
+            self.idle_loops[start:end] = [None] * (end - start)
 
     def dump_memory(self, path):
         """
             Dumps the cpu memory into a file
         """
         with open(path, 'wb') as file:
-            for byte in self.memory:
-                file.write(bytes([byte]))
+            file.write(self.memory)
         logger.info("Dumped memory into {}".format(path))
 
+    def save_state(self):
+        """
+            Returns the whole machine state as bytes: memory, registers, I,
+            pc, stack, timers, the clock, the screen and the random number
+            generator. Every state of the same machine has the same size.
+        """
+        stack = list(self.stack)
+        memory = self.memory
+        rows = self.display.rows
+        version, internal, gauss_next = self.rng.getstate()
+        return b''.join((
+            self.pack_header(stack, len(memory), len(rows)),
+            memory,
+            struct.pack('<{}Q'.format(len(rows)), *rows),
+            STATE_RNG.pack(
+                version,
+                *internal,
+                gauss_next is not None,
+                gauss_next or 0.0)))
+
+    def pack_header(self, stack, memory_size, height):
+        fields = [STATE_MAGIC, STATE_VERSION, self.pc, self.I,
+                  self.delay_timer, self.sound_timer, self.stack_pointer,
+                  len(stack), self.exited, self.cycles, self.next_tick,
+                  self.cycles_per_tick]
+        fields += self.registers
+        fields += stack + [0] * (16 - len(stack))
+        try:
+            return STATE_HEADER.pack(*fields, memory_size, height)
+        except struct.error:
+            # A register shifted past 64 bits, keep the low 64 like VectorCPU
+            for index in (4, 5) + tuple(range(12, 28)):
+                value = fields[index] % INT64
+                fields[index] = value - INT64 if value >> 63 else value
+            return STATE_HEADER.pack(*fields, memory_size, height)
+
+    def load_state(self, data):
+        """
+            Restores a state returned by save_state.
+        """
+        header = STATE_HEADER.unpack_from(data)
+        (magic, version, self.pc, self.I, self.delay_timer, self.sound_timer,
+         self.stack_pointer, depth, self.exited, self.cycles, self.next_tick,
+         self.cycles_per_tick) = header[:12]
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError("Not a save state")
+        registers = header[12:28]
+        stack = header[28:28 + depth]
+        memory_size, height = header[44:]
+        if memory_size != len(self.memory):
+            raise ValueError("The save state has {} bytes of memory".format(
+                memory_size))
+
+        offset = STATE_HEADER.size
+        memoryview(self.memory)[:] = data[offset:offset + memory_size]
+        offset += memory_size
+        self.display.load_rows(struct.unpack_from(
+            '<{}Q'.format(height), data, offset))
+        offset += height * 8
+        rng = STATE_RNG.unpack_from(data, offset)
+        self.rng.setstate((rng[0], rng[1:626], rng[627] if rng[626] else None))
+
+        self.registers[:] = registers
+        self.stack.clear()
+        self.stack.extend(stack)
+        self.invalidate_code(0, len(self.memory))
+
     def fetch_opcode(self):
         self.opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
 
     def decode_opcode(self):
+        self.resolve_handler(self.opcode)()
+
+    def resolve_handler(self, opcode):
+        """
+            Returns the handler that executes opcode without running it.
+        """
+        handler = self.lookup_handler(opcode)
+        if handler is None:
+            raise UnknownOpcodeException(opcode)
+        return handler
+
+    def lookup_handler(self, opcode):
+        """
+            Same as resolve_handler but returns None for unknown opcodes.
+        """
         # This makes sure I get only the first byte
-        operation = (self.opcode & 0xF000) >> 12
-        try:
-            self.operation_lookup[operation]()
-        except KeyError:
-            raise UnknownOpcodeException(self.opcode)
+        operation = (opcode & 0xF000) >> 12
+        if operation == 0x0:
+            return self.zero_operation_lookup.get(opcode, self.ignore_opcode)
+        elif operation == 0x8:
+            return self.logical_operation_lookup.get(opcode & 0xF)
+        elif operation == 0xE:
+            return self.input_operation_lookup.get(
+                opcode & 0xFF, self.ignore_opcode)
+        elif operation == 0xF:
+            return self.other_operation_lookup.get(opcode & 0xFF)
+        return self.operation_lookup.get(operation)
+
+    def decode(self, opcode):
+        """
+            Returns a callable that executes opcode, with its operands already
+            extracted.
+        """
+        handler = self.resolve_handler(opcode)
+        fields = getattr(handler, 'fields', None)
+        if not fields:
+            return handler
+        return functools.partial(
+            handler.__func__.__wrapped__,
+            self,
+            *extract_fields(opcode, fields))
+
+    def decode_at(self, address):
+        """
+            Decodes the instruction at address and stores it in the decode
+            cache.
+        """
+        self.opcode = self.memory[address] << 8 | self.memory[address + 1]
+        entry = (self.opcode, self.decode(self.opcode))
+        self.decode_cache[address] = entry
+        return entry
+
+    def warm_up(self, analysis):
+        """
+            Decodes the instructions a static analysis found before they
+            run, see analyzer.py.
+        """
+        opcode = self.opcode
+        unknown = {address for address, _ in analysis.unknown}
+        for address in analysis.code:
+            if address not in unknown and self.decode_cache[address] is None:
+                self.decode_at(address)
+        self.opcode = opcode
+
+    def fuse_at(self, address):
+        """
+            Stores what run_instructions runs at address in the fused table,
+            the decode cache entry or an idiom fused into one operation.
+            Fused operations return how many instructions they executed and
+            leave the last increment of pc to the caller like the others.
+        """
+        entry = None
+        end = address + MAX_FUSED_LENGTH * 2
+        if end <= len(self.memory):
+            opcodes = [self.memory[at] << 8 | self.memory[at + 1]
+                       for at in range(address, end, 2)]
+            for fuse in (self.fuse_load_store, self.fuse_sprite_setup,
+                         self.fuse_loop_counter, self.fuse_zero_register):
+                operation = fuse(*opcodes)
+                if operation is not None:
+                    entry = (opcodes[0], operation)
+                    break
+        if entry is None:
+            entry = self.decode_cache[address] or self.decode_at(address)
+        self.fused[address] = entry
+        return entry
+
+    def fuse_load_store(self, first, second, third):
+        """
+            Annn followed by Fx55 or Fx65.
+        """
+        if first >> 12 != 0xA or second & 0xF0FF not in (0xF055, 0xF065):
+            return None
+        address = first & 0xFFF
+        operation = self.decode(second)
+        counts = self.fusion_counts
+
+        def load_store():
+            self.I = address
+            self.pc += 2
+            self.opcode = second
+            operation()
+            counts['load_store'] += 2
+            return 2
+        return load_store
+
+    def fuse_sprite_setup(self, first, second, third):
+        """
+            6xkk and 6ykk followed by Dxyn.
+        """
+        if first >> 12 != 0x6 or second >> 12 != 0x6 or third >> 12 != 0xD:
+            return None
+        register_x, value_x = extract_fields(first, ('x', 'kk'))
+        register_y, value_y = extract_fields(second, ('x', 'kk'))
+        draw = self.decode(third)
+        counts = self.fusion_counts
+
+        def sprite_setup():
+            self.registers[register_x] = value_x
+            self.registers[register_y] = value_y
+            self.pc += 4
+            self.opcode = third
+            draw()
+            counts['sprite_setup'] += 3
+            return 3
+        return sprite_setup
+
+    def fuse_loop_counter(self, first, second, third):
+        """
+            7xkk, then 3xkk or 4xkk on the same register, then 1nnn.
+        """
+        if first >> 12 != 0x7 or second >> 12 not in (0x3, 0x4) \
+                or third >> 12 != 0x1 or (first ^ second) & 0x0F00:
+            return None
+        register, step = extract_fields(first, ('x', 'kk'))
+        limit = second & 0xFF
+        skip_if_equal = second >> 12 == 0x3
+        address = third & 0xFFF
+        counts = self.fusion_counts
+
+        def loop_counter():
+            registers = self.registers
+            value = registers[register] + step
+            if value > 0xFF:
+                value = bit_utils.wrap_around(value, 0xFF + 1)
+            registers[register] = value
+            if (value == limit) == skip_if_equal:
+                # The jump gets skipped
+                self.opcode = second
+                self.pc += 4
+                counts['loop_counter'] += 2
+                return 2
+            self.opcode = third
+            self.pc = address - 2
+            counts['loop_counter'] += 3
+            return 3
+        return loop_counter
+
+    def fuse_zero_register(self, first, second, third):
+        """
+            8xx3, which XORs a register with itself.
+        """
+        if first & 0xF00F != 0x8003 or (first >> 8 ^ first >> 4) & 0xF:
+            return None
+        register = (first & 0x0F00) >> 8
+        counts = self.fusion_counts
+
+        def zero_register():
+            self.registers[register] = 0
+            counts['zero_register'] += 1
+            return 1
+        return zero_register
+
+    def fusion_report(self):
+        """
+            Returns how many of the executed instructions ran fused, in
+            total and by idiom.
+        """
+        fused = sum(self.fusion_counts.values())
+        return {
+            'instructions': self.cycles,
+            'fused': fused,
+            'hit_rate': fused / self.cycles if self.cycles else 0.0,
+            'idioms': dict(self.fusion_counts)
+        }
+
+    def idle_loop_at(self, address):
+        """
+            Stores the busy-wait loop address is part of, if any, in the idle
+            loop table. These are loops that only poll the delay timer or the
+            keypad, so they go round the same way till the timers tick or
+            the keys change:
+
+                Fx07, 3xkk or 4xkk, (1nnn out,) 1nnn back
+                Ex9E or ExA1, (1nnn out,) 1nnn back
+        """
+        entry = False
+        for start in range(address, address - MAX_IDLE_LENGTH * 2, -2):
+            loop = self.match_idle_loop(start)
+            if loop is not None and address in loop[0]:
+                entry = loop
+                break
+        self.idle_loops[address] = entry
+        return entry
+
+    def match_idle_loop(self, start):
+        """
+            Returns (addresses in the order they run, index of the test,
+            register Fx07 sets, whether the test sends it round again) for a
+            busy-wait loop starting at start.
+        """
+        if start < 0 or start + MAX_IDLE_LENGTH * 2 > len(self.memory):
+            return None
+        memory = self.memory
+
+        def opcode_at(address):
+            return memory[address] << 8 | memory[address + 1]
+
+        first = opcode_at(start)
+        register = (first & 0x0F00) >> 8
+        if first & 0xF0FF == 0xF007:
+            test = opcode_at(start + 2)
+            if test >> 12 not in (0x3, 0x4) \
+                    or (test & 0x0F00) >> 8 != register:
+                return None
+            value = test & 0xFF
+            skip_if_equal = test >> 12 == 0x3
+            timer_register = register
+
+            def skips():
+                return (self.registers[timer_register] == value) \
+                    == skip_if_equal
+            test = 1
+        elif first & 0xF0FF in (0xE09E, 0xE0A1):
+            key_register = register
+            skip_if_pressed = first & 0xFF == 0x9E
+
+            def skips():
+                return self.keypad.is_pressed(
+                    self.registers[key_register]) == skip_if_pressed
+            register = None
+            test = 0
+        else:
+            return None
+
+        jump = start + test * 2 + 2
+        back = 0x1000 | start
+        if opcode_at(jump) == back:
+            # Goes round unless the test skips the jump back
+            def goes_round():
+                return not skips()
+            path = list(range(start, jump + 2, 2))
+        elif opcode_at(jump) >> 12 == 0x1 and opcode_at(jump + 2) == back:
+            # The test skips the jump out
+            goes_round = skips
+            path = list(range(start, jump, 2)) + [jump + 2]
+        else:
+            return None
+        return (path, test, register, goes_round)
+
+    def skip_idle_loop(self, stop):
+        """
+            If pc is in a busy-wait loop, moves it along the loop without
+            running it till stop or till the test would leave the loop.
+            Nothing the loop reads changes before stop, the timers tick and
+            the keys change after it, so the state ends up the same as if it
+            had run.
+        """
+        entry = self.idle_loops[self.pc]
+        if entry is None:
+            entry = self.idle_loop_at(self.pc)
+        if not entry:
+            return
+        path, test, register, goes_round = entry
+        length = len(path)
+        position = path.index(self.pc)
+        budget = stop - self.cycles
+        done = 0
+        while done < budget:
+            if position == 0:
+                if register is not None:
+                    # Fx07, which the test reads
+                    self.registers[register] = self.delay_timer
+                if not goes_round():
+                    break
+                # Every iteration from here on goes the same way
+                position = (budget - done) % length
+                done = budget
+                break
+            if position == test and not goes_round():
+                break
+            position = (position + 1) % length
+            done += 1
+        if done:
+            self.cycles += done
+            self.idle_instructions += done
+            self.pc = path[position]
+            last = path[position - 1]
+            self.opcode = self.memory[last] << 8 | self.memory[last + 1]
 
     def update_timers(self):
         if (self.delay_timer > 0):
             self.delay_timer -= 1
-        if (self.sound_timer > 0):
+        playing = self.sound_timer > 0
+        if playing:
             self.sound_timer -= 1
-            bleep.play()
+        # The tone keeps playing by itself, only the edges reach the backend
+        if playing != self.sound_playing:
+            self.sound_playing = playing
+            if playing:
+                self.audio.start()
+            else:
+                self.audio.stop()
+
+    def run_cycles(self, count):
+        """
+            Executes count instructions and ticks the timers every
+            cycles_per_tick of them. Returns how many were executed.
+        """
+        end = self.cycles + count
+        self.waiting_for_key = False
+        while self.cycles < end:
+            stop = min(end, self.next_tick)
+            if self.waiting_for_key:
+                # The keypad only changes between calls, so Fx0A would keep
+                # running on its own till then
+                self.cycles = stop
+            else:
+                if self.idle_skip:
+                    self.skip_idle_loop(stop)
+                if self.cycles < stop:
+                    self.cycles += self.run_instructions(stop - self.cycles)
+            if self.cycles >= self.next_tick:
+                self.update_timers()
+                self.next_tick += self.cycles_per_tick
+        return count
+
+    def run_ticks(self, ticks):
+        """
+            Runs until the timers ticked ticks times, which is as long as
+            ticks 60 Hz frames. Returns how many instructions were executed.
+        """
+        if ticks <= 0:
+            return 0
+        return self.run_cycles(
+            self.next_tick - self.cycles
+            + (ticks - 1) * self.cycles_per_tick)
+
+    def run_instructions(self, count):
+        """
+            Executes count instructions without ticking the timers. Fused
+            idioms only run while all of their instructions fit in count, so
+            the timers tick at the same instruction either way.
+        """
+        if not self.fusion:
+            return self.interpret_instructions(count)
+        fused = self.fused
+        fuse_at = self.fuse_at
+        executed = 0
+        limit = count - MAX_FUSED_LENGTH + 1
+        # run_cycle inlined, this is the hot loop of the interpreter
+        while executed < limit:
+            entry = fused[self.pc]
+            if entry is None:
+                entry = fuse_at(self.pc)
+            self.opcode, operation = entry
+            executed += operation() or 1
+            self.pc += 2
+        return executed + self.interpret_instructions(count - executed)
+
+    def interpret_instructions(self, count):
+        """
+            Same as run_instructions one instruction at a time, through
+            run_cycle.
+        """
+        run_cycle = self.run_cycle
+        executed = 0
+        while executed < count:
+            executed += run_cycle()
+        return executed
 
     def run_cycle(self):
-        self.fetch_opcode()
-        self.decode_opcode()
+        """
+            Executes the instruction at pc and returns how many instructions
+            were executed.
+        """
+        entry = self.decode_cache[self.pc]
+        if entry is None:
+            entry = self.decode_at(self.pc)
+        self.opcode, operation = entry
+        operation()
         self.pc += 2
+        return 1
 
     def initalize_cpu(self, filename):
         self.load_fontset()
@@ -146,6 +720,9 @@ class CPU:
         self.sound_timer = 0
         self.stack = deque(maxlen=16)
         self.stack_pointer = -1
+        self.exited = False
+        self.cycles = 0
+        self.next_tick = self.cycles_per_tick
         self.display.clear_display()
         self.load_rom(rom)
 
@@ -172,21 +749,43 @@ class CPU:
             00E0 - Clear the display
             00EE - Return from a subroutine.
         """
-        if self.opcode == 0x00E0:
-            self.display.clear_display()
-            logger.info("Cleared display")
-        elif self.opcode == 0x00EE:
-            logger.info("Returned from subroutine at {}".format(hex(self.pc)))
-            self.pc = self.stack[self.stack_pointer]
-            self.stack.pop()
-            self.stack_pointer -= 1
-            logger.info("to address at {}".format(hex(self.pc)))
+        self.zero_operation_lookup.get(self.opcode, self.ignore_opcode)()
+
+    def ignore_opcode(self):
+        """
+            0nnn - Jump to a machine code routine at nnn.
+            This instruction is only used on the old computers on which Chip-8
+            was originally implemented. It is ignored by modern interpreters.
+        """
+
+    def clear_screen(self):
+        """
+            00E0 - Clear the display.
+        """
+        self.display.clear_display()
+
+    def ret_from_subroutine(self):
+        """
+            00EE - Return from a subroutine.
+            The interpreter sets the program counter to the address at the top
+            of the stack, then subtracts 1 from the stack pointer.
+        """
+        self.pc = self.stack[self.stack_pointer]
+        self.stack.pop()
+        self.stack_pointer -= 1
+
+    def exit_interpreter(self):
+        """
+            00FD - Exit the interpreter (SUPER-CHIP).
+            The program stays on this instruction, whoever runs the CPU stops
+            when exited is set.
+        """
+        self.exited = True
+        self.pc -= 2
 
     def input_handler(self):
-        if self.opcode & 0xFF == 0xA1:
-            self.skip_if_key_not_pressed()
-        elif self.opcode & 0xFF == 0x9E:
-            self.skip_if_key_pressed()
+        self.input_operation_lookup.get(
+            self.opcode & 0xFF, self.ignore_opcode)()
 
     def logical_operations(self):
         operation = self.opcode & 0xF
@@ -202,17 +801,18 @@ class CPU:
         except KeyError:
             raise UnknownOpcodeException(self.opcode)
 
-    def jmp_to_addr(self):
+    @operands('nnn')
+    def jmp_to_addr(self, address):
         """
             1nnn - Jump to location nnn.
             The interpreter sets the program counter to nnn.
         """
-        self.pc = self.opcode & 0x0FFF
-        logger.info("Jumped to address at {}".format(hex(self.pc)))
+        self.pc = address
         # PC gets incremented after every instruction this counteracts that
         self.pc -= 2
 
-    def call_subroutine(self):
+    @operands('nnn')
+    def call_subroutine(self, address):
         """0x2nnn:
             The interpreter increments the stack pointer, then puts the current
             PC on the top of the stack. The PC is then set to nnn.
@@ -220,91 +820,68 @@ class CPU:
         # Might be an issue didn't test it yet.
         self.stack_pointer += 1
         self.stack.append(self.pc)
-        self.pc = (self.opcode & 0x0FFF) - 2
-        logger.info("Called subroutine at {}".format(hex(self.pc)))
+        self.pc = address - 2
 
-    def branch_if_equal_val(self):
+    @operands('x', 'kk')
+    def branch_if_equal_val(self, register, value):
         """
             3xkk -  Skip next instruction if Vx = kk.
             The interpreter compares register Vx to kk, and if they are equal,
             increments the program counter by 2.
         """
-        register = (self.opcode & 0x0F00) >> 8
-        value = self.opcode & 0xFF
         if self.registers[register] == value:
             self.pc += 2
-            logger.info("Skipped {} because V{} and {} are equal".format(
-                hex(self.pc - 2),
-                register,
-                value))
 
-    def branch_if_not_equal_val(self):
+    @operands('x', 'kk')
+    def branch_if_not_equal_val(self, register, value):
         """
             4xkk - Skip next instruction if Vx != kk.
             The interpreter compares register Vx to kk, and if they are not
             equal, increments the program counter by 2.
         """
-        register = (self.opcode & 0x0F00) >> 8
-        value = self.opcode & 0xFF
         if self.registers[register] != value:
             self.pc += 2
-            logger.info(
-                "Didn't skip {} because V{} and {} are not equal".format(
-                    hex(self.pc - 2),
-                    register,
-                    value))
 
-    def branch_if_equal_reg(self):
+    @operands('x', 'y')
+    def branch_if_equal_reg(self, register_x, register_y):
         """
             5xy0 - Skip next instruction if Vx = Vy.
             The interpreter compares register Vx to register Vy, and if they
             are equal, increments the program counter by 2.
         """
-        registers = self.return_middle_registers(self.opcode)
-
-        if self.registers[registers[0]] == self.registers[registers[1]]:
+        if self.registers[register_x] == self.registers[register_y]:
             self.pc += 2
-            logger.info(
-              "Skipped {} because register V{} and V{} are equal to {}".format(
-                 hex(self.pc - 2),
-                 registers[0],
-                 registers[1],
-                 self.registers[registers[0]]))
 
-    def set_reg_to_val(self):
+    @operands('x', 'kk')
+    def set_reg_to_val(self, register, value):
         """
             6xkk - Set Vx = kk.
             The interpreter puts the value kk into register Vx.
         """
-        register = (self.opcode & 0x0F00) >> 8
-        value = self.opcode & 0x00FF
         self.registers[register] = value
-        logger.info("Set register V{} to {}".format(register, value))
 
-    def add_to_reg(self):
+    @operands('x', 'kk')
+    def add_to_reg(self, register, value):
         """
            7xkk - Set Vx = Vx + kk.
            Adds the value kk to the value of register Vx, then stores the
            result in Vx.
         """
-        register = (self.opcode & 0xF00) >> 8
-        value = self.opcode & 0xFF
         sum = self.registers[register] + value
         if sum > 0xFF:
             sum = bit_utils.wrap_around(sum, 0xFF + 1)
         self.registers[register] = sum
-        logger.info("Added {} to register V{}".format(value, register))
 
-    def set_reg_to_reg(self):
+    @operands('x', 'y')
+    def set_reg_to_reg(self, register_x, register_y):
         """
             8xy0 - Set Vx = Vy.
             Stores the value of register Vy in register Vx.
         """
-        register = self.return_middle_registers(self.opcode)
-        self.registers[register[0]] = self.registers[register[1]]
-        logger.info("Set register V{} to V{}".format(register[0], register[1]))
+        self.registers[register_x] = self.registers[register_y]
 
-    def bitwise_or(self):
+    @operands('x', 'y')
+    def bitwise_or(self, register_x, register_y):
         """
             8xy1 - Set Vx = Vx OR Vy.
             Performs a bitwise OR on the values of Vx and Vy, then stores the
@@ -312,15 +889,11 @@ class CPU:
             values, and if either bit is 1, then the same bit in the result is
             also 1. Otherwise, it is 0.
         """
-        register = self.return_middle_registers(self.opcode)
-        self.registers[register[0]] = (
-            self.registers[register[0]] | self.registers[register[1]])
-        logger.info("Bitwise OR on V{} and V{} for {}".format(
-            register[0],
-            register[1],
-            self.registers[register[0]]))
+        self.registers[register_x] = (
+            self.registers[register_x] | self.registers[register_y])
 
-    def bitwise_and(self):
+    @operands('x', 'y')
+    def bitwise_and(self, register_x, register_y):
         """
             8xy2 - Set Vx = Vx AND Vy.
             Performs a bitwise AND on the values of Vx and Vy, then stores the
@@ -328,15 +901,11 @@ class CPU:
             two values, and if both bits are 1, then the same bit in the result
             is also 1. Otherwise, it is 0.
         """
-        register = self.return_middle_registers(self.opcode)
-        self.registers[register[0]] = (
-            self.registers[register[0]] & self.registers[register[1]])
-        logger.info("Bitwise AND on V{} and V{} for {}".format(
-            register[0],
-            register[1],
-            self.registers[register[0]]))
+        self.registers[register_x] = (
+            self.registers[register_x] & self.registers[register_y])
 
-    def bitwise_xor(self):
+    @operands('x', 'y')
+    def bitwise_xor(self, register_x, register_y):
         """
             8xy3 - Set Vx = Vx XOR Vy.
             Performs a bitwise exclusive OR on the values of Vx and Vy, then
@@ -344,57 +913,45 @@ class CPU:
             bits from two values, and if the bits are not both the same, then
             the corresponding bit in the result is set to 1. Otherwise, it is 0
         """
-        register = self.return_middle_registers(self.opcode)
-        self.registers[register[0]] = (
-            self.registers[register[0]] ^ self.registers[register[1]])
-        logger.info("Bitwise XOR on V{} and V{} for {}".format(
-            register[0],
-            register[1],
-            self.registers[register[0]]))
+        self.registers[register_x] = (
+            self.registers[register_x] ^ self.registers[register_y])
 
-    def add_reg_to_reg(self):
+    @operands('x', 'y')
+    def add_reg_to_reg(self, register_x, register_y):
         """
             8xy4 - Set Vx = Vx + Vy, set VF = carry.
             The values of Vx and Vy are added together. If the result is
             greater than 8 bits (i.e., > 255,) VF is set to 1, otherwise 0.
             Only the lowest 8 bits of the result are kept, and stored in Vx.
         """
-        register = self.return_middle_registers(self.opcode)
-        sum = self.registers[register[0]] + self.registers[register[1]]
+        sum = self.registers[register_x] + self.registers[register_y]
         if sum > 0xFF:
             self.registers[0xF] = 1
-            self.registers[register[0]] = sum & 0xFF
+            self.registers[register_x] = sum & 0xFF
         else:
             self.registers[0xF] = 0
-            self.registers[register[0]] = sum
-        logger.info("Added V{} to V{} and got {}".format(
-            register[0],
-            register[1],
-            self.registers[register[0]]))
+            self.registers[register_x] = sum
 
-    def sub_reg_from_reg(self):
+    @operands('x', 'y')
+    def sub_reg_from_reg(self, register_x, register_y):
         """
             8xy5 - Set Vx = Vx - Vy, set VF = NOT borrow.
             If Vx > Vy, then VF is set to 1, otherwise 0. Then Vy is subtracted
             from Vx, and the results stored in Vx.
         """
-        register = self.return_middle_registers(self.opcode)
-        if self.registers[register[0]] > self.registers[register[1]]:
+        if self.registers[register_x] > self.registers[register_y]:
             self.registers[0xF] = 1
-            self.registers[register[0]] -= self.registers[register[1]]
+            self.registers[register_x] -= self.registers[register_y]
         else:
             self.registers[0xF] = 0
-            self.registers[register[0]] = (
+            self.registers[register_x] = (
                 256
-                + self.registers[register[0]]
-                - self.registers[register[1]])
+                + self.registers[register_x]
+                - self.registers[register_y])
         # the 256 is there to simulate a wrap around of an unsigned integer
-        logger.info("Subtracted V{} from V{} and got {}".format(
-            register[1],
-            register[0],
-            self.registers[register[0]]))
 
-    def draw_pixel_to_display(self):
+    @operands('x', 'y', 'n')
+    def draw_pixel_to_display(self, register_x, register_y, height):
         """
             Dxyn - Display n-byte sprite starting at memory location I at
             (Vx, Vy), set VF = collision.
@@ -407,46 +964,33 @@ class CPU:
             outside the coordinates of the display, it wraps around to the
             opposite side of the screen.
         """
-        register = self.return_middle_registers(self.opcode)
-        x = self.registers[register[0]]
-        y = self.registers[register[1]]
-        height = self.opcode & 0xF
+        x = self.registers[register_x]
+        y = self.registers[register_y]
 
         self.registers[0xF] = 0
 
         x = bit_utils.wrap_around(x, self.display.width)
         y = bit_utils.wrap_around(y, self.display.height)
 
-        for yline in range(0, height):
-            pixels = self.memory[self.I + yline]
-            y1 = bit_utils.wrap_around(y + yline, self.display.height)
-            for xline in range(0, 8):
-                x1 = bit_utils.wrap_around(x + xline, self.display.width)
-                if pixels & (0x80 >> xline) != 0:
-                    if self.display.set_pixel(x1, y1):
-                        self.registers[0xF] = 1
-
-        self.display.draw_flag = True
-        logger.info("Drawing sprite from {} to {} at {}, {}".format(
-            hex(self.I),
-            hex(self.I + height),
-            x, y))
+        sprite = self.memory[self.I:self.I + height]
+        if self.display.draw_sprite(x, y, sprite):
+            self.registers[0xF] = 1
 
-    def set_I_to_address(self):
+    @operands('nnn')
+    def set_I_to_address(self, address):
         """
             Annn - Set I = nnn.
             The value of register I is set to nnn.
         """
-        self.I = self.opcode & 0xFFF
-        logger.info("Set I to {}".format(hex(self.I)))
+        self.I = address
 
-    def right_shift(self):
+    @operands('x')
+    def right_shift(self, register):
         """
             8x06 - Set Vx = Vx SHR 1.
             If the least-significant bit of Vx is 1, then VF is set to 1,
             otherwise 0. Then Vx is divided by 2.
         """
-        register = (self.opcode & 0xFFF) >> 8
         bits = self.registers[register]
         """if bits & 0b1 == 1:
             self.registers[0xF] = 1
@@ -455,56 +999,44 @@ class CPU:
         """
         self.registers[0xF] = bits & 0b1
         self.registers[register] = self.registers[register] >> 1
-        logger.info("Shifted register V{} 1 bit to the right got {}".format(
-            register,
-            hex(self.registers[register])))
 
-    def right_shift_quirk(self):
+    @operands('x', 'y')
+    def right_shift_quirk(self, register_x, register_y):
         """
             8xy6 - Set Vx = Vy SHR 1.
             If the least-significant bit of Vy is 1, then VF is set to 1,
             otherwise 0. Then Vy is divided by 2.
         """
-        register = self.return_middle_registers(self.opcode)
-        bits = self.registers[register[1]]
+        bits = self.registers[register_y]
         self.registers[0xF] = bits & 0b1
-        self.registers[register[0]] = self.registers[register[1]] >> 1
-        logger.info("Shifted register V{} to the right into V{}({})".format(
-            register[1],
-            register[0],
-            hex(self.registers[register[0]])))
+        self.registers[register_x] = self.registers[register_y] >> 1
 
-    def subn_reg_from_reg(self):
+    @operands('x', 'y')
+    def subn_reg_from_reg(self, register_x, register_y):
         """
             8xy7 - Set Vx = Vy - Vx, set VF = NOT borrow.
             If Vy > Vx, then VF is set to 1, otherwise 0. Then Vx is subtracted
             from Vy, and the results stored in Vx.
         """
-        register = self.return_middle_registers(self.opcode)
-        if self.registers[register[1]] > self.registers[register[0]]:
+        if self.registers[register_y] > self.registers[register_x]:
             self.registers[0xF] = 1
-            self.registers[register[0]] = (
-                self.registers[register[1]]
-                - self.registers[register[0]])
+            self.registers[register_x] = (
+                self.registers[register_y]
+                - self.registers[register_x])
         else:
             self.registers[0xF] = 0
-            self.registers[register[0]] = (
+            self.registers[register_x] = (
                 256
-                + self.registers[register[1]]
-                - self.registers[register[0]])
+                + self.registers[register_y]
+                - self.registers[register_x])
 
-        logger.info("Subtracted V{} from V{} and got {}".format(
-            register[1],
-            register[0],
-            self.registers[register[0]]))
-
-    def left_shift(self):
+    @operands('x')
+    def left_shift(self, register):
         """
             8x0E - Set Vx = Vx SHL 1.
             If the most-significant bit of Vx is 1, then VF is set to 1,
             otherwise to 0. Then Vx is multiplied by 2.
         """
-        register = (self.opcode & 0xFFF) >> 8
         bits = self.registers[register]
         """if bits & 0b1 == 1:
             self.registers[0xF] = 1
@@ -513,26 +1045,20 @@ class CPU:
         """
         self.registers[0xF] = bits & 0x80
         self.registers[register] = self.registers[register] << 1
-        logger.info("Shifted register V{} 1 bit to the left got {}".format(
-            register,
-            hex(self.registers[register])))
 
-    def left_shift_quirk(self):
+    @operands('x', 'y')
+    def left_shift_quirk(self, register_x, register_y):
         """
             8xyE - Set Vx = Vy SHL 1.
             If the most-significant bit of Vy is 1, then VF is set to 1,
             otherwise 0. Then Vy is multiplied by 2.
         """
-        register = self.return_middle_registers(self.opcode)
-        bits = self.registers[register[1]]
+        bits = self.registers[register_y]
         self.registers[0xF] = bits & 0x80
-        self.registers[register[0]] = self.registers[register[1]] << 1
-        logger.info("Shifted register V{} to the left into V{}({})".format(
-            register[1],
-            register[0],
-            hex(self.registers[register[0]])))
+        self.registers[register_x] = self.registers[register_y] << 1
 
-    def bin_coded_dec(self):
+    @operands('x')
+    def bin_coded_dec(self, register):
         """
             Fx33 - Store BCD representation of Vx in memory locations I, I+1,
             and I+2.
@@ -540,139 +1066,104 @@ class CPU:
             hundreds digit in memory at location in I, the tens digit at
             location I+1, and the ones digit at location I+2.
         """
-        register = (self.opcode & 0xFFF) >> 8
         value = self.registers[register]
-        self.memory[self.I] = int(math.floor(value / 100))
-        self.memory[self.I + 1] = int(math.floor(value % 100 / 10))
-        self.memory[self.I + 2] = value % 10
-        logger.info("Stored BCD of V{}({}) starting at {}".format(
-            register,
-            self.registers[register],
-            hex(self.I)))
+        self.memory[self.memory_at_I(3)] = bytes((
+            int(math.floor(value / 100)) & 0xFF,
+            int(math.floor(value % 100 / 10)),
+            value % 10))
+        self.invalidate_code(self.I, 3)
 
-    def load_mem_to_registers(self):
+    @operands('x')
+    def load_mem_to_registers(self, register):
         """
         Fx65 - Read registers V0 through Vx from memory starting at location I.
         The interpreter reads values from memory starting at location I into
         registers V0 through Vx.
         """
-        register = (self.opcode & 0xFFF) >> 8
-        for x in range(register+1):
-            self.registers[x] = self.memory[self.I + x]
-        logger.info(
-            "Loaded memory from {} to {} in registers till V{}".format(
-                hex(self.I),
-                hex((self.I + register)),
-                register))
+        self.registers[:register + 1] = self.memory[
+            self.memory_at_I(register + 1)]
 
-    def load_mem_to_registers_quirk(self):
+    @operands('x')
+    def load_mem_to_registers_quirk(self, register):
         """
         Fx65 - Read registers V0 through Vx from memory starting at location I.
         The interpreter reads values from memory starting at location I into
         registers V0 through Vx.
         I is set to I + X + 1 after operation
         """
-        register = (self.opcode & 0xFFF) >> 8
-        for x in range(register+1):
-            self.registers[x] = self.memory[self.I + x]
+        self.registers[:register + 1] = self.memory[
+            self.memory_at_I(register + 1)]
         self.I += register + 1
-        logger.info(
-            "Loaded memory from {} to {} in registers till V{}".format(
-                hex(self.I),
-                hex((self.I + register)),
-                register))
 
-    def load_sprite_from_memory(self):
+    @operands('x')
+    def load_sprite_from_memory(self, register):
         """
             Fx29 - Set I = location of sprite for digit Vx.
             The value of I is set to the location for the hexadecimal sprite
             corresponding to the value of Vx. See section 2.4, Display, for
             more information on the Chip-8 hexadecimal font.
         """
-        register = (self.opcode & 0xFFF) >> 8
         self.I = self.registers[register] * 5
 
-        logger.info("Loaded sprite at memory location {}".format(hex(self.I)))
-
-    def set_delay_timer_to_reg(self):
+    @operands('x')
+    def set_delay_timer_to_reg(self, register):
         """
             Fx15 - Set delay timer = Vx.
             DT is set equal to the value of Vx.
         """
-        register = (self.opcode & 0xFFF) >> 8
         self.delay_timer = self.registers[register]
 
-        logger.info("Set delay timer to register V{} = {}".format(
-            register,
-            self.registers[register]))
-
-    def set_reg_to_delay_timer(self):
+    @operands('x')
+    def set_reg_to_delay_timer(self, register):
         """
             Fx07 - Set Vx = delay timer value.
             The value of DT is placed into Vx.
         """
-        register = (self.opcode & 0xFFF) >> 8
         self.registers[register] = self.delay_timer
-        logger.info("Set register V{} to delay timer {}".format(
-            register,
-            self.registers[register]))
 
-    def generate_random_number(self):
+    @operands('x', 'kk')
+    def generate_random_number(self, register, to_and):
         """
             Cxkk - Set Vx = random byte AND kk.
             The interpreter generates a random number from 0 to 255, which is
             then ANDed with the value kk. The results are stored in Vx.
         """
-        value = random.randint(0, 0xFF)
-        register = (self.opcode & 0xF00) >> 8
-        to_and = self.opcode & 0xFF
+        value = self.rng.randint(0, 0xFF)
         self.registers[register] = value & to_and
-        logger.info("Set V{} to random number {}".format(
-            register,
-            self.registers[register]))
 
-    def skip_if_key_not_pressed(self):
+    @operands('x')
+    def skip_if_key_not_pressed(self, register):
         """
             ExA1 - Skip next instruction if key with the value of Vx is not
             pressed.
             Checks the keyboard, and if the key corresponding to the value of
             Vx is currently in the up position, PC is increased by 2.
         """
-        register = (self.opcode & 0xF00) >> 8
-        key = self.registers[register]
-        keys = pygame.key.get_pressed()
-        if not keys[ord(config.keys[key])]:
+        if not self.keypad.is_pressed(self.registers[register]):
             self.pc += 2
-            logger.info("Skipped {} because {} wasn't pressed".format(
-                hex(self.memory[self.pc - 2]),
-                key))
 
-    def set_sound_timer_to_reg(self):
+    @operands('x')
+    def set_sound_timer_to_reg(self, register):
         """
             Fx18 - Set sound timer = Vx.
             ST is set equal to the value of Vx.
         """
-        register = (self.opcode & 0xF00) >> 8
         self.sound_timer = self.registers[register]
-        logger.info("Set sound timer to V{} = {}".format(
-            register,
-            self.registers[register]))
 
-    def load_registers_in_memory(self):
+    @operands('x')
+    def load_registers_in_memory(self, register):
         """
             Fx55 - Store registers V0 through Vx in memory starting at
             location I.
             The interpreter copies the values of registers V0 through Vx into
             memory, starting at the address in I.
         """
-        register = (self.opcode & 0xF00) >> 8
-        for x in range(register+1):
-            self.memory[self.I + x] = self.registers[x]
-        logger.info("Loaded registers from V0 to V{} into {}".format(
-            register,
-            hex(self.I)))
+        self.memory[self.memory_at_I(register + 1)] = self.register_bytes(
+            register + 1)
+        self.invalidate_code(self.I, register + 1)
 
-    def load_registers_in_memory_quirk(self):
+    @operands('x')
+    def load_registers_in_memory_quirk(self, register):
         """
             Fx55 - Store registers V0 through Vx in memory starting at
             location I.
@@ -680,91 +1171,64 @@ class CPU:
             memory, starting at the address in I.
             I is set to I + X + 1 after operation
         """
-        register = (self.opcode & 0xF00) >> 8
-        for x in range(register+1):
-            self.memory[self.I + x] = self.registers[x]
+        self.memory[self.memory_at_I(register + 1)] = self.register_bytes(
+            register + 1)
+        self.invalidate_code(self.I, register + 1)
         self.I += register + 1
-        logger.info("Loaded registers from V0 to V{} into {}".format(
-            register,
-            hex(self.I)))
 
-    def add_reg_to_I(self):
+    @operands('x')
+    def add_reg_to_I(self, register):
         """
             Fx1E - Set I = I + Vx.
             The values of I and Vx are added, and the results are stored in I.
         """
-        register = (self.opcode & 0xF00) >> 8
         value = bit_utils.wrap_around(
             self.registers[register] + self.I,
             0xffff + 1)
         self.I = value
-        logger.info("Added V{}({}) to I".format(
-            register,
-            self.registers[register]))
 
-    def skip_if_key_pressed(self):
+    @operands('x')
+    def skip_if_key_pressed(self, register):
         """
             Ex9E - Skip next instruction if key with the value of Vx is
             pressed.
             Checks the keyboard, and if the key corresponding to the value of
             Vx is currently in the down position, PC is increased by 2.
         """
-        register = (self.opcode & 0xF00) >> 8
-        key = self.registers[register]
-        keys = pygame.key.get_pressed()
-        if keys[ord(config.keys[key])]:
+        if self.keypad.is_pressed(self.registers[register]):
             self.pc += 2
-            logger.info("Skipped {} because {} was pressed".format(
-                self.memory[self.pc + 2],
-                key))
 
-    def skip_if_regs_not_equal(self):
+    @operands('x', 'y')
+    def skip_if_regs_not_equal(self, register_x, register_y):
         """
             9xy0 - Skip next instruction if Vx != Vy.
             The values of Vx and Vy are compared, and if they are not equal,
             the program counter is increased by 2.
         """
-        register = self.return_middle_registers(self.opcode)
-        value_x = self.registers[register[0]]
-        value_y = self.registers[register[1]]
+        value_x = self.registers[register_x]
+        value_y = self.registers[register_y]
         if value_x != value_y:
             self.pc += 2
-        logger.info("Skipped {} because V{} = V{}".format(
-            hex(self.pc - 2),
-            register[0],
-            register[1]))
 
-    def jmp_to_val_plus_v0(self):
+    @operands('nnn')
+    def jmp_to_val_plus_v0(self, addr):
         """
             Bnnn - Jump to location nnn + V0.
             The program counter is set to nnn plus the value of V0.
         """
-        addr = self.opcode & 0xFFF
         self.pc = addr + self.registers[0]
-        logger.info("Jumped to {} + V0 = {}".format(
-            hex(addr),
-            hex(self.pc)))
 
-    def wait_for_keypress(self):
+    @operands('x')
+    def wait_for_keypress(self, register):
         """
             Fx0A - Wait for a key press, store the value of the key in Vx.
             All execution stops until a key is pressed, then the value of that
             key is stored in Vx.
         """
-        register = (self.opcode & 0xF00) >> 8
-        key_pressed = False
-        while not key_pressed:
-            event = pygame.event.wait()
-            if event.type == pygame.QUIT:
-                pygame.quit()
-            if event.type == pygame.KEYDOWN:
-                inv_keys = {v: k for k, v in config.keys.items()}
-                try:
-                    self.registers[register] = inv_keys[chr(event.key)]
-                    key_pressed = True
-                except KeyError:
-                    pass
-
-        logger.info("Stored key {} into V{}".format(
-            self.registers[register],
-            register))
+        key = self.keypad.wait_for_key()
+        if key is None:
+            # Nothing yet, the same instruction runs again
+            self.waiting_for_key = True
+            self.pc -= 2
+        else:
+            self.registers[register] = key
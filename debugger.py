@@ -0,0 +1,253 @@
+"""
+    Breakpoints, watchpoints and stepping. Like the tracer nothing here runs
+    while there is nothing to stop at: the debugger only swaps in its own
+    run_instructions, which checks a flag per address and the conditions
+    after every instruction, while a breakpoint, watchpoint, condition or
+    step target is set. Stopping raises DebuggerBreak out of the run with
+    the CPU's cycle count up to date, running again carries on from there.
+
+    Conditions compare a register with a number, like "V3 == 0x10" or
+    "I>=0x300". The registers are V0 to VF, I, PC, SP, DT and ST.
+"""
+import functools
+import operator
+import re
+from cpu import CPU
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '>': operator.gt
+}
+
+# register, operator, value
+CONDITION = re.compile(r'^\s*(\w+)\s*(==|!=|<=|>=|<|>)\s*(\w+)\s*$')
+
+REGISTERS = {
+    'I': lambda cpu: cpu.I,
+    'PC': lambda cpu: cpu.pc,
+    'SP': lambda cpu: cpu.stack_pointer,
+    'DT': lambda cpu: cpu.delay_timer,
+    'ST': lambda cpu: cpu.sound_timer
+}
+for _register in range(16):
+    REGISTERS['V{:X}'.format(_register)] = \
+        functools.partial(lambda register, cpu: cpu.registers[register],
+                          _register)
+
+
+class DebuggerBreak(Exception):
+    def __init__(self, reason):
+        super(DebuggerBreak, self).__init__(reason)
+        self.reason = reason
+
+
+def parse_condition(text):
+    """
+        Turns "V3 == 0x10" into a function that tells if it holds for a CPU.
+        The spaces around the operator are optional.
+    """
+    match = CONDITION.match(text)
+    if match is None or match.group(1).upper() not in REGISTERS:
+        raise ValueError("Can't understand the condition {!r}".format(text))
+    name, symbol, value = match.groups()
+    register = REGISTERS[name.upper()]
+    compare = OPERATORS[symbol]
+    try:
+        value = int(value, 0)
+    except ValueError:
+        raise ValueError("Can't understand the condition {!r}".format(text))
+
+    def condition(cpu):
+        return compare(register(cpu), value)
+    condition.text = text
+    return condition
+
+
+class Debugger:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # Conditions (None when there's none) by breakpoint address
+        self.breakpoints = {}
+        self.flags = bytearray(len(cpu.memory))
+        self.watchpoints = []  # (start, end)
+        self.conditions = []
+        # Where a step over or out stops, a function of the CPU
+        self.target = None
+        self.watch_hit = None
+        # Only writes made while running instructions hit watchpoints, not
+        # loading a rom or a state
+        self.running = False
+        # The breakpoint last stopped at, which doesn't stop again right away
+        self.resume = None
+        self.attached = False
+        self.saved = {}
+
+    def add_breakpoint(self, address, condition=None):
+        if condition is not None and not callable(condition):
+            condition = parse_condition(condition)
+        self.breakpoints[address] = condition
+        self.flags[address] = 1
+        self.update()
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.pop(address, None)
+        self.flags[address] = 0
+        self.update()
+
+    def add_watchpoint(self, address, length=1):
+        """
+            Stops after any write to memory[address:address + length].
+        """
+        self.watchpoints.append((address, address + length))
+        self.update()
+
+    def add_condition(self, condition):
+        """
+            Stops after the instruction that makes condition true.
+        """
+        if not callable(condition):
+            condition = parse_condition(condition)
+        self.conditions.append(condition)
+        self.update()
+
+    def clear(self):
+        for address in list(self.breakpoints):
+            self.flags[address] = 0
+        self.breakpoints.clear()
+        self.watchpoints = []
+        self.conditions = []
+        self.target = None
+        self.update()
+
+    def step_over(self):
+        """
+            Sets up running over the call at pc and returns True, or returns
+            False when pc isn't a call and a single step does the same.
+        """
+        cpu = self.cpu
+        opcode = cpu.memory[cpu.pc] << 8 | cpu.memory[cpu.pc + 1]
+        if opcode >> 12 != 0x2:
+            return False
+        address = cpu.pc + 2
+        depth = cpu.stack_pointer
+
+        def returned(cpu):
+            return cpu.pc == address and cpu.stack_pointer == depth
+        returned.text = 'step over'
+        self.target = returned
+        self.update()
+        return True
+
+    def step_out(self):
+        """
+            Sets up running till the current subroutine returns.
+        """
+        depth = self.cpu.stack_pointer
+
+        def returned(cpu):
+            return cpu.stack_pointer < depth
+        returned.text = 'step out'
+        self.target = returned
+        self.update()
+
+    def update(self):
+        """
+            Swaps the checking run_instructions in while there's something to
+            stop at and out when there isn't.
+        """
+        active = bool(self.breakpoints or self.watchpoints or
+                      self.conditions or self.target)
+        if active and not self.attached:
+            self.attach()
+        elif not active and self.attached:
+            self.detach()
+
+    def attach(self):
+        cpu = self.cpu
+        # Put back whatever the tracer or profiler swapped in when detaching
+        for name in ('run_instructions', 'invalidate_code', 'idle_skip'):
+            self.saved[name] = vars(cpu).get(name)
+        self.invalidate_code = cpu.invalidate_code
+        cpu.run_instructions = self.run_instructions
+        cpu.invalidate_code = self.watch_writes
+        # Skipped idle loops and compiled blocks would run past breakpoints
+        cpu.idle_skip = False
+        self.attached = True
+
+    def detach(self):
+        cpu = self.cpu
+        for name, value in self.saved.items():
+            if value is None:
+                vars(cpu).pop(name, None)
+            else:
+                setattr(cpu, name, value)
+        self.attached = False
+
+    def watch_writes(self, address, length=1):
+        self.invalidate_code(address, length)
+        if not self.running:
+            return
+        end = address + length
+        # The first watched byte that got written
+        hits = [max(start, address) for start, stop in self.watchpoints
+                if address < stop and start < end]
+        if hits:
+            self.watch_hit = min(hits)
+
+    def run_instructions(self, count):
+        """
+            Executes up to count instructions one at a time, raising
+            DebuggerBreak when one of them has to stop.
+        """
+        cpu = self.cpu
+        # The tracer or profiler may have swapped in their own run_cycle
+        run_cycle = vars(cpu).get('run_cycle') or \
+            functools.partial(CPU.run_cycle, cpu)
+        flags = self.flags
+        resume = self.resume
+        self.resume = None
+        self.watch_hit = None
+        executed = 0
+        reason = None
+        self.running = True
+        try:
+            while executed < count:
+                # A breakpoint stops before the instruction
+                pc = cpu.pc
+                if flags[pc] and (executed or pc != resume):
+                    condition = self.breakpoints[pc]
+                    if condition is None or condition(cpu):
+                        self.resume = pc
+                        reason = 'breakpoint at {}'.format(hex(pc))
+                        break
+                executed += run_cycle()
+                reason = self.check()
+                if reason is not None:
+                    break
+        finally:
+            self.running = False
+        if reason is None:
+            return executed
+        cpu.cycles += executed
+        raise DebuggerBreak(reason)
+
+    def check(self):
+        """
+            Returns why to stop after an instruction, None to keep going.
+        """
+        cpu = self.cpu
+        if self.watch_hit is not None:
+            return 'write to {}'.format(hex(self.watch_hit))
+        for condition in self.conditions:
+            if condition(cpu):
+                return getattr(condition, 'text', 'condition')
+        if self.target is not None and self.target(cpu):
+            reason = self.target.text
+            self.target = None
+            self.update()
+            return reason
+        return None
@@ -1,115 +1,177 @@
 import pygame
-import pygame.gfxdraw
+from framebuffer import FrameBuffer
 
 
-class Display():
+# The 8 pixels (0 or 1) of every possible row byte
+EXPANDED_BYTES = [
+    bytes((byte >> (7 - bit)) & 1 for bit in range(8)) for byte in range(256)
+]
+
+# What the debug info is made of, anything else gets rendered when first seen
+OVERLAY_CHARACTERS = '0123456789abcdefx OPCIV:='
+
+
+class Display(FrameBuffer):
     colors = {'white': (255, 255, 255)}
 
     def __init__(self, width, height, scale, debug=False):
+        super(Display, self).__init__(width, height)
         self.debug = debug
         self.debug_offset = 256
-        self.width = width
-        self.height = height
+        # The window is wider than the screen to fit the debug info
+        self.window_width = width
         if debug:
-            self.width += int(self.debug_offset / scale)
-        self.display_buffer = [
-            [0] * self.width for _ in range(self.height)
-        ]
+            self.window_width += int(self.debug_offset / scale)
         self.scale = scale
-        self.draw_flag = False
         self.font_size = 9
-        self.font = pygame.font.SysFont('Arial', self.font_size)
+        self.font = None  # Only the debug info needs it, see display_setup
+        # Parts of the window that changed since the last flip
+        self.dirty_rects = []
 
     def display_setup(self):
         self.screen = pygame.display.set_mode((
-            self.width * self.scale,
+            self.window_width * self.scale,
             self.height * self.scale))
-        self.surface = pygame.Surface(self.screen.get_size())
-        self.surface = self.surface.convert()
+        # One byte per pixel, 0 is black and 1 is white
+        self.pixels = pygame.Surface((self.width, self.height), 0, 8)
+        self.pixels.set_palette(
+            [(0, 0, 0), Display.colors['white']] + [(0, 0, 0)] * 254)
         pygame.display.set_caption("Chip8py3 Emulator")
+        if self.debug:
+            # Looking up a system font scans every font installed
+            pygame.font.init()
+            self.font = pygame.font.SysFont('Arial', self.font_size)
+            self.build_atlas()
+            self.overlay_positions = self.overlay_fields()
+            # What every label shows on the screen now, None when nothing
+            self.overlay_texts = [None] * len(self.overlay_positions)
+        self.dirty_rows = self.all_rows
 
     def update_display(self):
-        self.surface.fill((0, 0, 0, 0))  # Clears the display
-        for y in range(0, self.height):
-            for x in range(0, self.width):
-                if self.display_buffer[y][x] == 1:
-                    pygame.gfxdraw.box(
-                        self.surface,
-                        (x * self.scale, y * self.scale, self.scale,
-                         self.scale),
-                        Display.colors['white'])
-        self.screen.blit(self.surface, (0, 0))
+        """
+            Redraws the rows that changed since the last update and returns
+            the rects of the window they cover.
+        """
+        dirty = self.take_dirty_rows()
         self.draw_flag = False
+        if not dirty:
+            return []
+        self.write_pixels(dirty)
 
-    def clear_display(self):
-        self.display_buffer = [
-            [0] * self.width for _ in range(self.height)
-        ]
-        self.draw_flag = True
+        if dirty == self.all_rows:
+            bands = [(0, self.height)]
+        else:
+            bands = self.row_bands(dirty)
+        rects = []
+        for top, bottom in bands:
+            area = self.pixels.subsurface((0, top, self.width, bottom - top))
+            scaled = pygame.transform.scale(area, (
+                self.width * self.scale,
+                (bottom - top) * self.scale))
+            rects.append(self.screen.blit(scaled, (0, top * self.scale)))
+        self.dirty_rects.extend(rects)
+        return rects
 
-    def set_pixel(self, x, y):
+    def write_pixels(self, dirty):
         """
-            Sets a pixel inside the buffer to on if it is 0 and returns
-            False. Otherwise sets the pixel to off and returns True.
+            Copies the dirty rows into the 8-bit pixel surface.
         """
-        if self.display_buffer[y][x] == 0:
-            self.display_buffer[y][x] = 1
-            return False
+        pitch = self.pixels.get_pitch()
+        row_size = (self.width + 7) // 8
+        padding = row_size * 8 - self.width
+        buffer = self.pixels.get_buffer()
+        for y in range(self.height):
+            if dirty >> y & 1:
+                packed = (self.rows[y] << padding).to_bytes(row_size, 'big')
+                pixels = b''.join(EXPANDED_BYTES[byte] for byte in packed)
+                buffer.write(pixels[:self.width], y * pitch)
+        del buffer  # The surface stays locked while the buffer is around
 
-        else:
-            self.display_buffer[y][x] = 0
-            return True
+    def row_bands(self, dirty):
+        """
+            Returns (top, bottom) pairs of the runs of set bits in dirty.
+        """
+        bands = []
+        y = 0
+        while dirty >> y:
+            if dirty >> y & 1:
+                top = y
+                while dirty >> y & 1:
+                    y += 1
+                bands.append((top, y))
+            else:
+                y += 1
+        return bands
+
+    def flip(self):
+        """
+            Shows what changed on the window since the last flip.
+        """
+        if self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+            self.dirty_rects = []
+
+    def build_atlas(self):
+        """
+            Renders every character the debug info uses once, so drawing it
+            is only blits.
+        """
+        self.glyphs = {}
+        for character in OVERLAY_CHARACTERS:
+            self.glyph(character)
+        self.glyph_width = max(
+            glyph.get_width() for glyph in self.glyphs.values())
+        self.glyph_height = self.font.get_linesize()
+
+    def glyph(self, character):
+        glyph = self.glyphs.get(character)
+        if glyph is None:
+            glyph = self.font.render(character, 1, Display.colors['white'])
+            self.glyphs[character] = glyph
+        return glyph
+
+    def overlay_fields(self):
+        """
+            Returns the (x, y) of the opcode, pc, I and V0 to VF labels.
+        """
+        right = self.window_width * self.scale
+        # Where the labels always went
+        column = right - self.debug_offset / self.scale - self.font_size * 3
+        fields = [(right - self.debug_offset + self.font_size, 0),
+                  (column, 0),
+                  (column, 16)]
+        fields.extend((column, (i + 2) * 16) for i in range(16))
+        return [(int(x), y) for x, y in fields]
+
+    def draw_text(self, text, position, width):
+        """
+            Clears width characters at position, draws text over them and
+            returns the rect.
+        """
+        x, y = position
+        area = pygame.Rect(x, y, width * self.glyph_width, self.glyph_height)
+        self.screen.fill((0, 0, 0), area)
+        for character in text:
+            glyph = self.glyph(character)
+            self.screen.blit(glyph, (x, y))
+            x += glyph.get_width()
+        return area.clip(self.screen.get_rect())
 
     def draw_registers(self, registers, pc, i, opcode):
-        opcode_label = self.font.render(
-            "OP: {}".format(hex(opcode)),
-            1,
-            (255, 255, 255))
-        self.screen.blit(
-            opcode_label,
-            (
-                self.width
-                * self.scale
-                - self.debug_offset
-                + self.font_size,
-                0))
-
-        pc_label = self.font.render(
-            "PC = {}".format(hex(pc)),
-            1,
-            (255, 255, 255))
-        self.screen.blit(
-            pc_label,
-            (
-                self.width
-                * self.scale
-                - self.debug_offset
-                / self.scale
-                - self.font_size * 3, 0))
-
-        i_label = self.font.render(
-            "I = {}".format(hex(i)),
-            1,
-            (255, 255, 255))
-        self.screen.blit(
-            i_label,
-            (
-                self.width
-                * self.scale
-                - self.debug_offset
-                / self.scale
-                - self.font_size * 3, 16))
-        for i, register in enumerate(registers):
-            register_label = self.font.render(
-                "V{}: {}".format(i, register),
-                1,
-                (255, 255, 255)
-                )
-            self.screen.blit(
-                register_label,
-                (
-                    self.width
-                    * self.scale
-                    - self.debug_offset
-                    / self.scale
-                    - self.font_size * 3, (i+2) * 16))
+        """
+            Draws the labels whose value changed since the last call.
+        """
+        texts = ["OP: {}".format(hex(opcode)),
+                 "PC = {}".format(hex(pc)),
+                 "I = {}".format(hex(i))]
+        texts.extend("V{}: {}".format(number, register)
+                     for number, register in enumerate(registers))
+        drawn = self.overlay_texts
+        for index, text in enumerate(texts):
+            if text == drawn[index]:
+                continue
+            # Wide enough to clear the longer text that was there before
+            width = max(len(text), len(drawn[index] or ''))
+            self.dirty_rects.append(self.draw_text(
+                text, self.overlay_positions[index], width))
+            drawn[index] = text
@@ -0,0 +1,107 @@
+class FrameBuffer:
+    """
+        The CHIP-8 screen without anything to show it on, Display draws it
+        with pygame.
+
+        Every row is stored as a single int with the leftmost pixel in the
+        most significant bit, so a sprite row is drawn with one shift and one
+        XOR and collisions are found with one AND.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.rows = [0] * height
+        self.draw_flag = False
+        # Rows changed since the renderer last looked, bit y is row y
+        self.all_rows = (1 << height) - 1
+        self.dirty_rows = self.all_rows
+
+    def clear_display(self):
+        self.rows = [0] * self.height
+        self.dirty_rows = self.all_rows
+        self.draw_flag = True
+
+    def load_rows(self, rows):
+        """
+            Replaces the whole screen, used to restore save states.
+        """
+        self.rows = list(rows)
+        self.dirty_rows = self.all_rows
+        self.draw_flag = True
+
+    def update_rows(self, rows):
+        """
+            Replaces the whole screen, only the rows that differ get marked
+            dirty. Used to show frames drawn into another FrameBuffer.
+        """
+        dirty = 0
+        for y, row in enumerate(rows):
+            if self.rows[y] != row:
+                self.rows[y] = row
+                dirty |= 1 << y
+        if dirty:
+            self.dirty_rows |= dirty
+            self.draw_flag = True
+
+    def take_dirty_rows(self):
+        """
+            Returns the mask of rows that changed and marks them clean.
+        """
+        dirty = self.dirty_rows
+        self.dirty_rows = 0
+        return dirty
+
+    def get_pixel(self, x, y):
+        return (self.rows[y] >> (self.width - 1 - x)) & 1
+
+    def set_pixel(self, x, y):
+        """
+            Sets a pixel inside the buffer to on if it is 0 and returns
+            False. Otherwise sets the pixel to off and returns True.
+        """
+        bit = 1 << (self.width - 1 - x)
+        self.rows[y] ^= bit
+        self.dirty_rows |= 1 << y
+        return not self.rows[y] & bit
+
+    def draw_sprite(self, x, y, sprite):
+        """
+            XORs the sprite rows (bytes) onto the screen with the top left
+            corner at (x, y), wrapping around the edges. Returns True if any
+            pixel got erased.
+        """
+        width = self.width
+        height = self.height
+        rows = self.rows
+        shift = width - 8 - x
+        collision = 0
+        for line, byte in enumerate(sprite):
+            if shift >= 0:
+                bits = byte << shift
+            else:
+                # Rotates the part that sticks out over to the left edge
+                bits = ((byte >> -shift) | (byte << (width + shift))) \
+                    & self.full_row
+            row_y = (y + line) % height
+            row = rows[row_y]
+            collision |= row & bits
+            rows[row_y] = row ^ bits
+        span = ((1 << len(sprite)) - 1) << y
+        self.dirty_rows |= (span | span >> height) & self.all_rows
+        self.draw_flag = True
+        return collision != 0
+
+    def row_pixels(self, y):
+        """
+            Returns the pixels of a row as a list of 0 and 1.
+        """
+        row = self.rows[y]
+        return [(row >> bit) & 1 for bit in range(self.width - 1, -1, -1)]
+
+    def to_bytes(self):
+        """
+            Returns the screen packed into bytes, a row after the other.
+        """
+        row_size = (self.width + 7) // 8
+        return b''.join(row.to_bytes(row_size, 'big') for row in self.rows)
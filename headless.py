@@ -0,0 +1,125 @@
+"""
+    Runs ROMs without a window, audio or pygame. Handy for CI and batch
+    runs where there is no display:
+
+        python headless.py rom -n 100000
+"""
+import argparse
+import hashlib
+import sys
+import time
+from cpu import CPU
+from translator import BlockCPU
+from ram import RAM
+from framebuffer import FrameBuffer
+
+MEM_SIZE = 4096
+WIDTH = 64
+HEIGHT = 32
+OFFSET = 0x200
+ENGINES = {'interpreter': CPU, 'block': BlockCPU}
+
+
+def make_machine(rom=None, engine='interpreter', keypad=None, audio=None):
+    """
+        Returns a CPU wired to RAM and a FrameBuffer, with the fontset and
+        rom loaded when one is given.
+    """
+    cpu = ENGINES[engine](
+        RAM(MEM_SIZE, OFFSET),
+        FrameBuffer(WIDTH, HEIGHT),
+        keypad,
+        audio)
+    if rom is not None:
+        cpu.initalize_cpu(rom)
+    return cpu
+
+
+def run(cpu, instructions):
+    """
+        Executes the given number of instructions, ticking the timers on the
+        emulated clock, and returns how many were executed.
+    """
+    return cpu.run_cycles(instructions)
+
+
+def framebuffer_hash(display):
+    """
+        Returns a hex digest of the pixels currently on screen.
+    """
+    return hashlib.sha1(display.to_bytes()).hexdigest()
+
+
+def render_text(display):
+    return '\n'.join(
+        ''.join('#' if pixel else '.' for pixel in display.row_pixels(y))
+        for y in range(display.height))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="runs a rom without a window")
+    parser.add_argument("rom", help="path to rom", type=str)
+    parser.add_argument(
+        "-n",
+        help="number of instructions to execute",
+        dest="instructions",
+        type=int,
+        default=100000)
+    parser.add_argument(
+        "-e",
+        help="sets the execution engine",
+        dest="engine",
+        choices=sorted(ENGINES),
+        default="interpreter")
+    parser.add_argument(
+        "--load-state",
+        help="starts from a save state instead of the beginning of the rom",
+        dest="load_state",
+        type=str)
+    parser.add_argument(
+        "--save-state",
+        help="saves the state at the end",
+        dest="save_state",
+        type=str)
+    parser.add_argument(
+        "--show",
+        help="prints the screen at the end",
+        action='store_true',
+        dest='show',
+        default=False)
+    parser.add_argument(
+        "--fusion-report",
+        help="prints how many instructions ran fused, by idiom",
+        action='store_true',
+        dest='fusion_report',
+        default=False)
+    args = parser.parse_args(argv)
+
+    cpu = make_machine(args.rom, args.engine)
+    if args.load_state:
+        with open(args.load_state, 'rb') as file:
+            cpu.load_state(file.read())
+    start = time.perf_counter()
+    executed = run(cpu, args.instructions)
+    elapsed = time.perf_counter() - start
+    if args.save_state:
+        with open(args.save_state, 'wb') as file:
+            file.write(cpu.save_state())
+    if args.show:
+        sys.stdout.write(render_text(cpu.display) + '\n')
+    sys.stdout.write("{} instructions in {:.3f}s ({:.0f}/s) {}\n".format(
+        executed,
+        elapsed,
+        executed / elapsed if elapsed else 0,
+        framebuffer_hash(cpu.display)))
+    if args.fusion_report:
+        report = cpu.fusion_report()
+        sys.stdout.write("{} of {} instructions fused ({:.1%})\n".format(
+            report['fused'], executed,
+            report['fused'] / executed if executed else 0))
+        for idiom, fused in sorted(report['idioms'].items()):
+            sys.stdout.write("  {:<16} {}\n".format(idiom, fused))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+    What the tracer and the profiler have in common: both see every
+    instruction by swapping their own run_cycle into a CPU, and only while
+    attached.
+"""
+import functools
+from cpu import CPU
+
+
+class CycleHook:
+    """
+        Subclasses define run_cycle, which has to execute a single
+        instruction through CPU.run_cycle and return how many it executed.
+    """
+    cpu = None
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        cpu.run_cycle = self.run_cycle
+        # Blocks and fused idioms skip run_cycle, go through it instead. The
+        # debugger's run_instructions already does, so that one stays
+        self.swapped = None
+        if 'run_instructions' not in vars(cpu):
+            self.swapped = functools.partial(CPU.interpret_instructions, cpu)
+            cpu.run_instructions = self.swapped
+        # Skipped idle loops would be missing too
+        self.idle_skip = cpu.idle_skip
+        cpu.idle_skip = False
+
+    def detach(self):
+        cpu = self.cpu
+        if cpu is not None:
+            del cpu.run_cycle
+            # The debugger may have swapped its own in since, then it's left
+            # alone and puts back what it found when it detaches
+            current = vars(cpu).get('run_instructions')
+            if self.swapped is None or current is self.swapped:
+                if self.swapped is not None:
+                    del cpu.run_instructions
+                cpu.idle_skip = self.idle_skip
+            self.cpu = None
@@ -1,16 +1,19 @@
 import pygame
 from cpu import CPU
-from cpu import logger as logger_cpu
+from tracer import Tracer, LEVELS
+from scheduler import FrameScheduler, FRAME_RATE
 from ram import RAM
 from display import Display
+from framebuffer import FrameBuffer
+from backends import KeyState
+from pygame_backends import PygameKeypad, PygameAudio
 import argparse
 import logging
+import random
 import config
 
 logger = logging.getLogger(__name__)
-fh = logging.FileHandler('last.log')
-fh.setLevel(logging.INFO)
-logger.addHandler(fh)
+logger.setLevel(logging.INFO)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("rom", help="path to rom", type=str)
@@ -23,10 +26,17 @@ parser.add_argument(
 
 parser.add_argument(
     "-t",
-    help="sets the delay between cpu cycles in ms",
-    dest="timer",
+    help="sets how many instructions get executed per second",
+    dest="speed",
     type=int,
-    default=1)
+    default=600)
+
+parser.add_argument(
+    "--turbo",
+    help="runs as fast as possible",
+    action='store_true',
+    dest='turbo',
+    default=False)
 
 parser.add_argument(
     "-d",
@@ -35,7 +45,147 @@ parser.add_argument(
     dest='debug',
     default=False)
 
+parser.add_argument(
+    "-e",
+    help="sets the execution engine, block compiles straight-line code",
+    dest="engine",
+    choices=["interpreter", "block"],
+    default="interpreter")
+
+parser.add_argument(
+    "--trace",
+    help="records executed instructions, read them with tracer.py",
+    dest="trace",
+    choices=sorted(LEVELS),
+    default="off")
+
+parser.add_argument(
+    "--trace-file",
+    help="where the trace gets written",
+    dest="trace_file",
+    type=str,
+    default="last.trace")
+
+parser.add_argument(
+    "--profile",
+    help="counts and times every instruction, F2 writes the report",
+    action='store_true',
+    dest='profile',
+    default=False)
+
+parser.add_argument(
+    "--profile-file",
+    help="where the profile gets written, as JSON if it ends in .json",
+    dest="profile_file",
+    type=str,
+    default="last.profile")
+
+parser.add_argument(
+    "--rewind",
+    help="seconds of history kept for rewinding with backspace",
+    dest="rewind",
+    type=float,
+    default=config.rewind_seconds)
+
+parser.add_argument(
+    "--seed",
+    help="seeds the random numbers, a random seed by default",
+    dest="seed",
+    type=int)
+
+parser.add_argument(
+    "--record",
+    help="records the keypad for replay.py, disables rewinding and loading",
+    dest="record",
+    type=str)
+
+parser.add_argument(
+    "--frames",
+    help="quits after this many frames",
+    dest="frames",
+    type=int)
+
+parser.add_argument(
+    "--threaded",
+    help="runs the cpu on its own thread, turns off rewinding",
+    action='store_true',
+    dest='threaded',
+    default=False)
+
+parser.add_argument(
+    "--break",
+    help="stops at an address, when the condition holds if one is given, "
+         "like 0x20a or 0x20a:V3==5, needs -d",
+    dest="breakpoints",
+    action='append',
+    default=[])
+
+parser.add_argument(
+    "--watch",
+    help="stops after a write to an address or range, like 0x300 or "
+         "0x300:16, needs -d",
+    dest="watchpoints",
+    action='append',
+    default=[])
+
+parser.add_argument(
+    "--break-if",
+    help="stops when a condition becomes true, like 'V3 == 5', needs -d",
+    dest="conditions",
+    action='append',
+    default=[])
+
+parser.add_argument(
+    "--run-to-frame",
+    help="runs till this frame before pausing, needs -d",
+    dest="run_to_frame",
+    type=int)
+
 args = parser.parse_args()
+if args.profile and args.trace != 'off':
+    parser.error("--profile and --trace can't be used together")
+if args.record and args.debug:
+    parser.error("--record can't be used with -d")
+if args.threaded and (args.debug or args.record):
+    parser.error("--threaded can't be used with -d or --record")
+if not args.debug and (args.breakpoints or args.watchpoints or
+                       args.conditions or args.run_to_frame is not None):
+    parser.error("--break, --watch, --break-if and --run-to-frame need -d")
+
+
+def parse_address(text):
+    """
+        Splits "0x300:16" into (0x300, '16'), the second part is None when
+        it's missing.
+    """
+    address, _, rest = text.partition(':')
+    return int(address, 0), rest or None
+
+
+# (address, condition), (address, length) and conditions for the debugger
+breakpoints = []
+watchpoints = []
+conditions = []
+if args.debug:
+    from debugger import parse_condition
+    try:
+        for text in args.breakpoints:
+            address, condition = parse_address(text)
+            if condition is not None:
+                condition = parse_condition(condition)
+            breakpoints.append((address, condition))
+        for text in args.watchpoints:
+            address, length = parse_address(text)
+            watchpoints.append((address, int(length or '1', 0)))
+        for text in args.conditions:
+            conditions.append(parse_condition(text))
+    except ValueError as error:
+        parser.error("bad debugger option {!r}: {}".format(text, error))
+
+if args.trace != 'off':
+    fh = logging.FileHandler('last.log')
+    fh.setLevel(logging.INFO)
+    logger.addHandler(fh)
 
 # The Chip8 had 4KB of RAM so that means an array of 4096 bytes
 MEM_SIZE = 4096
@@ -43,9 +193,14 @@ WIDTH = 64
 HEIGHT = 32
 OFFSET = 0x200
 SCALE = args.scale
-TIMER = pygame.USEREVENT + 1
-TIMERS_UPDATE = config.timers_delay
 DEBUG = args.debug
+# Only what is used, the mixer starts with the first beep and the font
+# module in debug mode
+pygame.display.init()
+if args.engine == 'block':
+    from translator import BlockCPU as Engine
+else:
+    Engine = CPU
 
 if not DEBUG:
     pygame.key.set_repeat(1, 17)
@@ -56,57 +211,255 @@ else:
 # Initializing all the emulator objects
 display = Display(WIDTH, HEIGHT, SCALE, DEBUG)
 ram = RAM(MEM_SIZE, OFFSET)
-cpu = CPU(ram, display)
-keys = config.keys
-if not DEBUG:
-    logger_cpu.propagate = False
-pause_toggle = True
-clock = pygame.time.Clock()
+keypad = PygameKeypad()
+if args.threaded:
+    # The core thread draws into its own screen and gets the keys sent over
+    cpu = Engine(ram, FrameBuffer(WIDTH, HEIGHT), KeyState(), PygameAudio())
+else:
+    cpu = Engine(ram, display, keypad, PygameAudio())
+tracer = Tracer(LEVELS[args.trace], args.trace_file)
+profiler = None
+if args.profile:
+    from profiler import Profiler
+    profiler = Profiler()
+debugger = None
+if DEBUG:
+    from debugger import Debugger
+    debugger = Debugger(cpu)
+# Starts running when there's something to stop at
+pause_toggle = not (args.breakpoints or args.watchpoints or args.conditions
+                    or args.run_to_frame is not None)
+
+# What the keys do while paused
+PAUSED_KEYS = {
+    pygame.K_f: 'step',
+    pygame.K_o: 'over',
+    pygame.K_u: 'out',
+    pygame.K_n: 'frame',
+    pygame.K_p: 'continue'
+}
+
+
+def setup_debugger(args):
+    if breakpoints:
+        from analyzer import load_analysis
+        code = set(load_analysis(args.rom).code)
+    for address, condition in breakpoints:
+        if address not in code:
+            logger.warning(
+                "No instruction found at {}, the breakpoint may never "
+                "stop".format(hex(address)))
+        debugger.add_breakpoint(address, condition)
+    for address, length in watchpoints:
+        debugger.add_watchpoint(address, length)
+    for condition in conditions:
+        debugger.add_condition(condition)
+
+
+def run_debugged(function, *args):
+    """
+        Calls function and returns why the debugger stopped it, None when it
+        didn't.
+    """
+    from debugger import DebuggerBreak
+    try:
+        function(*args)
+    except DebuggerBreak as stop:
+        logger.info("Paused, {}".format(stop.reason))
+        return stop.reason
+    return None
 
 
 def wait():
-    global pause_toggle
+    """
+        Sleeps till a key does something and returns what, see PAUSED_KEYS.
+    """
+    # The tone would keep going while waiting, the next tick starts it again
+    cpu.audio.stop()
+    cpu.sound_playing = False
     while True:
+        # Blocks instead of polling, so a paused emulator sits idle
+        event = pygame.event.wait()
+        keypad.handle_event(event)
+        if event.type == pygame.QUIT:
+            return 'quit'
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_d:
+                cpu.dump_memory("memory")
+            if event.key in PAUSED_KEYS:
+                return PAUSED_KEYS[event.key]
+
+
+def step(action):
+    """
+        Runs what a key pressed while paused asked for, except for quitting
+        and running a frame.
+    """
+    global pause_toggle
+    if action == 'continue':
+        pause_toggle = False
+    elif action == 'out':
+        debugger.step_out()
+        pause_toggle = False
+    elif action == 'over' and debugger.step_over():
+        pause_toggle = False
+    else:
+        # Stepping goes an instruction at a time instead of a frame
+        cpu.run_cycles(1)
+        keypad.next_frame()
+
+
+def save_state(cpu, path):
+    with open(path, 'wb') as file:
+        file.write(cpu.save_state())
+    logger.info("Saved state into {}".format(path))
+
+
+def load_state(cpu, path):
+    try:
+        with open(path, 'rb') as file:
+            cpu.load_state(file.read())
+    except (IOError, ValueError) as error:
+        logger.warning("Couldn't load state from {}: {}".format(path, error))
+        return
+    logger.info("Loaded state from {}".format(path))
+
+
+def start_cpu(args):
+    """
+        Opens the window, loads the rom and attaches the tools. Returns the
+        random seed.
+    """
+    display.display_setup()
+
+    cpu.initalize_cpu(args.rom)
+    seed = args.seed if args.seed is not None else random.getrandbits(64)
+    cpu.rng.seed(seed)
+    logger.info("Random seed {}".format(seed))
+    tracer.attach(cpu)
+    if profiler is not None:
+        profiler.attach(cpu)
+    # After the tracer and profiler so it runs through their run_cycle
+    if debugger is not None:
+        setup_debugger(args)
+    return seed
+
+
+def threaded_loop(args):
+    """
+        Runs the CPU on the core thread, this one only shows the latest
+        frame and sends the keypad over.
+    """
+    from threaded import EmulationThread
+    start_cpu(args)
+    core = EmulationThread(
+        FrameScheduler(cpu, args.speed, args.turbo), args.frames)
+    core.start()
+    clock = pygame.time.Clock()
+    state = None
+
+    while core.is_alive():
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
+            keypad.handle_event(event)
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_d:
-                    cpu.dump_memory("memory")
-                if event.key == pygame.K_p:
-                    pause_toggle = False
-                    return
-                if event.key == pygame.K_f:
-                    return
-            if event.type == TIMER:
-                cpu.update_timers()
+                if event.key == pygame.K_l:
+                    core.call(lambda: cpu.reset_cpu(args.rom))
+                if event.key == pygame.K_F5:
+                    core.call(lambda: save_state(cpu, args.rom + '.state'))
+                if event.key == pygame.K_F9:
+                    core.call(lambda: load_state(cpu, args.rom + '.state'))
+                if event.key == pygame.K_F2 and profiler is not None:
+                    core.call(lambda: profiler.dump(args.profile_file))
+            if event.type == pygame.QUIT:
+                core.stop()
+        if (keypad.mask, keypad.pressed) != state:
+            state = (keypad.mask, keypad.pressed)
+            core.send_input(*state)
+        keypad.next_frame()
+
+        rows = core.mailbox.take()
+        if rows is not None:
+            display.update_rows(rows)
+            display.update_display()
+            display.flip()
+        clock.tick(FRAME_RATE)
+
+    core.join()
+    if core.error is not None:
+        raise core.error
 
 
 def main_loop(args):
     """
         Runs the main loop.
     """
-    timer = args.timer
-    display.display_setup()
-
-    cpu.initalize_cpu(args.rom)
-    pygame.time.set_timer(TIMER, TIMERS_UPDATE)
+    seed = start_cpu(args)
+    scheduler = FrameScheduler(cpu, args.speed, args.turbo)
+    recorder = None
+    if args.record:
+        from replay import Recorder
+        recorder = Recorder(args.record, args.rom, seed, cpu.cycles_per_tick)
+    # Going back in time can't be replayed
+    rewind = None
+    if args.rewind > 0 and recorder is None:
+        from rewind import Rewind
+        rewind = Rewind(cpu, args.rewind)
     running = True
     global pause_toggle
+    # The frame to pause at
+    pause_at = args.run_to_frame
 
     while running:
-        pygame.time.wait(timer)
         if DEBUG and pause_toggle:
-            wait()
-        cpu.run_cycle()
+            action = wait()
+            if action == 'quit':
+                break
+            # Whatever runs next doesn't stop at a breakpoint on pc first
+            debugger.resume = cpu.pc
+            if action == 'frame':
+                pause_at = scheduler.frames + 1
+                pause_toggle = False
+            else:
+                run_debugged(step, action)
+        elif rewind is not None and \
+                pygame.key.get_pressed()[pygame.K_BACKSPACE]:
+            # Holding backspace goes back a frame every frame
+            rewind.step_back()
+            scheduler.throttle()
+        else:
+            if recorder is not None:
+                recorder.record_frame(keypad)
+            stopped = None
+            if debugger is None:
+                scheduler.run_frame()
+            else:
+                stopped = run_debugged(scheduler.run_frame)
+            if stopped is not None:
+                # The rest of the frame runs once carrying on
+                pause_toggle = True
+            else:
+                if rewind is not None:
+                    rewind.capture()
+                if pause_at is not None and scheduler.frames >= pause_at:
+                    pause_at = None
+                    pause_toggle = True
+                scheduler.throttle()
+            if not pause_toggle and not scheduler.should_present():
+                continue
+
         for event in pygame.event.get():
+            keypad.handle_event(event)
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_l:
+                if event.key == pygame.K_l and recorder is None:
                     cpu.reset_cpu(args.rom)
                 if event.key == pygame.K_p:
                     pause_toggle = True
-            if event.type == TIMER:
-                cpu.update_timers()
+                if event.key == pygame.K_F5:
+                    save_state(cpu, args.rom + '.state')
+                if event.key == pygame.K_F9 and recorder is None:
+                    load_state(cpu, args.rom + '.state')
+                if event.key == pygame.K_F2 and profiler is not None:
+                    profiler.dump(args.profile_file)
             if event.type == pygame.QUIT:
                 running = False
 
@@ -118,21 +471,36 @@ def main_loop(args):
                     cpu.pc,
                     cpu.I,
                     cpu.opcode)
-            pygame.display.flip()
+            display.flip()
 
-        if cpu.opcode == 0x00FD:
+        if cpu.exited:
             running = False
+        if args.frames is not None and scheduler.frames >= args.frames:
+            running = False
+
+    if recorder is not None:
+        recorder.close(display)
+
+    if rewind is not None:
+        logger.info("Rewind captures took {:.3f} ms per frame".format(
+            rewind.capture_cost() * 1000))
 
 
 if __name__ == '__main__':
     try:
-        main_loop(args)
+        if args.threaded:
+            threaded_loop(args)
+        else:
+            main_loop(args)
     except Exception:
-        logger.info(
+        logger.error(
             " Current Addr: {}\n Curr Opcode: {}\n Nxt Opcode: {}".format(
                 hex(cpu.pc),
                 hex(cpu.memory[cpu.pc] << 8 | cpu.memory[cpu.pc + 1]),
                 hex(cpu.memory[cpu.pc+1] << 8 | cpu.memory[cpu.pc + 2])))
         logger.exception("Here be crash")
 
+    tracer.close()
+    if profiler is not None:
+        profiler.dump(args.profile_file)
     pygame.quit()
@@ -0,0 +1,152 @@
+"""
+    Profiling. Like the tracer nothing here runs unless a Profiler is
+    attached to a CPU, attaching swaps in a run_cycle that times every
+    instruction and counts it per opcode and per address. The report lists
+    the handlers that took the most time, the hottest addresses and loops and
+    how much of the time went into drawing.
+"""
+import json
+import time
+from cpu import CPU
+from hooks import CycleHook
+
+DRAW_HANDLER = 'draw_pixel_to_display'
+
+
+class Profiler(CycleHook):
+    def __init__(self):
+        self.cpu = None
+        self.lookup_handler = None
+        # Executions and seconds, indexed by the opcode
+        self.opcode_counts = [0] * 0x10000
+        self.opcode_times = [0.0] * 0x10000
+        # The same indexed by the address of the instruction
+        self.address_counts = []
+        self.address_times = []
+        # Times every backwards jump was taken, by (target, address)
+        self.loops = {}
+
+    def attach(self, cpu):
+        self.lookup_handler = cpu.lookup_handler
+        if len(self.address_counts) != len(cpu.memory):
+            self.address_counts = [0] * len(cpu.memory)
+            self.address_times = [0.0] * len(cpu.memory)
+        super(Profiler, self).attach(cpu)
+
+    def run_cycle(self):
+        """
+            Interprets a single instruction and accounts for it.
+        """
+        cpu = self.cpu
+        pc = cpu.pc
+        start = time.perf_counter()
+        executed = CPU.run_cycle(cpu)
+        elapsed = time.perf_counter() - start
+        opcode = cpu.opcode
+        self.opcode_counts[opcode] += 1
+        self.opcode_times[opcode] += elapsed
+        self.address_counts[pc] += 1
+        self.address_times[pc] += elapsed
+        # Calls and returns go backwards too without being loops
+        if cpu.pc <= pc and opcode >> 12 != 0x2 and opcode != 0x00EE:
+            loop = (cpu.pc, pc)
+            self.loops[loop] = self.loops.get(loop, 0) + 1
+        return executed
+
+    def report(self, top=10):
+        """
+            Returns the profile as a dict of plain values.
+        """
+        handlers = {}
+        families = {}
+        for opcode, count in enumerate(self.opcode_counts):
+            if not count:
+                continue
+            elapsed = self.opcode_times[opcode]
+            handler = self.lookup_handler(opcode)
+            name = handler.__name__ if handler is not None else 'unknown'
+            family = '{:X}xxx'.format(opcode >> 12)
+            for table, key in ((handlers, name), (families, family)):
+                entry = table.setdefault(key, [0, 0.0])
+                entry[0] += count
+                entry[1] += elapsed
+
+        total = sum(entry[1] for entry in handlers.values())
+        draw = handlers.get(DRAW_HANDLER, (0, 0.0))[1]
+        addresses = sorted(
+            (address for address, count in enumerate(self.address_counts)
+             if count),
+            key=lambda address: self.address_times[address],
+            reverse=True)[:top]
+        loops = sorted(
+            ((start, end, taken,
+              sum(self.address_times[start:end + 2]))
+             for (start, end), taken in self.loops.items()),
+            key=lambda loop: loop[3],
+            reverse=True)[:top]
+
+        def ranked(table, label):
+            return [
+                {label: key, 'count': count, 'time': elapsed}
+                for key, (count, elapsed) in sorted(
+                    table.items(), key=lambda item: item[1][1], reverse=True)]
+
+        return {
+            'instructions': sum(entry[0] for entry in handlers.values()),
+            'time': total,
+            'draw_time': draw,
+            'other_time': total - draw,
+            'handlers': ranked(handlers, 'handler')[:top],
+            'families': ranked(families, 'family'),
+            'addresses': [
+                {'address': hex(address),
+                 'count': self.address_counts[address],
+                 'time': self.address_times[address]}
+                for address in addresses],
+            'loops': [
+                {'start': hex(start), 'end': hex(end), 'iterations': taken,
+                 'time': elapsed}
+                for start, end, taken, elapsed in loops]
+        }
+
+    def dump(self, path, top=10):
+        """
+            Writes the report to path, as JSON when it ends in .json and as
+            text otherwise.
+        """
+        report = self.report(top)
+        with open(path, 'w') as file:
+            if path.endswith('.json'):
+                json.dump(report, file, indent=2)
+                file.write('\n')
+            else:
+                file.write(format_report(report))
+
+
+def format_report(report):
+    """
+        Turns a report into readable text.
+    """
+    total = report['time'] or 1
+    lines = [
+        "{} instructions in {:.3f}s".format(
+            report['instructions'], report['time']),
+        "{:.3f}s ({:.0%}) drawing, {:.3f}s ({:.0%}) everything else".format(
+            report['draw_time'], report['draw_time'] / total,
+            report['other_time'], report['other_time'] / total),
+        ""]
+    sections = (
+        ('Handlers', 'handler', 'count', report['handlers']),
+        ('Opcode families', 'family', 'count', report['families']),
+        ('Hottest addresses', 'address', 'count', report['addresses']),
+        ('Hottest loops', 'start', 'iterations', report['loops']))
+    for title, label, counter, rows in sections:
+        lines.append(title)
+        for row in rows:
+            name = row[label]
+            if 'end' in row:
+                name = '{}-{}'.format(row['start'], row['end'])
+            lines.append("  {:<32} {:>10} {:>10.3f}ms {:>5.0%}".format(
+                name, row[counter], row['time'] * 1000, row['time'] / total))
+        lines.append("")
+    return '\n'.join(lines)
@@ -0,0 +1,72 @@
+from array import array
+import logging
+import pygame
+import config
+from backends import KeyState, Audio
+
+logger = logging.getLogger(__name__)
+
+
+class PygameKeypad(KeyState):
+    """
+        Reads the keypad from the keyboard using the key map in config.py.
+        The main loop hands it the key events once per frame.
+    """
+    def __init__(self):
+        super(PygameKeypad, self).__init__()
+        # pygame key codes of letters and digits are their ord
+        self.keymap = {ord(char): key for key, char in config.keys.items()}
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN:
+            key = self.keymap.get(event.key)
+            if key is not None:
+                self.press(key)
+        elif event.type == pygame.KEYUP:
+            key = self.keymap.get(event.key)
+            if key is not None:
+                self.release(key)
+
+
+class PygameAudio(Audio):
+    """
+        A square wave at config.beep_frequency, built once and looped for as
+        long as the sound timer runs. The mixer is only started by the first
+        beep, plenty of ROMs never make one. Without a sound device it stays
+        quiet like NullAudio.
+    """
+    def __init__(self):
+        self.tone = None
+        self.silent = False
+
+    def setup(self):
+        mixer = pygame.mixer.get_init()
+        if mixer is None or mixer[1] != -16:
+            # The tone is written as signed 16 bit samples
+            pygame.mixer.quit()
+            try:
+                pygame.mixer.init(config.sample_rate, -16, 1)
+            except pygame.error as error:
+                logger.warning("No sound, the mixer didn't start: {}".format(
+                    error))
+                self.silent = True
+                return
+        rate, size, channels = pygame.mixer.get_init()
+        half = max(1, round(rate / (2 * config.beep_frequency)))
+        amplitude = int(config.beep_volume * 32767)
+        period = array('h', [amplitude] * (half * channels)
+                       + [-amplitude] * (half * channels))
+        self.tone = pygame.mixer.Sound(buffer=period.tobytes())
+
+    def start(self):
+        if self.tone is None:
+            if self.silent:
+                return
+            self.setup()
+            if self.silent:
+                return
+        self.tone.play(-1)
+
+    def stop(self):
+        if self.tone is not None:
+            self.tone.stop()
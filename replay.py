@@ -0,0 +1,178 @@
+"""
+    Input recording and replay. A recording has the random seed, the frame
+    length and a hash of the ROM, every change of the keypad with the frame
+    it happened on and the hash of the screen at the end. Replaying runs the
+    ROM headless as fast as it goes and checks that the screen comes out the
+    same:
+
+        python main.py rom --record bug.rec
+        python replay.py bug.rec rom
+"""
+import argparse
+import hashlib
+import struct
+import sys
+import time
+import config
+import headless
+from backends import KeyState
+
+MAGIC = b'C8RC'
+VERSION = 1
+# magic, version, seed, cycles per tick, rom sha1, shift quirk, load quirk
+HEADER = struct.Struct('<4sBQI20s??')
+# frame, held keys, keys that went down since the previous frame
+EVENT = struct.Struct('<IHH')
+END = 0xFFFFFFFF  # The frame of the event that ends the recording
+# frames, sha1 of the screen at the end
+TRAILER = struct.Struct('<I20s')
+
+
+def file_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).digest()
+
+
+class Recorder:
+    def __init__(self, path, rom, seed, cycles_per_tick):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, seed, cycles_per_tick, file_hash(rom),
+            config.shift_quirk, config.load_quirk))
+        self.frames = 0
+        self.last = None
+
+    def record_frame(self, keypad):
+        """
+            Call it right before every frame, with the keys the frame sees.
+        """
+        state = (keypad.mask, keypad.pressed)
+        if state != self.last:
+            self.file.write(EVENT.pack(self.frames, *state))
+            self.last = state
+        self.frames += 1
+
+    def close(self, display):
+        if self.file is None:
+            return
+        self.file.write(EVENT.pack(END, 0, 0))
+        self.file.write(TRAILER.pack(
+            self.frames, hashlib.sha1(display.to_bytes()).digest()))
+        self.file.close()
+        self.file = None
+
+
+class Recording:
+    def __init__(self, seed, cycles_per_tick, rom_hash, shift_quirk,
+                 load_quirk, events, frames, screen_hash):
+        self.seed = seed
+        self.cycles_per_tick = cycles_per_tick
+        self.rom_hash = rom_hash
+        self.shift_quirk = shift_quirk
+        self.load_quirk = load_quirk
+        self.events = events  # (frame, mask, pressed)
+        self.frames = frames
+        self.screen_hash = screen_hash
+
+
+def read_recording(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, version, seed, cycles_per_tick, rom_hash, shift_quirk, \
+        load_quirk = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} isn't a recording".format(path))
+    events = []
+    offset = HEADER.size
+    while True:
+        event = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        if event[0] == END:
+            break
+        events.append(event)
+    frames, screen_hash = TRAILER.unpack_from(data, offset)
+    return Recording(seed, cycles_per_tick, rom_hash, shift_quirk,
+                     load_quirk, events, frames, screen_hash)
+
+
+class ReplayKeypad(KeyState):
+    """
+        Plays the recorded keypad back, a frame at a time.
+    """
+    def __init__(self, events):
+        super(ReplayKeypad, self).__init__()
+        self.events = {frame: (mask, pressed)
+                       for frame, mask, pressed in events}
+        self.state = (0, 0)
+        self.frame = 0
+        self.apply()
+
+    def apply(self):
+        self.state = self.events.get(self.frame, self.state)
+        self.mask, self.pressed = self.state
+
+    def next_frame(self):
+        self.frame += 1
+        self.apply()
+
+
+def replay(recording, rom, engine='interpreter'):
+    """
+        Runs a recording and returns the CPU at the end.
+    """
+    if file_hash(rom) != recording.rom_hash:
+        raise ValueError("{} isn't the recorded rom".format(rom))
+    shift_quirk, load_quirk = config.shift_quirk, config.load_quirk
+    config.shift_quirk = recording.shift_quirk
+    config.load_quirk = recording.load_quirk
+    try:
+        keypad = ReplayKeypad(recording.events)
+        cpu = headless.make_machine(rom, engine, keypad)
+    finally:
+        config.shift_quirk, config.load_quirk = shift_quirk, load_quirk
+    cpu.rng.seed(recording.seed)
+    cpu.cycles_per_tick = recording.cycles_per_tick
+    cpu.next_tick = recording.cycles_per_tick
+    for _ in range(recording.frames):
+        cpu.run_ticks(1)
+        keypad.next_frame()
+    return cpu
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="replays a recording headless and checks the screen")
+    parser.add_argument("recording", help="path to the recording", type=str)
+    parser.add_argument("rom", help="path to the recorded rom", type=str)
+    parser.add_argument(
+        "-e",
+        help="sets the execution engine",
+        dest="engine",
+        choices=sorted(headless.ENGINES),
+        default="interpreter")
+    parser.add_argument(
+        "--show",
+        help="prints the screen at the end",
+        action='store_true',
+        dest='show',
+        default=False)
+    args = parser.parse_args(argv)
+
+    recording = read_recording(args.recording)
+    start = time.perf_counter()
+    cpu = replay(recording, args.rom, args.engine)
+    elapsed = time.perf_counter() - start
+    if args.show:
+        sys.stdout.write(headless.render_text(cpu.display) + '\n')
+    screen_hash = headless.framebuffer_hash(cpu.display)
+    matches = screen_hash == recording.screen_hash.hex()
+    sys.stdout.write("{} frames in {:.3f}s {} {}\n".format(
+        recording.frames, elapsed, screen_hash,
+        "matches" if matches else "differs from " +
+        recording.screen_hash.hex()))
+    if not matches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+    Rewinding. After every frame the whole machine is saved with
+    CPU.save_state, but only the XOR against the previous state is kept,
+    compressed. A frame rarely touches more than a few bytes of memory and a
+    few screen rows so the delta is almost all zeroes and compresses to a few
+    dozen bytes.
+"""
+from collections import deque
+import time
+import zlib
+from scheduler import FRAME_RATE
+
+
+def xor_bytes(a, b):
+    """
+        XORs two byte strings of the same length.
+    """
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')) \
+        .to_bytes(len(a), 'little')
+
+
+class Rewind:
+    def __init__(self, cpu, seconds):
+        """
+            Keeps the last seconds worth of frames.
+        """
+        self.cpu = cpu
+        self.deltas = deque(maxlen=max(1, int(seconds * FRAME_RATE)))
+        self.state = cpu.save_state()  # The newest state
+        # How long capturing took, to keep an eye on the overhead
+        self.captures = 0
+        self.capture_time = 0.0
+
+    def capture(self):
+        """
+            Records the current state, call it once per frame.
+        """
+        start = time.perf_counter()
+        state = self.cpu.save_state()
+        self.deltas.append(zlib.compress(xor_bytes(state, self.state), 1))
+        self.state = state
+        self.capture_time += time.perf_counter() - start
+        self.captures += 1
+
+    def step_back(self):
+        """
+            Restores the frame before the newest one. Returns False when
+            there is no history left.
+        """
+        if not self.deltas:
+            return False
+        self.state = xor_bytes(
+            self.state, zlib.decompress(self.deltas.pop()))
+        self.cpu.load_state(self.state)
+        return True
+
+    def frames(self):
+        return len(self.deltas)
+
+    def history_size(self):
+        """
+            Returns how many bytes the history takes up.
+        """
+        return len(self.state) + sum(len(delta) for delta in self.deltas)
+
+    def capture_cost(self):
+        """
+            Returns the average time a capture took, in seconds.
+        """
+        return self.capture_time / self.captures if self.captures else 0.0
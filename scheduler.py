@@ -0,0 +1,60 @@
+import time
+
+FRAME_RATE = 60  # The CHIP-8 timers count down at 60 Hz
+
+
+class FrameScheduler:
+    """
+        Runs the CPU a frame at a time: a fixed number of instructions in a
+        tight loop, which is also the length of a timer tick on the CPU's
+        clock. Everything else (input, rendering) is expected to happen once
+        between frames.
+    """
+    def __init__(self, cpu, instructions_per_second, turbo=False):
+        self.cpu = cpu
+        self.instructions_per_frame = max(
+            1, int(round(instructions_per_second / FRAME_RATE)))
+        cpu.cycles_per_tick = self.instructions_per_frame
+        cpu.next_tick = cpu.cycles + self.instructions_per_frame
+        self.turbo = turbo
+        self.frame_time = 1.0 / FRAME_RATE
+        self.frames = 0
+        self.next_frame = time.perf_counter()
+        self.last_present = 0
+
+    def run_frame(self):
+        """
+            Executes a frame worth of instructions, which ticks the timers
+            once. Returns the number of instructions executed.
+        """
+        executed = self.cpu.run_ticks(1)
+        self.cpu.keypad.next_frame()
+        self.frames += 1
+        return executed
+
+    def throttle(self):
+        """
+            Sleeps until the next frame is due, unless in turbo mode.
+        """
+        if self.turbo:
+            return
+        self.next_frame += self.frame_time
+        delay = self.next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -self.frame_time:
+            # Too far behind to catch up, start counting from now
+            self.next_frame = time.perf_counter()
+
+    def should_present(self):
+        """
+            Returns True when input and the screen should be handled. Every
+            frame normally, at most FRAME_RATE times a second in turbo mode.
+        """
+        if not self.turbo:
+            return True
+        now = time.perf_counter()
+        if now - self.last_present >= self.frame_time:
+            self.last_present = now
+            return True
+        return False
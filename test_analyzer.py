@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+import analyzer
+import config
+import headless
+
+
+class TestAnalyzer(unittest.TestCase):
+    # V0 = 0, call 0x20a, skip the unknown 8008 when V0 is 0, loop forever,
+    # then the subroutine drawing the sprite at 0x212 and returning
+    program = bytes([
+        0x60, 0x00, 0x22, 0x0A, 0x30, 0x00, 0x80, 0x08, 0x12, 0x08,
+        0xA2, 0x12, 0xD0, 0x05, 0x00, 0xEE, 0x00, 0x00,
+        0xF0, 0x90, 0x90, 0x90, 0xF0])
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.rom = os.path.join(self.directory, 'test.ch8')
+        with open(self.rom, 'wb') as file:
+            file.write(self.program)
+        self.cache = os.path.join(self.directory, 'cache')
+
+    def test_analysis(self):
+        analysis = analyzer.analyze(self.program)
+        self.assertEqual(analysis.code, list(range(0x200, 0x210, 2)))
+        self.assertEqual(analysis.blocks, [
+            [0x200, 0x204, [0x204], 0x20A],
+            [0x204, 0x206, [0x206, 0x208], None],
+            [0x206, 0x208, [], None],
+            [0x208, 0x20A, [0x208], None],
+            [0x20A, 0x210, [], None]])
+        self.assertEqual(analysis.subroutines, [[0x20A, 0x20A, 0x210]])
+        self.assertEqual(analysis.sprites, [[0x212, 0x217]])
+        self.assertEqual(analysis.unknown, [[0x206, 0x8008]])
+        self.assertEqual(analysis.memory_map(), [
+            [0x200, 0x210, 'code'],
+            [0x210, 0x212, 'unused'],
+            [0x212, 0x217, 'sprite']])
+        self.assertEqual(analysis.listing[0x20C], 'DRW V0, V0, 5')
+        self.assertEqual(analysis.listing[0x206], 'DW 0x8008')
+
+    def test_cached_by_hash(self):
+        analysis = analyzer.load_analysis(self.rom, self.cache)
+        self.assertEqual(os.listdir(self.cache),
+                         [analysis.rom + '-shift0-load0.json'])
+        with mock.patch('analyzer.analyze') as analyze:
+            cached = analyzer.load_analysis(self.rom, self.cache)
+        self.assertFalse(analyze.called)
+        self.assertEqual(cached.to_json(), analysis.to_json())
+
+    def test_quirks_get_their_own_analysis(self):
+        analyzer.load_analysis(self.rom, self.cache)
+        with mock.patch.object(config, 'load_quirk', True), \
+                mock.patch('analyzer.analyze',
+                           wraps=analyzer.analyze) as analyze:
+            analyzer.load_analysis(self.rom, self.cache)
+        self.assertTrue(analyze.called)
+        self.assertEqual(len(os.listdir(self.cache)), 2)
+
+    def test_warm_up_runs_the_same(self):
+        analysis = analyzer.load_analysis(self.rom, None)
+        for engine in headless.ENGINES:
+            cold = headless.make_machine(self.rom, engine)
+            warm = headless.make_machine(self.rom, engine)
+            cold.rng.seed(1)
+            warm.rng.seed(1)
+            warm.warm_up(analysis)
+            self.assertIsNotNone(warm.decode_cache[0x20C])
+            # The unknown opcode is left alone
+            self.assertIsNone(warm.decode_cache[0x206])
+            cold.run_cycles(100)
+            warm.run_cycles(100)
+            self.assertEqual(warm.save_state(), cold.save_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import mock
+
+import pygame
+
+import headless
+from backends import KeyState, ScriptedKeypad
+from pygame_backends import PygameAudio, PygameKeypad
+from scheduler import FrameScheduler
+
+
+class TestKeyState(unittest.TestCase):
+    def test_mask(self):
+        keypad = KeyState()
+        keypad.press(0x3)
+        keypad.press(0xF)
+        self.assertEqual(keypad.mask, 0x8008)
+        self.assertTrue(keypad.is_pressed(0xF))
+        self.assertFalse(keypad.is_pressed(0x4))
+        self.assertFalse(keypad.is_pressed(0x13))
+        self.assertFalse(keypad.is_pressed(-1))
+        keypad.release(0x3)
+        self.assertEqual(keypad.mask, 0x8000)
+
+    def test_wait_for_key_sees_presses_once(self):
+        keypad = KeyState()
+        self.assertIsNone(keypad.wait_for_key())
+        keypad.set_mask(0b1010)
+        self.assertEqual(keypad.wait_for_key(), 1)
+        self.assertEqual(keypad.wait_for_key(), 3)
+        self.assertIsNone(keypad.wait_for_key())
+        # Holding a key down isn't a new press
+        keypad.set_mask(0b1010)
+        self.assertIsNone(keypad.wait_for_key())
+        keypad.press(5)
+        keypad.next_frame()
+        self.assertIsNone(keypad.wait_for_key())
+
+    def test_scripted(self):
+        keypad = ScriptedKeypad([0b1, 0b11, 0])
+        self.assertEqual(keypad.mask, 0b1)
+        keypad.next_frame()
+        self.assertEqual(keypad.wait_for_key(), 1)
+        keypad.next_frame()
+        keypad.next_frame()
+        self.assertEqual(keypad.mask, 0)
+
+    def test_pygame_events(self):
+        keypad = PygameKeypad()
+        keypad.handle_event(pygame.event.Event(pygame.KEYDOWN, key=ord('z')))
+        keypad.handle_event(pygame.event.Event(pygame.KEYDOWN, key=ord('p')))
+        self.assertEqual(keypad.mask, 1 << 0xA)
+        keypad.handle_event(pygame.event.Event(pygame.KEYUP, key=ord('z')))
+        self.assertEqual(keypad.mask, 0)
+
+    def test_audio_without_a_sound_device(self):
+        audio = PygameAudio()
+        with mock.patch('pygame.mixer.get_init', return_value=None), \
+                mock.patch('pygame.mixer.init',
+                           side_effect=pygame.error('No such audio device')) \
+                as init:
+            audio.start()
+            audio.stop()
+            audio.start()
+        # Gives up after the first try
+        self.assertEqual(init.call_count, 1)
+        self.assertTrue(audio.silent)
+
+
+class TestWaitingForKey(unittest.TestCase):
+    def setUp(self):
+        self.keypad = ScriptedKeypad([0, 1 << 7])
+        self.cpu = headless.make_machine(keypad=self.keypad)
+        # V0 = next key, then loop forever
+        self.cpu.memory[0x200:0x206] = [0xF0, 0x0A, 0x12, 0x04, 0x12, 0x04]
+        self.cpu.pc = 0x200
+
+    def test_suspends_until_a_key_comes(self):
+        self.cpu.delay_timer = 5
+        scheduler = FrameScheduler(self.cpu, 600)
+        self.assertEqual(scheduler.run_frame(), 10)
+        self.assertTrue(self.cpu.waiting_for_key)
+        self.assertEqual(self.cpu.pc, 0x200)
+        self.assertEqual(self.cpu.delay_timer, 4)
+        scheduler.run_frame()
+        self.assertEqual(self.cpu.pc, 0x204)
+        self.assertEqual(self.cpu.registers[0], 7)
+        self.assertEqual(self.cpu.cycles, 20)
+
+    def test_waiting_skips_instructions(self):
+        with mock.patch.object(
+                self.keypad, 'wait_for_key',
+                wraps=self.keypad.wait_for_key) as wait_for_key:
+            self.cpu.run_cycles(1000)
+        self.assertEqual(self.cpu.cycles, 1000)
+        # Only up to the first timer tick
+        self.assertEqual(wait_for_key.call_count, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch
+from test_headless import PROGRAM, RANDOM_PROGRAM
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        roms = {
+            'draw.ch8': PROGRAM,
+            'exit.ch8': bytes([0x00, 0xFD]),
+            'random.ch8': RANDOM_PROGRAM,
+            'unknown.ch8': bytes([0xF0, 0xFF])
+        }
+        for name, rom in roms.items():
+            with open(os.path.join(self.directory, name), 'wb') as file:
+                file.write(rom)
+
+    def test_run_rom(self):
+        result = batch.run_rom(
+            os.path.join(self.directory, 'draw.ch8'), 1000)
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(result['cycles'], 1000)
+        self.assertEqual(len(result['framebuffer']), 40)
+
+    def test_run_batch(self):
+        roms = batch.find_roms(self.directory)
+        results = batch.run_batch(roms, 1000, workers=2)
+        self.assertEqual([result['rom'] for result in results], roms)
+        self.assertEqual([result['status'] for result in results],
+                         ['ok', 'exited', 'ok', 'unknown_opcode'])
+        self.assertLess(results[1]['cycles'], 1000)
+
+    def test_manifest(self):
+        path = os.path.join(self.directory, 'manifest.txt')
+        with open(path, 'w') as manifest:
+            manifest.write('# the ones that draw\ndraw.ch8\n\nrandom.ch8\n')
+        self.assertEqual(
+            batch.find_roms(path),
+            [os.path.join(self.directory, 'draw.ch8'),
+             os.path.join(self.directory, 'random.ch8')])
+
+    def test_reports(self):
+        results = [batch.run_rom(
+            os.path.join(self.directory, 'unknown.ch8'), 100)]
+        file = io.StringIO()
+        batch.write_report(results, file, 'json')
+        self.assertEqual(json.loads(file.getvalue()), results)
+        file = io.StringIO()
+        batch.write_report(results, file, 'csv')
+        self.assertEqual(file.getvalue().splitlines()[0],
+                         ','.join(batch.FIELDS))
+
+
+if __name__ == '__main__':
+    unittest.main()
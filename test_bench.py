@@ -0,0 +1,51 @@
+import unittest
+
+import bench
+import headless
+
+
+class TestBench(unittest.TestCase):
+    def test_micro_covers_every_handler(self):
+        results = bench.bench_micro(iterations=10)
+        cpu = headless.make_machine()
+        handlers = set()
+        for table in (cpu.zero_operation_lookup,
+                      cpu.logical_operation_lookup,
+                      cpu.input_operation_lookup,
+                      cpu.other_operation_lookup):
+            handlers.update(handler.__name__ for handler in table.values())
+        names = set(name.split('.')[2] for name in results)
+        self.assertLessEqual(handlers - {'ret_from_subroutine'}, names)
+        self.assertIn('call_and_return', names)
+
+    def test_macro(self):
+        results = bench.bench_macro(frames=5)
+        self.assertEqual(
+            len(results),
+            len(bench.SYNTHETIC_ROMS) * (len(headless.ENGINES) * 3 + 1))
+        self.assertGreater(results['macro.draw.block.ips']['value'], 0)
+        self.assertGreater(results['macro.draw.block_speedup']['value'], 0)
+
+    def test_startup(self):
+        results = bench.bench_startup(runs=1)
+        for name, entry in results.items():
+            self.assertEqual(name, 'startup.main')
+            self.assertGreater(entry['value'], 0)
+
+    def test_compare(self):
+        baseline = {
+            'fast': bench.result(100, 'instr/s', 'higher'),
+            'slow': bench.result(100, 'ns', 'lower'),
+            'gone': bench.result(100, 'ns', 'lower')
+        }
+        results = {
+            'fast': bench.result(80, 'instr/s', 'higher'),
+            'slow': bench.result(105, 'ns', 'lower'),
+            'new': bench.result(1, 'ns', 'lower')
+        }
+        regressions = bench.compare(results, baseline, 0.1)
+        self.assertEqual([name for name, _, _, _ in regressions], ['fast'])
+
+
+if __name__ == '__main__':
+    unittest.main()
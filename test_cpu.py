@@ -1,8 +1,11 @@
+import os
+import tempfile
 import unittest
 import mock
 import bit_utils
 
 from cpu import CPU, UnknownOpcodeException
+from framebuffer import FrameBuffer
 import ram
 
 
@@ -157,6 +160,217 @@ class TestCPU(unittest.TestCase):
                 x = bit_utils.wrap_around(number, 64)
                 self.assertTrue(x < 64)
 
+    def test_decode_cache_reuses_entries(self):
+        """
+            An address is decoded once and executed from the cache after that
+        """
+        self.cpu.memory[0x200:0x204] = [0x70, 0x01, 0x12, 0x00]
+        self.cpu.pc = 0x200
+        for _ in range(10):
+            self.cpu.run_cycle()
+        self.assertEqual(self.cpu.registers[0], 5)
+        self.assertEqual(self.cpu.decode_cache[0x200][0], 0x7001)
+        self.assertEqual(self.cpu.decode_cache[0x202][0], 0x1200)
+
+    def test_timers_tick_on_the_cycle_count(self):
+        self.cpu.memory[0x200:0x204] = [0x70, 0x01, 0x12, 0x00]
+        self.cpu.pc = 0x200
+        self.cpu.cycles_per_tick = 4
+        self.cpu.next_tick = 4
+        self.cpu.delay_timer = 10
+        self.assertEqual(self.cpu.run_cycles(3), 3)
+        self.assertEqual(self.cpu.delay_timer, 10)
+        self.assertEqual(self.cpu.run_cycles(9), 9)
+        self.assertEqual(self.cpu.delay_timer, 7)
+        self.assertEqual(self.cpu.cycles, 12)
+
+    def test_run_ticks(self):
+        self.cpu.memory[0x200:0x204] = [0x70, 0x01, 0x12, 0x00]
+        self.cpu.pc = 0x200
+        self.cpu.cycles_per_tick = 4
+        self.cpu.next_tick = 4
+        self.cpu.delay_timer = 10
+        self.cpu.run_cycles(1)
+        self.assertEqual(self.cpu.run_ticks(3), 11)
+        self.assertEqual(self.cpu.delay_timer, 7)
+        self.assertEqual(self.cpu.run_ticks(0), 0)
+
+    def test_sound_starts_and_stops_on_edges(self):
+        self.cpu.audio = mock.MagicMock()
+        self.cpu.sound_timer = 3
+        for _ in range(6):
+            self.cpu.update_timers()
+        self.cpu.audio.start.assert_called_once_with()
+        self.cpu.audio.stop.assert_called_once_with()
+        self.assertEqual(self.cpu.sound_timer, 0)
+
+    def run_program(self, program, instructions, fusion=True, idle=True,
+                    engine=None):
+        cpu = (engine or type(self.cpu))(
+            ram.RAM(self.MEM_SIZE, self.OFFSET), FrameBuffer(64, 32))
+        cpu.rng.seed(0)
+        cpu.fusion = fusion
+        cpu.idle_skip = idle
+        for offset, opcode in enumerate(program):
+            cpu.memory[0x200 + offset * 2:0x202 + offset * 2] = \
+                opcode.to_bytes(2, 'big')
+        cpu.pc = 0x200
+        cpu.cycles_per_tick = 7
+        cpu.next_tick = 7
+        cpu.delay_timer = 50
+        cpu.run_cycles(instructions)
+        return cpu
+
+    def test_fusion_parity(self):
+        program = [
+            0x8333,  # 0x200 V3 ^= V3
+            0x6005,  # 0x202 V0 = 5
+            0x610A,  # 0x204 V1 = 10
+            0xD011,  # 0x206 draw at (V0, V1)
+            0xA300,  # 0x208 I = 0x300
+            0xF355,  # 0x20A store V0-V3 at I
+            0xA300,  # 0x20C I = 0x300
+            0xF265,  # 0x20E load V0-V2 from I
+            0x72FE,  # 0x210 V2 += 0xFE
+            0x3204,  # 0x212 skip if V2 == 4
+            0x1210,  # 0x214 jump 0x210
+            0x7301,  # 0x216 V3 += 1
+            0x4310,  # 0x218 skip if V3 != 0x10
+            0x1200,  # 0x21A jump 0x200
+            0x1216   # 0x21C jump 0x216
+        ]
+        for instructions in (1, 2, 3, 40, 301):
+            plain = self.run_program(program, instructions, False, engine=CPU)
+            fused = self.run_program(program, instructions, True, engine=CPU)
+            self.assertEqual(fused.save_state(), plain.save_state())
+            self.assertEqual(fused.opcode, plain.opcode)
+            self.assertEqual(fused.display.rows, plain.display.rows)
+        report = fused.fusion_report()
+        self.assertEqual(report['instructions'], 301)
+        self.assertGreater(report['fused'], 0)
+        self.assertEqual(set(report['idioms']), {
+            'zero_register', 'sprite_setup', 'load_store', 'loop_counter'})
+
+    def test_fusion_dropped_by_store(self):
+        program = [
+            0x6005,  # 0x200 V0 = 5
+            0x6100,  # 0x202 V1 = 0
+            0xD011,  # 0x204 draw at (V0, V1)
+            0xA202,  # 0x206 I = 0x202
+            0x6061,  # 0x208 V0 = 0x61
+            0x6103,  # 0x20A V1 = 0x03
+            0xF155,  # 0x20C store V0-V1 at 0x202, V1 = 3 from now on
+            0x1200   # 0x20E jump 0x200
+        ]
+        cpu = self.run_program(program, 7, engine=CPU)
+        self.assertEqual(cpu.fused[0x200], None)
+        cpu.run_cycles(4)  # The jump back and the sprite setup
+        self.assertEqual(cpu.registers[1], 3)
+        self.assertEqual(cpu.fused[0x200][1].__name__, 'sprite_setup')
+
+    def test_idle_loop_parity(self):
+        program = [
+            0x6A03,  # 0x200 VA = 3
+            0xFA15,  # 0x202 delay timer = VA
+            0xF107,  # 0x204 V1 = delay timer
+            0x3100,  # 0x206 skip if V1 == 0
+            0x1204,  # 0x208 jump 0x204
+            0x7201,  # 0x20A V2 += 1
+            0x6305,  # 0x20C V3 = 5
+            0xE3A1,  # 0x20E skip if key V3 isn't held
+            0x1214,  # 0x210 jump 0x214
+            0x120E,  # 0x212 jump 0x20E
+            0x7401,  # 0x214 V4 += 1
+            0x1202   # 0x216 jump 0x202
+        ]
+        for instructions in (5, 24, 41, 100, 333):
+            spun = self.run_program(program, instructions, idle=False)
+            skipped = self.run_program(program, instructions)
+            self.assertEqual(skipped.save_state(), spun.save_state())
+        self.assertGreater(skipped.idle_instructions, 100)
+        self.assertEqual(skipped.registers[2], 1)
+        # Holding 5 lets it through the key loop
+        skipped.keypad = spun.keypad = mock.MagicMock()
+        skipped.keypad.is_pressed.return_value = True
+        skipped.run_cycles(100)
+        spun.run_cycles(100)
+        self.assertEqual(skipped.save_state(), spun.save_state())
+        self.assertGreater(skipped.registers[4], 0)
+
+    def test_decode_cache_invalidated_by_store(self):
+        """
+            Fx55 overwriting an already decoded instruction drops it from the
+            cache so the new one gets executed.
+        """
+        self.cpu.memory[0x200:0x204] = [0x60, 0x01, 0x00, 0xE0]
+        self.cpu.pc = 0x200
+        self.cpu.run_cycle()
+        self.assertEqual(self.cpu.registers[0], 1)
+        # Stores V0 = 0x61 and V1 = 0x05 over the instruction at 0x200
+        self.cpu.registers[0] = 0x61
+        self.cpu.registers[1] = 0x05
+        self.cpu.I = 0x200
+        self.cpu.opcode = 0xF155
+        self.cpu.decode_opcode()
+        self.assertIsNone(self.cpu.decode_cache[0x200])
+        self.cpu.pc = 0x200
+        self.cpu.run_cycle()
+        self.assertEqual(self.cpu.registers[1], 5)
+
+    def test_decode_cache_invalidated_by_bcd(self):
+        """
+            Fx33 also drops the instruction that starts a byte before I.
+        """
+        self.cpu.memory[0x200:0x202] = [0x60, 0x01]
+        self.cpu.pc = 0x200
+        self.cpu.run_cycle()
+        self.cpu.I = 0x201
+        self.cpu.opcode = 0xF033
+        self.cpu.decode_opcode()
+        self.assertIsNone(self.cpu.decode_cache[0x200])
+
+    def test_decode_cache_invalidated_by_load_rom(self):
+        self.cpu.memory[0x200:0x202] = [0x60, 0x01]
+        self.cpu.pc = 0x200
+        self.cpu.run_cycle()
+        with tempfile.NamedTemporaryFile(delete=False) as rom:
+            rom.write(bytes([0x61, 0x02]))
+        self.addCleanup(os.remove, rom.name)
+        self.cpu.load_rom(rom.name)
+        self.cpu.pc = 0x200
+        self.cpu.run_cycle()
+        self.assertEqual(self.cpu.registers[1], 2)
+
+    def test_store_wraps_to_8_bits(self):
+        self.cpu.registers[0:3] = [0x1FE, 0x12, 0x100]
+        self.cpu.I = 0x300
+        self.cpu.opcode = 0xF255
+        self.cpu.decode_opcode()
+        self.assertEqual(list(self.cpu.memory[0x300:0x304]),
+                         [0xFE, 0x12, 0x00, 0x00])
+        self.cpu.opcode = 0xF165
+        self.cpu.decode_opcode()
+        self.assertEqual(self.cpu.registers[0:3], [0xFE, 0x12, 0x100])
+        self.cpu.I = len(self.cpu.memory) - 1
+        with self.assertRaises(IndexError):
+            self.cpu.decode_opcode()
+        self.assertEqual(len(self.cpu.registers), 16)
+
+    def test_load_rom_and_dump_memory(self):
+        with tempfile.NamedTemporaryFile(delete=False) as rom:
+            rom.write(bytes(range(10)))
+        self.addCleanup(os.remove, rom.name)
+        self.cpu.initalize_cpu(rom.name)
+        path = rom.name + '.dump'
+        self.addCleanup(os.remove, path)
+        self.cpu.dump_memory(path)
+        with open(path, 'rb') as dump:
+            memory = dump.read()
+        self.assertEqual(len(memory), self.MEM_SIZE)
+        self.assertEqual(memory[:len(self.ram.fontset)],
+                         bytes(self.ram.fontset))
+        self.assertEqual(memory[0x200:0x20B], bytes(range(10)) + b'\x00')
+
 
 if __name__ == '__main__':
     unittest.main()
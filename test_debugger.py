@@ -0,0 +1,120 @@
+import unittest
+
+import headless
+import tracer
+from debugger import Debugger, DebuggerBreak, parse_condition
+
+
+class TestDebugger(unittest.TestCase):
+    # V0 += 1, call 0x20a, jump back, (padding), V1 = V0, I = 0x300,
+    # store V0 to V1, return
+    program = [0x7001, 0x220A, 0x1200, 0x0000, 0x0000,
+               0x8100, 0xA300, 0xF155, 0x00EE]
+
+    def make_cpu(self, engine='interpreter'):
+        cpu = headless.make_machine(engine=engine)
+        for offset, opcode in enumerate(self.program):
+            cpu.memory[0x200 + offset * 2:0x202 + offset * 2] = \
+                opcode.to_bytes(2, 'big')
+        cpu.pc = 0x200
+        cpu.next_tick = cpu.cycles + cpu.cycles_per_tick
+        return cpu
+
+    def test_nothing_set_leaves_cpu_alone(self):
+        cpu = self.make_cpu()
+        debugger = Debugger(cpu)
+        debugger.add_breakpoint(0x20A)
+        debugger.remove_breakpoint(0x20A)
+        self.assertNotIn('run_instructions', vars(cpu))
+        self.assertNotIn('invalidate_code', vars(cpu))
+        self.assertTrue(cpu.idle_skip)
+
+    def test_breakpoint_stops_before_and_carries_on(self):
+        for engine in headless.ENGINES:
+            cpu = self.make_cpu(engine)
+            debugger = Debugger(cpu)
+            debugger.add_breakpoint(0x20E)
+            with self.assertRaises(DebuggerBreak):
+                cpu.run_ticks(5)
+            self.assertEqual(cpu.pc, 0x20E)
+            # 7001 220A 8100 A300
+            self.assertEqual(cpu.cycles, 4)
+            # Stops at the same place on the next time round
+            with self.assertRaises(DebuggerBreak):
+                cpu.run_ticks(5)
+            self.assertEqual(cpu.pc, 0x20E)
+            self.assertEqual(cpu.cycles, 11)
+            self.assertEqual(cpu.registers[0], 2)
+
+    def test_conditional_breakpoint(self):
+        cpu = self.make_cpu()
+        Debugger(cpu).add_breakpoint(0x200, 'V0 == 3')
+        with self.assertRaises(DebuggerBreak):
+            cpu.run_ticks(10)
+        self.assertEqual((cpu.pc, cpu.registers[0]), (0x200, 3))
+
+    def test_watchpoint(self):
+        cpu = self.make_cpu()
+        Debugger(cpu).add_watchpoint(0x301)
+        with self.assertRaises(DebuggerBreak) as stop:
+            cpu.run_ticks(5)
+        # F155 writes 0x300 and 0x301, the watched one is reported
+        self.assertEqual(stop.exception.reason, 'write to 0x301')
+        # Stops right after the Fx55
+        self.assertEqual(cpu.pc, 0x210)
+
+    def test_loading_doesnt_hit_watchpoints(self):
+        cpu = self.make_cpu()
+        state = cpu.save_state()
+        debugger = Debugger(cpu)
+        debugger.add_watchpoint(0x200, 0x100)
+        cpu.load_state(state)
+        cpu.load_fontset()
+        self.assertIsNone(debugger.watch_hit)
+        # 7001 only, then 220A
+        self.assertEqual(cpu.run_cycles(2), 2)
+
+    def test_tracer_detach_keeps_the_debugger(self):
+        for engine in headless.ENGINES:
+            cpu = self.make_cpu(engine)
+            trace = tracer.Tracer(tracer.TRACE_ALL)
+            trace.attach(cpu)
+            Debugger(cpu).add_breakpoint(0x20E)
+            trace.detach()
+            self.assertFalse(cpu.idle_skip)
+            with self.assertRaises(DebuggerBreak):
+                cpu.run_ticks(5)
+            self.assertEqual(cpu.pc, 0x20E)
+
+    def test_step_over_and_out(self):
+        cpu = self.make_cpu()
+        debugger = Debugger(cpu)
+        depth = cpu.stack_pointer
+        cpu.run_cycles(1)
+        self.assertTrue(debugger.step_over())
+        with self.assertRaises(DebuggerBreak):
+            cpu.run_ticks(5)
+        self.assertEqual((cpu.pc, cpu.cycles), (0x204, 6))
+        # Done stepping, so out of the way again
+        self.assertNotIn('run_instructions', vars(cpu))
+
+        cpu.run_cycles(3)
+        self.assertEqual(cpu.pc, 0x20A)
+        debugger.step_out()
+        with self.assertRaises(DebuggerBreak):
+            cpu.run_ticks(5)
+        self.assertEqual((cpu.pc, cpu.stack_pointer), (0x204, depth))
+
+    def test_parse_condition(self):
+        cpu = self.make_cpu()
+        cpu.registers[0xA] = 7
+        self.assertTrue(parse_condition('VA >= 0x7')(cpu))
+        self.assertFalse(parse_condition('pc != 0x200')(cpu))
+        self.assertTrue(parse_condition('VA==7')(cpu))
+        for text in ('V3 = 1', 'VG == 1', 'V3 == x'):
+            with self.assertRaises(ValueError):
+                parse_condition(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
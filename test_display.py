@@ -0,0 +1,66 @@
+import os
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame  # noqa: E402
+from display import Display  # noqa: E402
+
+
+class TestDisplay(unittest.TestCase):
+    def setUp(self):
+        pygame.display.init()
+        pygame.font.init()
+        self.display = Display(64, 32, 4)
+        self.display.display_setup()
+        self.addCleanup(pygame.display.quit)
+
+    def pixel(self, x, y):
+        return self.display.screen.get_at(
+            (x * self.display.scale, y * self.display.scale))[:3]
+
+    def test_first_update_redraws_everything(self):
+        rects = self.display.update_display()
+        self.assertEqual(rects, [pygame.Rect(0, 0, 256, 128)])
+
+    def test_only_dirty_rows_are_redrawn(self):
+        self.display.update_display()
+        self.display.draw_sprite(62, 30, [0xC0, 0xC0, 0xC0])
+        rects = self.display.update_display()
+        # The sprite wraps around the bottom, so it covers two bands
+        self.assertEqual(rects, [
+            pygame.Rect(0, 0, 256, 4),
+            pygame.Rect(0, 120, 256, 8)])
+        self.assertEqual(self.pixel(62, 30), (255, 255, 255))
+        self.assertEqual(self.pixel(63, 0), (255, 255, 255))
+        self.assertEqual(self.pixel(0, 0), (0, 0, 0))
+        self.assertEqual(self.display.update_display(), [])
+
+    def test_clear_redraws_everything(self):
+        self.display.draw_sprite(0, 0, [0xFF])
+        self.display.update_display()
+        self.display.clear_display()
+        self.assertEqual(len(self.display.update_display()), 1)
+        self.assertEqual(self.pixel(0, 0), (0, 0, 0))
+
+    def test_flip_forgets_rects(self):
+        self.display.update_display()
+        self.display.flip()
+        self.assertEqual(self.display.dirty_rects, [])
+
+    def test_overlay_only_redraws_changed_values(self):
+        display = Display(64, 32, 4, debug=True)
+        display.display_setup()
+        registers = [0] * 16
+        display.draw_registers(registers, 0x200, 0, 0x1200)
+        self.assertEqual(len(display.dirty_rects), 19)
+        display.flip()
+        registers[3] = 10
+        display.draw_registers(registers, 0x202, 0, 0x1200)
+        self.assertEqual(len(display.dirty_rects), 2)
+        display.flip()
+        display.draw_registers(registers, 0x202, 0, 0x1200)
+        self.assertEqual(display.dirty_rects, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
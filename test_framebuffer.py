@@ -0,0 +1,66 @@
+import unittest
+
+from framebuffer import FrameBuffer
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def draw_per_pixel(self, display, x, y, sprite):
+        """
+            The way sprites used to be drawn, one pixel at a time.
+        """
+        collision = False
+        for yline, pixels in enumerate(sprite):
+            y1 = (y + yline) % display.height
+            for xline in range(8):
+                x1 = (x + xline) % display.width
+                if pixels & (0x80 >> xline) != 0:
+                    if display.set_pixel(x1, y1):
+                        collision = True
+        return collision
+
+    def test_draw_sprite_matches_per_pixel(self):
+        """
+            Draws a sprite at every position, twice so that it collides and
+            erases itself, wrapping on the right and bottom edges.
+        """
+        sprite = [0xF0, 0x90, 0xA5, 0x81, 0xFF]
+        for y in range(0, 32, 3):
+            for x in range(64):
+                packed = FrameBuffer(64, 32)
+                reference = FrameBuffer(64, 32)
+                for _ in range(2):
+                    self.assertEqual(
+                        packed.draw_sprite(x, y, sprite),
+                        self.draw_per_pixel(reference, x, y, sprite))
+                    self.assertEqual(packed.rows, reference.rows)
+                    packed.draw_sprite(5, 7, sprite)
+                    self.draw_per_pixel(reference, 5, 7, sprite)
+
+    def test_wrap_around_right_edge(self):
+        display = FrameBuffer(64, 32)
+        display.draw_sprite(60, 0, [0xFF])
+        self.assertEqual(display.row_pixels(0), [1] * 4 + [0] * 56 + [1] * 4)
+
+    def test_clear_display(self):
+        display = FrameBuffer(64, 32)
+        display.draw_sprite(0, 0, [0xFF])
+        display.clear_display()
+        self.assertEqual(display.to_bytes(), bytes(8 * 32))
+        self.assertTrue(display.draw_flag)
+
+    def test_update_rows_marks_changed_rows(self):
+        display = FrameBuffer(64, 32)
+        display.take_dirty_rows()
+        rows = [0] * 32
+        rows[3] = 0xF0
+        display.update_rows(rows)
+        self.assertEqual(display.take_dirty_rows(), 1 << 3)
+        self.assertTrue(display.draw_flag)
+        display.draw_flag = False
+        display.update_rows(rows)
+        self.assertEqual(display.take_dirty_rows(), 0)
+        self.assertFalse(display.draw_flag)
+
+
+if __name__ == '__main__':
+    unittest.main()
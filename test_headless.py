@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import headless
+from backends import ScriptedKeypad
+
+# Draws the sprite for the digit in V0 at (0, 0) and waits for a key
+PROGRAM = bytes([
+    0x60, 0x07,  # V0 = 7
+    0xF0, 0x29,  # I = sprite of V0
+    0xD0, 0x05,  # draw it at (V0, V0)
+    0xF1, 0x0A,  # V1 = next key
+    0x12, 0x08   # loop forever
+])
+
+# Draws random digits at random places and keeps the delay timer busy
+RANDOM_PROGRAM = bytes([
+    0xC0, 0x0F,  # V0 = random & 0xF
+    0xC1, 0x3F,  # V1 = random & 0x3F
+    0xF0, 0x29,  # I = sprite of V0
+    0xD1, 0x05,  # draw it at (V1, V1)
+    0xF1, 0x15,  # delay timer = V1
+    0x12, 0x00   # jump 0x200
+])
+
+
+class TestHeadless(unittest.TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(delete=False) as rom:
+            rom.write(PROGRAM)
+        self.rom = rom.name
+        self.addCleanup(os.remove, self.rom)
+
+    def test_no_pygame_import(self):
+        script = (
+            "import sys, headless\n"
+            "cpu = headless.make_machine({!r})\n"
+            "headless.run(cpu, 100)\n"
+            "assert 'pygame' not in sys.modules\n").format(self.rom)
+        subprocess.check_call(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.abspath(headless.__file__)))
+
+    def test_draws_and_waits_without_a_keypad(self):
+        cpu = headless.make_machine(self.rom)
+        headless.run(cpu, 100)
+        self.assertEqual(cpu.pc, 0x206)
+        self.assertEqual(headless.render_text(cpu.display).splitlines()[7],
+                         '.......####' + '.' * 53)
+
+    def test_keypad_backend(self):
+        cpu = headless.make_machine(
+            self.rom, keypad=ScriptedKeypad([1 << 0xA]))
+        headless.run(cpu, 100)
+        self.assertEqual(cpu.registers[1], 0xA)
+        self.assertEqual(cpu.pc, 0x208)
+
+    def test_engines_agree(self):
+        hashes = set()
+        for engine in sorted(headless.ENGINES):
+            cpu = headless.make_machine(self.rom, engine)
+            headless.run(cpu, 100)
+            hashes.add(headless.framebuffer_hash(cpu.display))
+        self.assertEqual(len(hashes), 1)
+
+    def test_save_state_restores_everything(self):
+        with open(self.rom, 'wb') as rom:
+            rom.write(RANDOM_PROGRAM)
+        for engine in sorted(headless.ENGINES):
+            cpu = headless.make_machine(self.rom, engine)
+            headless.run(cpu, 100)
+            state = cpu.save_state()
+            headless.run(cpu, 300)
+            expected = (headless.framebuffer_hash(cpu.display),
+                        list(cpu.registers), cpu.I, cpu.pc, cpu.delay_timer,
+                        cpu.cycles)
+
+            cpu.load_state(state)
+            self.assertEqual(cpu.save_state(), state)
+            headless.run(cpu, 300)
+            self.assertEqual(
+                (headless.framebuffer_hash(cpu.display),
+                 list(cpu.registers), cpu.I, cpu.pc, cpu.delay_timer,
+                 cpu.cycles),
+                expected)
+
+    def test_save_state_past_the_limits(self):
+        # A call that never returns and a timer set from an unwrapped
+        # register
+        cpu = headless.make_machine()
+        cpu.memory[0x200:0x202] = b'\x22\x00'
+        cpu.pc = 0x200
+        headless.run(cpu, 200)
+        cpu.registers[1] = 0x1FE
+        cpu.delay_timer = cpu.registers[1]
+        other = headless.make_machine()
+        other.load_state(cpu.save_state())
+        self.assertEqual(other.stack_pointer, 199)
+        self.assertEqual(other.delay_timer, 0x1FE)
+        self.assertEqual(list(other.stack), list(cpu.stack))
+
+    def test_save_state_unwrapped_registers(self):
+        # 60FF 800E 6100 8105 leaves V1 at -254, and enough 8xyE push V2
+        # past 32 bits
+        cpu = headless.make_machine()
+        cpu.registers[1] = -254
+        cpu.registers[2] = 0xFF << 40
+        other = headless.make_machine()
+        other.load_state(cpu.save_state())
+        self.assertEqual(other.registers[1], -254)
+        self.assertEqual(other.registers[2], 0xFF << 40)
+        cpu.registers[3] = 1 << 70
+        cpu.delay_timer = -1
+        other.load_state(cpu.save_state())
+        self.assertEqual(other.registers[3], 0)
+        self.assertEqual(other.delay_timer, -1)
+
+    def test_save_state_into_another_machine(self):
+        cpu = headless.make_machine(self.rom)
+        headless.run(cpu, 100)
+        other = headless.make_machine()
+        other.load_state(cpu.save_state())
+        self.assertEqual(other.memory, cpu.memory)
+        self.assertEqual(other.display.rows, cpu.display.rows)
+        self.assertEqual(other.pc, cpu.pc)
+        with self.assertRaises(ValueError):
+            other.load_state(b'XXXX' + cpu.save_state()[4:])
+
+
+if __name__ == '__main__':
+    unittest.main()
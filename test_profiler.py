@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+import unittest
+
+import headless
+from bench import SYNTHETIC_ROMS, rom_bytes
+from profiler import Profiler, format_report
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(delete=False) as rom:
+            rom.write(rom_bytes(SYNTHETIC_ROMS['draw']))
+        self.addCleanup(os.remove, rom.name)
+        self.rom = rom.name
+
+    def profile(self, engine):
+        cpu = headless.make_machine(self.rom, engine)
+        profiler = Profiler()
+        profiler.attach(cpu)
+        cpu.run_cycles(602)
+        profiler.detach()
+        return cpu, profiler
+
+    def test_report(self):
+        for engine in sorted(headless.ENGINES):
+            cpu, profiler = self.profile(engine)
+            report = profiler.report()
+            self.assertEqual(report['instructions'], 602)
+            handlers = dict((row['handler'], row['count'])
+                            for row in report['handlers'])
+            self.assertEqual(handlers['draw_pixel_to_display'], 100)
+            self.assertEqual(handlers['add_to_reg'], 300)
+            self.assertAlmostEqual(
+                report['draw_time'] + report['other_time'], report['time'])
+            self.assertEqual(
+                report['loops'][0],
+                dict(report['loops'][0], start='0x204', end='0x20e',
+                     iterations=100))
+
+    def test_detach(self):
+        cpu, profiler = self.profile('block')
+        self.assertNotIn('run_cycle', vars(cpu))
+        cpu.run_cycles(100)
+        self.assertEqual(profiler.report()['instructions'], 602)
+
+    def test_dump(self):
+        _, profiler = self.profile('interpreter')
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'profile.json')
+        profiler.dump(path)
+        with open(path) as file:
+            self.assertEqual(json.load(file)['instructions'], 602)
+        os.remove(path)
+        os.rmdir(directory)
+        self.assertIn('Hottest loops', format_report(profiler.report()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import headless
+import replay
+from backends import KeyState
+from bench import rom_bytes
+
+# Draws the digit of a key at a random place, clears while 5 is held
+PROGRAM = [
+    0xF00A,  # 0x200 V0 = next key
+    0xF029,  # 0x202 I = sprite of V0
+    0xC13F,  # 0x204 V1 = random & 0x3F
+    0xD115,  # 0x206 draw it at (V1, V1)
+    0x6205,  # 0x208 V2 = 5
+    0xE2A1,  # 0x20A skip if 5 isn't held
+    0x00E0,  # 0x20C clear
+    0x1200   # 0x20E jump 0x200
+]
+
+# The keys held during every frame
+SESSION = [0, 0, 1 << 3, 1 << 3, 0, 1 << 7, 0, 0, 1 << 5, 0, 1 << 0xA, 0]
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.rom = os.path.join(directory, 'rom.ch8')
+        self.path = os.path.join(directory, 'session.rec')
+        with open(self.rom, 'wb') as rom:
+            rom.write(rom_bytes(PROGRAM))
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(os.remove, self.rom)
+
+    def record(self):
+        keypad = KeyState()
+        cpu = headless.make_machine(self.rom, keypad=keypad)
+        cpu.rng.seed(42)
+        recorder = replay.Recorder(self.path, self.rom, 42, 10)
+        self.addCleanup(os.remove, self.path)
+        for mask in SESSION:
+            # Like the main loop, the keys change between frames
+            keypad.set_mask(mask)
+            recorder.record_frame(keypad)
+            cpu.run_ticks(1)
+            keypad.next_frame()
+        recorder.close(cpu.display)
+        return cpu
+
+    def test_replay_matches(self):
+        cpu = self.record()
+        recording = replay.read_recording(self.path)
+        self.assertEqual(recording.frames, len(SESSION))
+        self.assertEqual(recording.seed, 42)
+        for engine in sorted(headless.ENGINES):
+            replayed = replay.replay(recording, self.rom, engine)
+            self.assertEqual(replayed.display.rows, cpu.display.rows)
+            self.assertEqual(replayed.registers, cpu.registers)
+        self.assertEqual(recording.screen_hash.hex(),
+                         headless.framebuffer_hash(cpu.display))
+        self.assertNotEqual(cpu.display.rows, [0] * 32)
+
+    def test_only_changes_are_stored(self):
+        self.record()
+        recording = replay.read_recording(self.path)
+        self.assertEqual(recording.events[:3], [
+            (0, 0, 0), (2, 1 << 3, 1 << 3), (3, 1 << 3, 0)])
+        self.assertEqual(
+            os.path.getsize(self.path),
+            replay.HEADER.size
+            + replay.EVENT.size * (len(recording.events) + 1)
+            + replay.TRAILER.size)
+
+    def test_wrong_rom(self):
+        self.record()
+        recording = replay.read_recording(self.path)
+        recording.rom_hash = b'\0' * 20
+        with self.assertRaises(ValueError):
+            replay.replay(recording, self.rom)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import headless
+from rewind import Rewind, xor_bytes
+from test_headless import RANDOM_PROGRAM
+
+
+class TestRewind(unittest.TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(delete=False) as rom:
+            rom.write(RANDOM_PROGRAM)
+        self.addCleanup(os.remove, rom.name)
+        self.cpu = headless.make_machine(rom.name)
+
+    def test_xor_bytes(self):
+        self.assertEqual(xor_bytes(b'\x0f\xf0', b'\xff\xff'), b'\xf0\x0f')
+
+    def test_steps_back_through_every_frame(self):
+        rewind = Rewind(self.cpu, 1)
+        states = [self.cpu.save_state()]
+        for _ in range(20):
+            self.cpu.run_ticks(1)
+            rewind.capture()
+            states.append(self.cpu.save_state())
+        for state in reversed(states[:-1]):
+            self.assertTrue(rewind.step_back())
+            self.assertEqual(self.cpu.save_state(), state)
+        self.assertFalse(rewind.step_back())
+
+    def test_history_is_bounded(self):
+        rewind = Rewind(self.cpu, 0.5)
+        for _ in range(100):
+            self.cpu.run_ticks(1)
+            rewind.capture()
+        self.assertEqual(rewind.frames(), 30)
+        self.assertEqual(rewind.captures, 100)
+        self.assertGreater(rewind.capture_cost(), 0)
+        # The deltas are much smaller than full states
+        self.assertLess(rewind.history_size(), 10 * len(rewind.state))
+
+    def test_resuming_after_rewinding(self):
+        rewind = Rewind(self.cpu, 1)
+        for _ in range(5):
+            self.cpu.run_ticks(1)
+            rewind.capture()
+        rewind.step_back()
+        rewind.step_back()
+        expected = self.cpu.save_state()
+        self.cpu.run_ticks(1)
+        rewind.capture()
+        rewind.step_back()
+        self.assertEqual(self.cpu.save_state(), expected)
+        self.assertEqual(rewind.frames(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import mock
+
+from cpu import CPU
+from scheduler import FrameScheduler
+from translator import BlockCPU
+import ram
+
+
+class TestFrameScheduler(unittest.TestCase):
+    def make_cpu(self, cpu_class=CPU):
+        cpu = cpu_class(ram.RAM(4096, 0x200), mock.MagicMock())
+        # V0 += 1, jump back
+        cpu.memory[0x200:0x204] = [0x70, 0x01, 0x12, 0x00]
+        cpu.pc = 0x200
+        return cpu
+
+    def test_instructions_per_frame(self):
+        self.assertEqual(
+            FrameScheduler(self.make_cpu(), 600).instructions_per_frame, 10)
+        self.assertEqual(
+            FrameScheduler(self.make_cpu(), 1).instructions_per_frame, 1)
+
+    def test_timers_tick_once_per_frame(self):
+        cpu = self.make_cpu()
+        cpu.delay_timer = 10
+        scheduler = FrameScheduler(cpu, 600)
+        for _ in range(3):
+            self.assertEqual(scheduler.run_frame(), 10)
+        self.assertEqual(cpu.delay_timer, 7)
+        self.assertEqual(cpu.registers[0], 15)
+
+    def test_block_engine_frames(self):
+        cpu = self.make_cpu(BlockCPU)
+        scheduler = FrameScheduler(cpu, 600)
+        self.assertEqual(scheduler.run_frame(), 10)
+
+    def test_turbo_does_not_sleep(self):
+        scheduler = FrameScheduler(self.make_cpu(), 600, turbo=True)
+        with mock.patch('time.sleep') as sleep:
+            scheduler.throttle()
+        sleep.assert_not_called()
+        self.assertTrue(scheduler.should_present())
+        self.assertFalse(scheduler.should_present())
+
+    def test_exit_opcode(self):
+        cpu = self.make_cpu()
+        cpu.memory[0x200:0x202] = [0x00, 0xFD]
+        FrameScheduler(cpu, 600).run_frame()
+        self.assertTrue(cpu.exited)
+        self.assertEqual(cpu.pc, 0x200)
+
+
+if __name__ == '__main__':
+    unittest.main()
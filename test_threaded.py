@@ -0,0 +1,66 @@
+import unittest
+
+import headless
+from backends import KeyState
+from scheduler import FrameScheduler
+from threaded import EmulationThread, FrameMailbox
+
+
+class TestFrameMailbox(unittest.TestCase):
+    def test_take_latest_once(self):
+        mailbox = FrameMailbox()
+        self.assertIsNone(mailbox.take())
+        mailbox.publish(1, [1, 2])
+        mailbox.publish(2, [3, 4])
+        self.assertEqual(mailbox.take(), (3, 4))
+        self.assertIsNone(mailbox.take())
+
+
+class TestEmulationThread(unittest.TestCase):
+    def make_core(self, program, frames):
+        cpu = headless.make_machine(keypad=KeyState())
+        cpu.load_fontset()
+        for offset, opcode in enumerate(program):
+            cpu.memory[0x200 + offset * 2:0x202 + offset * 2] = \
+                opcode.to_bytes(2, 'big')
+        cpu.pc = 0x200
+        return EmulationThread(FrameScheduler(cpu, 600, turbo=True), frames)
+
+    def run_core(self, core):
+        core.start()
+        core.join(10)
+        self.assertFalse(core.is_alive())
+        self.assertIsNone(core.error)
+
+    def test_publishes_frames(self):
+        # Draws the sprite of V0 and counts up
+        program = [0xF029, 0xD005, 0x7001, 0x1200]
+        core = self.make_core(program, 20)
+        self.run_core(core)
+        reference = self.make_core(program, 20)
+        for _ in range(20):
+            reference.scheduler.run_frame()
+        self.assertEqual(core.mailbox.take(),
+                         tuple(reference.cpu.display.rows))
+        self.assertEqual(core.scheduler.frames, 20)
+
+    def test_input_and_calls(self):
+        # Waits for a key into V0 and exits
+        core = self.make_core([0xF00A, 0x00FD], None)
+        core.send_input(1 << 2, 0)
+        core.send_input(1 << 7, 1 << 7)
+        core.call(lambda: core.cpu.registers.__setitem__(1, 9))
+        self.run_core(core)
+        self.assertTrue(core.cpu.exited)
+        self.assertEqual(core.cpu.registers[0], 7)
+        self.assertEqual(core.cpu.registers[1], 9)
+
+    def test_error_is_kept(self):
+        core = self.make_core([0x8FF8], None)  # Unknown opcode
+        core.start()
+        core.join(10)
+        self.assertIsNotNone(core.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+import mock
+
+from cpu import CPU
+from translator import BlockCPU
+import ram
+import tracer
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.cpu = CPU(ram.RAM(4096, 0x200), mock.MagicMock())
+        # V0 = 5, V1 = 3, V0 += V1, I = 0x300, jump back to the start
+        program = [0x60, 0x05, 0x61, 0x03, 0x80, 0x14, 0xA3, 0x00, 0x12, 0x00]
+        self.cpu.memory[0x200:0x200 + len(program)] = program
+        self.cpu.pc = 0x200
+
+    def test_disabled_tracer_leaves_cpu_alone(self):
+        tracer.Tracer(tracer.TRACE_OFF).attach(self.cpu)
+        self.assertNotIn('run_cycle', vars(self.cpu))
+
+    def test_records_every_instruction(self):
+        trace = tracer.Tracer(tracer.TRACE_ALL)
+        trace.attach(self.cpu)
+        for _ in range(5):
+            self.cpu.run_cycle()
+        records = trace.records()
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[2], (0x204, 0x8014, 0x206, 0, 8, 3, 0))
+        self.assertEqual(records[4][:3], (0x208, 0x1200, 0x200))
+
+    def test_flow_level_skips_arithmetic(self):
+        trace = tracer.Tracer(tracer.TRACE_FLOW)
+        trace.attach(self.cpu)
+        for _ in range(10):
+            self.cpu.run_cycle()
+        self.assertEqual([record[1] for record in trace.records()],
+                         [0x1200, 0x1200])
+
+    def test_ring_buffer_keeps_newest(self):
+        trace = tracer.Tracer(tracer.TRACE_ALL, capacity=3)
+        trace.attach(self.cpu)
+        for _ in range(7):
+            self.cpu.run_cycle()
+        self.assertEqual([record[0] for record in trace.records()],
+                         [0x208, 0x200, 0x202])
+
+    def test_block_engine_is_traced_per_instruction(self):
+        cpu = BlockCPU(ram.RAM(4096, 0x200), mock.MagicMock())
+        cpu.memory[0x200:0x20A] = self.cpu.memory[0x200:0x20A]
+        cpu.pc = 0x200
+        trace = tracer.Tracer(tracer.TRACE_ALL)
+        trace.attach(cpu)
+        self.assertEqual(cpu.run_cycle(), 1)
+        trace.detach()
+        # The block follows the jump back to V0 = 5
+        self.assertEqual(cpu.run_cycle(), 5)
+
+    def test_file_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), 'last.trace')
+        self.addCleanup(os.remove, path)
+        trace = tracer.Tracer(tracer.TRACE_ALL, path, capacity=2)
+        trace.attach(self.cpu)
+        for _ in range(5):
+            self.cpu.run_cycle()
+        trace.close()
+        formatter = tracer.TraceFormatter()
+        lines = [line
+                 for record in tracer.read_trace(path)
+                 for line in formatter.format(record)]
+        self.assertEqual(lines, [
+            "Set register V0 to 5",
+            "Set register V1 to 3",
+            "Added V0 to V1 and got 8",
+            "Set I to 0x300",
+            "Jumped to address at 0x200"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import unittest
+import mock
+
+from cpu import CPU
+from translator import BlockCPU
+import ram
+import test_cpu
+
+# Loops through arithmetic, a subroutine and code that rewrites itself
+PROGRAM = [
+    0x6005,  # 0x200 V0 = 5
+    0x610A,  # 0x202 V1 = 10, rewritten to V1 = 7 by 0x226
+    0x8014,  # 0x204 V0 += V1
+    0x8F15,  # 0x206 VF -= V1
+    0x8016,  # 0x208 V0 >>= 1
+    0x801E,  # 0x20A V0 <<= 1
+    0x8107,  # 0x20C V1 = V0 - V1
+    0xC30F,  # 0x20E V3 = random & 0xF
+    0xF31E,  # 0x210 I += V3
+    0x2230,  # 0x212 call 0x230
+    0x4205,  # 0x214 skip if V2 != 5
+    0x1220,  # 0x216 jump 0x220
+    0x5010,  # 0x218 skip if V0 == V1
+    0x1200,  # 0x21A jump 0x200
+    0x1200,  # 0x21C jump 0x200
+    0x0000,  # 0x21E
+    0x6061,  # 0x220 V0 = 0x61
+    0x6107,  # 0x222 V1 = 7
+    0xA202,  # 0x224 I = 0x202
+    0xF155,  # 0x226 store V0, V1 over 0x202
+    0x6200,  # 0x228 V2 = 0
+    0x1200,  # 0x22A jump 0x200
+    0x0000,  # 0x22C
+    0x0000,  # 0x22E
+    0x7201,  # 0x230 V2 += 1
+    0xA300,  # 0x232 I = 0x300
+    0xF233,  # 0x234 BCD of V2 at 0x300
+    0xF165,  # 0x236 V0, V1 = memory[0x300:0x302]
+    0x00EE   # 0x238 return
+]
+
+
+class TestBlockCPU(test_cpu.TestCPU):
+    """
+        The block engine has to pass everything the interpreter passes.
+    """
+    def setUp(self):
+        super(TestBlockCPU, self).setUp()
+        self.cpu = BlockCPU(self.ram, self.display)
+
+    def test_decode_cache_reuses_entries(self):
+        """
+            Here the loop body is compiled into a single block instead
+        """
+        self.cpu.memory[0x200:0x204] = [0x70, 0x01, 0x12, 0x00]
+        self.cpu.pc = 0x200
+        executed = 0
+        while executed < 10:
+            executed += self.cpu.run_cycle()
+        self.assertEqual(self.cpu.registers[0], 5)
+        self.assertEqual(self.cpu.block_lengths[0x200], 2)
+
+
+class TestBlockParity(unittest.TestCase):
+    def make_cpu(self, cpu_class, program):
+        cpu = cpu_class(ram.RAM(4096, 0x200),
+                        mock.MagicMock(width=64, height=32))
+        for i, opcode in enumerate(program):
+            cpu.memory[0x200 + i * 2] = opcode >> 8
+            cpu.memory[0x200 + i * 2 + 1] = opcode & 0xFF
+        cpu.pc = 0x200
+        return cpu
+
+    def assertSameState(self, program, instructions):
+        block_cpu = self.make_cpu(BlockCPU, program)
+        block_cpu.rng.seed(8)
+        executed = 0
+        while executed < instructions:
+            executed += block_cpu.run_cycle()
+
+        cpu = self.make_cpu(CPU, program)
+        cpu.rng.seed(8)
+        for _ in range(executed):
+            cpu.run_cycle()
+
+        self.assertEqual(block_cpu.registers, cpu.registers)
+        self.assertEqual(block_cpu.I, cpu.I)
+        self.assertEqual(block_cpu.pc, cpu.pc)
+        self.assertEqual(list(block_cpu.stack), list(cpu.stack))
+        self.assertEqual(block_cpu.stack_pointer, cpu.stack_pointer)
+        self.assertEqual(block_cpu.memory, cpu.memory)
+
+    def test_program_parity(self):
+        self.assertSameState(PROGRAM, 5000)
+
+    def test_program_parity_with_quirks(self):
+        with mock.patch('config.shift_quirk', True), \
+                mock.patch('config.load_quirk', True):
+            self.assertSameState(PROGRAM, 5000)
+
+    def test_jump_plus_v0_parity(self):
+        self.assertSameState([0x6004, 0xB204, 0x0000, 0x0000, 0x1200], 50)
+
+    def test_timer_parity(self):
+        """
+            Ticks have to land on the same instruction for both engines
+        """
+        program = [
+            0x6007,  # 0x200 V0 = 7
+            0xF015,  # 0x202 delay timer = V0
+            0xF107,  # 0x204 V1 = delay timer
+            0x7201,  # 0x206 V2 += 1
+            0x8314,  # 0x208 V3 += V1
+            0x3100,  # 0x20A skip if V1 == 0
+            0x1204,  # 0x20C jump 0x204
+            0x1200   # 0x20E jump 0x200
+        ]
+        block_cpu = self.make_cpu(BlockCPU, program)
+        cpu = self.make_cpu(CPU, program)
+        for engine in (block_cpu, cpu):
+            engine.cycles_per_tick = 7
+            engine.next_tick = 7
+            engine.run_cycles(1000)
+        self.assertEqual(block_cpu.registers, cpu.registers)
+        self.assertEqual(block_cpu.delay_timer, cpu.delay_timer)
+        self.assertEqual(block_cpu.pc, cpu.pc)
+
+    def test_partial_block_parity(self):
+        """
+            At the default tick rate most ticks stop in the middle of a block,
+            the partial blocks have to stop on the same instruction
+        """
+        block_cpu = self.make_cpu(BlockCPU, PROGRAM)
+        cpu = self.make_cpu(CPU, PROGRAM)
+        for engine in (block_cpu, cpu):
+            engine.rng.seed(8)
+            engine.run_ticks(300)
+        self.assertEqual(block_cpu.save_state(), cpu.save_state())
+        self.assertTrue(any(block_cpu.partials))
+
+    def test_store_past_the_end_of_memory(self):
+        cpu = self.make_cpu(BlockCPU, [0xAFFE, 0xF255])
+        with self.assertRaises(IndexError):
+            cpu.run_cycle()
+        self.assertEqual(cpu.pc, 0x202)
+        self.assertEqual(cpu.I, 0xFFE)
+
+    def test_load_past_the_end_of_memory(self):
+        program = [0x6105, 0xAFFE, 0xF265]
+        block_cpu = self.make_cpu(BlockCPU, program)
+        cpu = self.make_cpu(CPU, program)
+        block_cpu.rng.seed(8)
+        cpu.rng.seed(8)
+        with self.assertRaises(IndexError):
+            block_cpu.run_cycle()
+        with self.assertRaises(IndexError):
+            for _ in program:
+                cpu.run_cycle()
+        self.assertEqual(block_cpu.pc, 0x204)
+        self.assertEqual(block_cpu.save_state(), cpu.save_state())
+
+    def test_compiled_code_is_bounded(self):
+        cpu = self.make_cpu(BlockCPU, [0x6000, 0x1200])
+        with mock.patch('translator.MAX_COMPILED', 4):
+            for value in range(10):
+                cpu.memory[0x201] = value
+                cpu.invalidate_code(0x201)
+                cpu.run_cycle()
+        self.assertEqual(len(cpu.compiled), 4)
+        self.assertEqual(cpu.registers[0], 9)
+
+    def test_draw_parity(self):
+        self.assertSameState(
+            [0x6F05, 0xA300, 0xD015, 0x7001, 0x8F04, 0x1200], 100)
+
+    def test_block_follows_calls(self):
+        # call 0x206, jump 0x200, call 0x20C, V0 += 1, return, V1 += 1,
+        # return
+        program = [0x2206, 0x1200, 0x0000, 0x220C, 0x7001, 0x00EE, 0x7101,
+                   0x00EE]
+        self.assertSameState(program, 500)
+        cpu = self.make_cpu(BlockCPU, program)
+        self.assertEqual(cpu.run_cycle(), 4)
+        self.assertEqual(cpu.pc, 0x208)
+        self.assertEqual(list(cpu.stack), [0x200])
+        # Rewriting the subroutine drops the block that went through it
+        cpu.invalidate_code(0x20C, 2)
+        self.assertIsNone(cpu.blocks[0x200])
+
+    def test_self_modifying_code_drops_block(self):
+        cpu = self.make_cpu(BlockCPU, PROGRAM)
+        cpu.run_cycle()
+        self.assertIsNotNone(cpu.blocks[0x200])
+        cpu.invalidate_code(0x202, 2)
+        self.assertIsNone(cpu.blocks[0x200])
+        self.assertNotIn(0x200, cpu.block_owners[0x204])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+import mock
+
+import headless
+from backends import KeyState
+from bench import SYNTHETIC_ROMS, rom_bytes
+from test_headless import RANDOM_PROGRAM
+from test_translator import PROGRAM
+
+try:
+    import numpy
+    from vector import VectorCPU
+except ImportError:
+    numpy = None
+
+SEEDS = [1, 2, 3, 4]
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class TestVectorCPU(unittest.TestCase):
+    def write_rom(self, rom):
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(rom)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def assertMatchesCPU(self, rom, instructions):
+        path = self.write_rom(rom)
+        machines = VectorCPU(len(SEEDS), path, SEEDS)
+        machines.run_cycles(instructions)
+        for machine, seed in enumerate(SEEDS):
+            cpu = headless.make_machine(path)
+            cpu.rng.seed(seed)
+            cpu.run_cycles(instructions)
+            exported = headless.make_machine()
+            machines.export(machine, exported)
+            self.assertEqual(exported.save_state(), cpu.save_state())
+
+    def test_parity(self):
+        programs = [rom_bytes(program) for _, program in
+                    sorted(SYNTHETIC_ROMS.items())]
+        programs += [rom_bytes(PROGRAM), RANDOM_PROGRAM]
+        for program in programs:
+            self.assertMatchesCPU(program, 3000)
+
+    def test_parity_with_quirks(self):
+        with mock.patch('config.shift_quirk', True), \
+                mock.patch('config.load_quirk', True):
+            self.assertMatchesCPU(rom_bytes(PROGRAM), 3000)
+            self.assertMatchesCPU(
+                rom_bytes(SYNTHETIC_ROMS['arithmetic']), 3000)
+
+    def test_vf_as_operand(self):
+        # VF is written before the result, like in CPU
+        self.assertMatchesCPU(rom_bytes([
+            0x6F05, 0x6003, 0x80F5, 0x8F07, 0x8FF4, 0x8F06, 0x8F0E,
+            0x7F01, 0x1208]), 500)
+
+    def test_unknown_opcode_stops_one_machine(self):
+        # Loops until key 5 is held, then runs into an unknown opcode
+        path = self.write_rom(rom_bytes([0x6005, 0xE09E, 0x1202, 0xF0FF]))
+        machines = VectorCPU(2, path)
+        machines.keys[0, 5] = True
+        machines.run_cycles(50)
+        self.assertEqual(list(machines.crashed), [True, False])
+        self.assertEqual(machines.pc[0], 0x206)
+        self.assertEqual(list(machines.active), [1])
+
+    def test_keys(self):
+        path = self.write_rom(rom_bytes([0xF00A, 0x1202]))
+        machines = VectorCPU(3, path)
+        machines.keys[1, 0xA] = True
+        machines.keys[2, 0x3] = machines.keys[2, 0x7] = True
+        machines.run_cycles(10)
+        self.assertEqual(list(machines.registers[:, 0]), [0, 0xA, 0x3])
+        self.assertEqual(list(machines.pc), [0x200, 0x202, 0x202])
+
+    def test_wait_for_key_parity(self):
+        # Fx0A only takes keys that went down, not ones still held
+        path = self.write_rom(rom_bytes([0xF00A, 0xF10A, 0xF20A, 0x1206]))
+        masks = [0, 1 << 5, 1 << 5 | 1 << 3, 1 << 3, 0, 1 << 7, 1 << 7]
+        machines = VectorCPU(1, path, [0])
+        keypad = KeyState()
+        cpu = headless.make_machine(path, keypad=keypad)
+        cpu.rng.seed(0)
+        for mask in masks:
+            machines.keys[0] = [mask >> key & 1 for key in range(16)]
+            machines.run_ticks(1)
+            keypad.set_mask(mask)
+            cpu.run_ticks(1)
+            keypad.next_frame()
+        self.assertEqual(list(machines.registers[0, :3]), [5, 3, 7])
+        exported = headless.make_machine()
+        machines.export(0, exported)
+        self.assertEqual(exported.save_state(), cpu.save_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
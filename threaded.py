@@ -0,0 +1,100 @@
+"""
+    Runs the CPU on a thread of its own so a slow flip doesn't hold up the
+    emulation and the other way around. The core thread publishes finished
+    frames and the pygame thread shows the latest one, sending the keypad
+    back. Nothing on the core thread ever waits for the renderer: both sides
+    only swap references and append to deques, which the GIL keeps whole.
+"""
+from collections import deque
+import threading
+
+
+class FrameMailbox:
+    """
+        Holds the latest finished frame. Every frame is a new tuple of rows,
+        so the writer never touches a frame the reader holds, like a triple
+        buffer without the buffers to recycle.
+    """
+    def __init__(self):
+        self.frame = None  # (number, rows)
+        self.taken = 0
+
+    def publish(self, number, rows):
+        self.frame = (number, tuple(rows))
+
+    def take(self):
+        """
+            Returns the rows of the latest frame if it wasn't taken yet,
+            None otherwise. Frames published in between are skipped.
+        """
+        frame = self.frame
+        if frame is None or frame[0] == self.taken:
+            return None
+        self.taken = frame[0]
+        return frame[1]
+
+
+class EmulationThread(threading.Thread):
+    """
+        Runs a FrameScheduler until stopped, the CPU exits or it ran frames
+        frames. The CPU should have a KeyState keypad and a display nobody
+        else draws, the screen is only read through the mailbox.
+    """
+    def __init__(self, scheduler, frames=None):
+        super(EmulationThread, self).__init__(name='chip8-core', daemon=True)
+        self.scheduler = scheduler
+        self.cpu = scheduler.cpu
+        self.frames = frames
+        self.mailbox = FrameMailbox()
+        # (mask, pressed) from the input side, newest last
+        self.input = deque()
+        # Functions to run on the core thread between two frames
+        self.calls = deque()
+        self.running = True
+        self.error = None
+
+    def send_input(self, mask, pressed):
+        self.input.append((mask, pressed))
+
+    def call(self, function):
+        """
+            Runs function on the core thread before the next frame, use it
+            for anything that touches the CPU.
+        """
+        self.calls.append(function)
+
+    def stop(self):
+        self.running = False
+
+    def apply_input(self):
+        keypad = self.cpu.keypad
+        pressed = 0
+        mask = None
+        while self.input:
+            mask, down = self.input.popleft()
+            pressed |= down
+        if mask is not None:
+            keypad.mask = mask
+            keypad.pressed |= pressed
+
+    def run(self):
+        cpu = self.cpu
+        scheduler = self.scheduler
+        display = cpu.display
+        try:
+            while self.running and not cpu.exited:
+                while self.calls:
+                    self.calls.popleft()()
+                self.apply_input()
+                scheduler.run_frame()
+                if display.draw_flag:
+                    display.draw_flag = False
+                    self.mailbox.publish(scheduler.frames, display.rows)
+                if self.frames is not None and \
+                        scheduler.frames >= self.frames:
+                    break
+                scheduler.throttle()
+        except Exception as error:
+            # Left for the pygame thread to report
+            self.error = error
+        self.running = False
@@ -0,0 +1,280 @@
+"""
+    Instruction tracing. Nothing here runs unless a Tracer is attached to a
+    CPU, attaching swaps in a run_cycle that records every instruction into
+    a ring buffer of fixed size binary records, which gets written to disk in
+    one go when it fills up.
+
+    Turn a trace back into readable lines with:
+        python tracer.py last.trace
+"""
+import argparse
+import struct
+import sys
+from cpu import CPU
+from hooks import CycleHook
+from ram import RAM
+
+TRACE_OFF = 0
+TRACE_FLOW = 1  # Jumps, calls, returns, skips, draws and key waits
+TRACE_ALL = 2
+
+LEVELS = {'off': TRACE_OFF, 'flow': TRACE_FLOW, 'all': TRACE_ALL}
+
+# pc, opcode, pc after the instruction, I, Vx, Vy, VF after the instruction
+RECORD = struct.Struct('<HHHHBBB')
+HEADER = struct.Struct('<4sBB')
+MAGIC = b'C8TR'
+VERSION = 1
+
+# Opcode families (first nibble) that change the control flow
+FLOW_OPERATIONS = (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x9, 0xB, 0xD, 0xE)
+
+
+class Tracer(CycleHook):
+    def __init__(self, level=TRACE_ALL, path=None, capacity=4096):
+        """
+            Keeps the last capacity records in memory. With a path the buffer
+            is appended to the file every time it fills up instead of being
+            overwritten.
+        """
+        self.level = level
+        self.path = path
+        self.capacity = capacity
+        self.buffer = bytearray(RECORD.size * capacity)
+        self.position = 0  # Index of the next record
+        self.wrapped = False
+        self.file = None
+        self.cpu = None
+        # Which opcodes get recorded, indexed by the opcode. Built on attach
+        # so a tracer that stays off costs nothing
+        self.traced = None
+
+    def attach(self, cpu):
+        if self.level == TRACE_OFF:
+            return
+        if self.traced is None:
+            self.traced = bytearray(
+                self.level == TRACE_ALL
+                or opcode >> 12 in FLOW_OPERATIONS
+                or opcode & 0xF0FF == 0xF00A
+                for opcode in range(0x10000))
+        if self.path is not None:
+            self.file = open(self.path, 'wb')
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        super(Tracer, self).attach(cpu)
+
+    def detach(self):
+        super(Tracer, self).detach()
+        self.close()
+
+    def run_cycle(self):
+        """
+            Interprets a single instruction and records it. Compiled blocks
+            are skipped on purpose so that every instruction shows up.
+        """
+        cpu = self.cpu
+        pc = cpu.pc
+        executed = CPU.run_cycle(cpu)
+        opcode = cpu.opcode
+        if self.traced[opcode]:
+            registers = cpu.registers
+            RECORD.pack_into(
+                self.buffer,
+                self.position * RECORD.size,
+                pc & 0xFFFF,
+                opcode,
+                cpu.pc & 0xFFFF,
+                cpu.I & 0xFFFF,
+                registers[(opcode & 0x0F00) >> 8] & 0xFF,
+                registers[(opcode & 0x00F0) >> 4] & 0xFF,
+                registers[0xF] & 0xFF)
+            self.position += 1
+            if self.position == self.capacity:
+                if self.file is not None:
+                    self.file.write(self.buffer)
+                else:
+                    self.wrapped = True
+                self.position = 0
+        return executed
+
+    def records(self):
+        """
+            Returns the buffered records, oldest first.
+        """
+        size = RECORD.size
+        end = self.position * size
+        if self.wrapped:
+            data = self.buffer[end:] + self.buffer[:end]
+        else:
+            data = self.buffer[:end]
+        return list(RECORD.iter_unpack(bytes(data)))
+
+    def flush(self):
+        """
+            Writes the records that are still buffered to the file.
+        """
+        if self.file is None:
+            return
+        self.file.write(self.buffer[:self.position * RECORD.size])
+        self.file.flush()
+        self.position = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def read_trace(path):
+    """
+        Returns the records of a trace file.
+    """
+    with open(path, 'rb') as file:
+        magic, version, size = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            raise ValueError("{} isn't a trace file".format(path))
+        return list(RECORD.iter_unpack(file.read()))
+
+
+class TraceFormatter:
+    """
+        Turns records into the lines the CPU used to log.
+    """
+    messages = {
+        'clear_screen': lambda r: ["Cleared display"],
+        'ret_from_subroutine': lambda r: [
+            "Returned from subroutine at {}".format(hex(r.pc)),
+            "to address at {}".format(hex(r.next_pc - 2))],
+        'jmp_to_addr': lambda r: [
+            "Jumped to address at {}".format(hex(r.opcode & 0xFFF))],
+        'call_subroutine': lambda r: [
+            "Called subroutine at {}".format(hex(r.next_pc - 2))],
+        'branch_if_equal_val': lambda r: [
+            "Skipped {} because V{} and {} are equal".format(
+                hex(r.pc), r.x, r.opcode & 0xFF)] if r.skipped else [],
+        'branch_if_not_equal_val': lambda r: [
+            "Didn't skip {} because V{} and {} are not equal".format(
+                hex(r.pc), r.x, r.opcode & 0xFF)] if r.skipped else [],
+        'branch_if_equal_reg': lambda r: [
+            "Skipped {} because register V{} and V{} are equal to {}".format(
+                hex(r.pc), r.x, r.y, r.vx)] if r.skipped else [],
+        'set_reg_to_val': lambda r: [
+            "Set register V{} to {}".format(r.x, r.opcode & 0xFF)],
+        'add_to_reg': lambda r: [
+            "Added {} to register V{}".format(r.opcode & 0xFF, r.x)],
+        'set_reg_to_reg': lambda r: [
+            "Set register V{} to V{}".format(r.x, r.y)],
+        'bitwise_or': lambda r: [
+            "Bitwise OR on V{} and V{} for {}".format(r.x, r.y, r.vx)],
+        'bitwise_and': lambda r: [
+            "Bitwise AND on V{} and V{} for {}".format(r.x, r.y, r.vx)],
+        'bitwise_xor': lambda r: [
+            "Bitwise XOR on V{} and V{} for {}".format(r.x, r.y, r.vx)],
+        'add_reg_to_reg': lambda r: [
+            "Added V{} to V{} and got {}".format(r.x, r.y, r.vx)],
+        'sub_reg_from_reg': lambda r: [
+            "Subtracted V{} from V{} and got {}".format(r.y, r.x, r.vx)],
+        'subn_reg_from_reg': lambda r: [
+            "Subtracted V{} from V{} and got {}".format(r.y, r.x, r.vx)],
+        'draw_pixel_to_display': lambda r: [
+            "Drawing sprite from {} to {} at {}, {}".format(
+                hex(r.I), hex(r.I + (r.opcode & 0xF)), r.vx % 64, r.vy % 32)],
+        'set_I_to_address': lambda r: ["Set I to {}".format(hex(r.I))],
+        'right_shift': lambda r: [
+            "Shifted register V{} 1 bit to the right got {}".format(
+                r.x, hex(r.vx))],
+        'right_shift_quirk': lambda r: [
+            "Shifted register V{} to the right into V{}({})".format(
+                r.y, r.x, hex(r.vx))],
+        'left_shift': lambda r: [
+            "Shifted register V{} 1 bit to the left got {}".format(
+                r.x, hex(r.vx))],
+        'left_shift_quirk': lambda r: [
+            "Shifted register V{} to the left into V{}({})".format(
+                r.y, r.x, hex(r.vx))],
+        'bin_coded_dec': lambda r: [
+            "Stored BCD of V{}({}) starting at {}".format(
+                r.x, r.vx, hex(r.I))],
+        'load_mem_to_registers': lambda r: [
+            "Loaded memory from {} to {} in registers till V{}".format(
+                hex(r.I), hex(r.I + r.x), r.x)],
+        'load_mem_to_registers_quirk': lambda r: [
+            "Loaded memory from {} to {} in registers till V{}".format(
+                hex(r.I), hex(r.I + r.x), r.x)],
+        'load_sprite_from_memory': lambda r: [
+            "Loaded sprite at memory location {}".format(hex(r.I))],
+        'set_delay_timer_to_reg': lambda r: [
+            "Set delay timer to register V{} = {}".format(r.x, r.vx)],
+        'set_reg_to_delay_timer': lambda r: [
+            "Set register V{} to delay timer {}".format(r.x, r.vx)],
+        'generate_random_number': lambda r: [
+            "Set V{} to random number {}".format(r.x, r.vx)],
+        'skip_if_key_not_pressed': lambda r: [
+            "Skipped {} because {} wasn't pressed".format(
+                hex(r.pc), r.vx)] if r.skipped else [],
+        'set_sound_timer_to_reg': lambda r: [
+            "Set sound timer to V{} = {}".format(r.x, r.vx)],
+        'load_registers_in_memory': lambda r: [
+            "Loaded registers from V0 to V{} into {}".format(
+                r.x, hex(r.I))],
+        'load_registers_in_memory_quirk': lambda r: [
+            "Loaded registers from V0 to V{} into {}".format(
+                r.x, hex(r.I))],
+        'add_reg_to_I': lambda r: [
+            "Added V{}({}) to I".format(r.x, r.vx)],
+        'skip_if_key_pressed': lambda r: [
+            "Skipped {} because {} was pressed".format(
+                hex(r.pc), r.vx)] if r.skipped else [],
+        'skip_if_regs_not_equal': lambda r: [
+            "Skipped {} because V{} = V{}".format(hex(r.pc), r.x, r.y)],
+        'jmp_to_val_plus_v0': lambda r: [
+            "Jumped to {} + V0 = {}".format(
+                hex(r.opcode & 0xFFF), hex(r.next_pc - 2))],
+        'wait_for_keypress': lambda r: [
+            "Stored key {} into V{}".format(r.vx, r.x)]
+    }
+
+    def __init__(self):
+        # Only used to look opcodes up in the same tables the CPU uses
+        self.cpu = CPU(RAM(4096, 0x200), None)
+
+    def format(self, record):
+        """
+            Returns the lines for a record unpacked with RECORD.
+        """
+        entry = TraceEntry(*record)
+        handler = self.cpu.lookup_handler(entry.opcode)
+        if handler is None:
+            return ["The opcode isn't valid {}".format(hex(entry.opcode))]
+        message = self.messages.get(handler.__name__)
+        return message(entry) if message is not None else []
+
+
+class TraceEntry:
+    def __init__(self, pc, opcode, next_pc, I, vx, vy, vf):
+        self.pc = pc
+        self.opcode = opcode
+        self.next_pc = next_pc
+        self.I = I
+        self.vx = vx
+        self.vy = vy
+        self.vf = vf
+        self.x = (opcode & 0x0F00) >> 8
+        self.y = (opcode & 0x00F0) >> 4
+        self.skipped = next_pc == pc + 4
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="prints a binary trace as readable lines")
+    parser.add_argument("trace", help="path to the trace file", type=str)
+    args = parser.parse_args(argv)
+    formatter = TraceFormatter()
+    for record in read_trace(args.trace):
+        for line in formatter.format(record):
+            sys.stdout.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,573 @@
+import collections
+
+from cpu import CPU
+
+
+# The most instructions that get compiled into a single block
+MAX_BLOCK_LENGTH = 64
+# The most code objects kept around for blocks that come back the same
+MAX_COMPILED = 4096
+
+
+class BlockBuilder:
+    """
+        Collects the Python source of a single basic block. Registers are
+        kept in locals called v0 to vf and I in a local called I, the ones
+        that get touched are loaded when the block starts and written back
+        when it exits.
+    """
+    def __init__(self, address):
+        self.address = address
+        # The instruction being emitted, blocks follow jumps and calls
+        self.pc = address
+        self.lines = []
+        self.used = set()
+        self.written = set()
+        self.uses_I = False
+        self.writes_I = False
+        self.uses_memory = False
+        self.count = 0
+        # The same code with an exit before every instruction, for when
+        # fewer instructions than the whole block are left before a tick
+        self.partial_lines = []
+
+    def read(self, register):
+        self.used.add(register)
+        return 'v{:x}'.format(register)
+
+    def write(self, register):
+        self.used.add(register)
+        self.written.add(register)
+        return 'v{:x}'.format(register)
+
+    def read_I(self):
+        self.uses_I = True
+        return 'I'
+
+    def write_I(self):
+        self.uses_I = True
+        self.writes_I = True
+        return 'I'
+
+    def emit(self, *lines):
+        self.lines.extend(lines)
+        self.partial_lines.extend(lines)
+
+    def checkpoint(self, pc):
+        """
+            Lets the partial block stop before the instruction at pc when
+            its budget runs out there.
+        """
+        if not self.count:
+            return
+        exit = ['if budget == {}:'.format(self.count)]
+        exit += self.write_back('    ')
+        exit += ['    cpu.pc = {}'.format(pc),
+                 '    return {}'.format(self.count)]
+        self.partial_lines.extend(exit)
+
+    def write_back(self, indent=''):
+        """
+            Returns the lines storing the registers and I written so far.
+        """
+        lines = ['{}R[{}] = v{:x}'.format(indent, register, register)
+                 for register in sorted(self.written)]
+        if self.writes_I:
+            lines.append(indent + 'cpu.I = I')
+        return lines
+
+    def exit(self, *lines):
+        """
+            Writes the registers back and runs lines, which have to set
+            cpu.pc and return.
+        """
+        self.emit(*self.write_back())
+        self.emit(*lines)
+
+    def source(self, partial=False):
+        """
+            Returns the name and source of the block function. The partial
+            one takes how many instructions it may run at most.
+        """
+        name = 'block_{:x}'.format(self.address)
+        lines = self.lines
+        header = 'def {}(cpu=cpu, randint=randint, interpret=interpret):'
+        if partial:
+            name = 'partial_{:x}'.format(self.address)
+            lines = self.partial_lines
+            header = 'def {}(budget, cpu=cpu, randint=randint, ' \
+                'interpret=interpret):'
+        prologue = ['R = cpu.registers']
+        for register in sorted(self.used):
+            prologue.append('v{:x} = R[{}]'.format(register, register))
+        if self.uses_I:
+            prologue.append('I = cpu.I')
+        if self.uses_memory:
+            prologue.append('M = cpu.memory')
+        body = ['    ' + line for line in prologue + lines]
+        return name, '\n'.join([header.format(name)] + body) + '\n'
+
+
+class BlockCPU(CPU):
+    """
+        Runs straight-line code as compiled Python functions instead of
+        decoding one instruction at a time. Blocks end at jumps, calls,
+        returns, skips and the instructions that are left to the interpreter
+        (Ex9E, ExA1, Fx0A and unknown opcodes), and after Fx33 or Fx55 when
+        they write over the block itself. Jumps and calls with a target that
+        isn't in the block yet carry on there instead.
+    """
+    def __init__(self, ram, display, keypad=None, audio=None):
+        super(BlockCPU, self).__init__(ram, display, keypad, audio)
+        # Compiled blocks indexed by their starting address
+        self.blocks = [None] * len(self.memory)
+        # How many instructions each block runs, the addresses it covers and
+        # which blocks cover every address
+        self.block_lengths = [0] * len(self.memory)
+        self.block_covers = {}
+        self.block_owners = [None] * len(self.memory)
+        # Code objects by source, rewritten code tends to come back the same.
+        # The least recently used go first when there are too many
+        self.compiled = collections.OrderedDict()
+        # Blocks that can stop early, compiled from their builder the first
+        # time a tick lands inside them
+        self.partials = [None] * len(self.memory)
+        self.builders = {}
+
+        # The straight-line part of a block
+        self.emitters = {
+            'ignore_opcode': self.emit_nothing,
+            'clear_screen': self.emit_clear_screen,
+            'set_reg_to_val': self.emit_set_reg_to_val,
+            'add_to_reg': self.emit_add_to_reg,
+            'set_reg_to_reg': self.emit_set_reg_to_reg,
+            'bitwise_or': self.emit_bitwise('|'),
+            'bitwise_and': self.emit_bitwise('&'),
+            'bitwise_xor': self.emit_bitwise('^'),
+            'add_reg_to_reg': self.emit_add_reg_to_reg,
+            'sub_reg_from_reg': self.emit_sub_reg_from_reg,
+            'subn_reg_from_reg': self.emit_subn_reg_from_reg,
+            'right_shift': self.emit_right_shift,
+            'right_shift_quirk': self.emit_right_shift_quirk,
+            'left_shift': self.emit_left_shift,
+            'left_shift_quirk': self.emit_left_shift_quirk,
+            'set_I_to_address': self.emit_set_I_to_address,
+            'generate_random_number': self.emit_generate_random_number,
+            'set_reg_to_delay_timer': self.emit_set_reg_to_delay_timer,
+            'set_delay_timer_to_reg': self.emit_set_delay_timer_to_reg,
+            'set_sound_timer_to_reg': self.emit_set_sound_timer_to_reg,
+            'add_reg_to_I': self.emit_add_reg_to_I,
+            'load_sprite_from_memory': self.emit_load_sprite_from_memory,
+            'load_mem_to_registers': self.emit_load_mem_to_registers,
+            'load_mem_to_registers_quirk': self.emit_load_mem_to_registers,
+            'bin_coded_dec': self.emit_store,
+            'load_registers_in_memory': self.emit_store,
+            'load_registers_in_memory_quirk': self.emit_store,
+            'draw_pixel_to_display': self.emit_draw
+        }
+
+        # Instructions that end a block on their own
+        self.terminators = {
+            'jmp_to_addr': self.emit_jmp_to_addr,
+            'call_subroutine': self.emit_call_subroutine,
+            'ret_from_subroutine': self.emit_ret_from_subroutine,
+            'jmp_to_val_plus_v0': self.emit_jmp_to_val_plus_v0,
+            'branch_if_equal_val': self.emit_skip_val('=='),
+            'branch_if_not_equal_val': self.emit_skip_val('!='),
+            'branch_if_equal_reg': self.emit_skip_reg('=='),
+            'skip_if_regs_not_equal': self.emit_skip_reg('!=')
+        }
+
+    def run_cycle(self):
+        """
+            Executes the block starting at pc and returns how many
+            instructions were executed.
+        """
+        block = self.blocks[self.pc]
+        if block is None:
+            block = self.translate(self.pc)
+        return block()
+
+    def run_instructions(self, count):
+        """
+            Runs whole blocks while they fit in count and the partial block
+            that stops where count runs out, so a timer tick never lands
+            inside a block and the timing matches the interpreter exactly.
+        """
+        blocks = self.blocks
+        block_lengths = self.block_lengths
+        executed = 0
+        while executed < count:
+            pc = self.pc
+            block = blocks[pc]
+            if block is None:
+                block = self.translate(pc)
+            left = count - executed
+            if block_lengths[pc] <= left:
+                executed += block()
+            else:
+                partial = self.partials[pc]
+                if partial is None:
+                    partial = self.compile_partial(pc)
+                executed += partial(left)
+        return executed
+
+    def compile_partial(self, address):
+        builder = self.builders.pop(address)
+        partial = self.compile_block(builder, partial=True)
+        self.partials[address] = partial
+        return partial
+
+    def warm_up(self, analysis):
+        """
+            Compiles the blocks starting where a static analysis found basic
+            blocks before they run, see analyzer.py.
+        """
+        super(BlockCPU, self).warm_up(analysis)
+        for start in analysis.block_starts():
+            if self.blocks[start] is None:
+                self.translate(start)
+
+    def interpret(self):
+        """
+            Executes a single instruction with the interpreter.
+        """
+        return CPU.run_cycle(self)
+
+    def invalidate_code(self, address, length=1):
+        super(BlockCPU, self).invalidate_code(address, length)
+        start = max(address - 1, 0)
+        covered = self.block_owners[start:address + length]
+        if not any(covered):
+            return  # Plain data, the usual case for Fx33 and Fx55
+        for owners in covered:
+            for block_start in list(owners or ()):
+                self.drop_block(block_start)
+
+    def drop_block(self, start):
+        self.blocks[start] = None
+        self.partials[start] = None
+        self.builders.pop(start, None)
+        for address in self.block_covers.pop(start):
+            self.block_owners[address].discard(start)
+
+    def translate(self, address):
+        """
+            Compiles the block starting at address and stores it. Jumps and
+            calls to code that isn't in the block yet don't end it, the block
+            carries on at their target.
+        """
+        builder = BlockBuilder(address)
+        pc = address
+        end = len(self.memory) - 1
+        covered = []
+        segment = address
+        length = 0
+        while True:
+            if builder.count == MAX_BLOCK_LENGTH or pc >= end or \
+                    pc in covered:
+                builder.exit('cpu.pc = {}'.format(pc),
+                             'return {}'.format(builder.count))
+                break
+            opcode = self.memory[pc] << 8 | self.memory[pc + 1]
+            handler = self.lookup_handler(opcode)
+            name = handler.__name__ if handler is not None else None
+            builder.checkpoint(pc)
+            builder.pc = pc
+            target = opcode & 0xFFF
+            if name in ('jmp_to_addr', 'call_subroutine') and \
+                    target < end and target not in covered and \
+                    not segment <= target < pc + 2:
+                if name == 'call_subroutine':
+                    builder.emit('cpu.stack_pointer += 1',
+                                 'cpu.stack.append({})'.format(pc))
+                builder.count += 1
+                covered.extend(range(segment, pc + 2))
+                segment = pc = target
+            elif name in self.emitters:
+                self.emitters[name](builder, opcode)
+                builder.count += 1
+                pc += 2
+            elif name in self.terminators:
+                builder.count += 1
+                self.terminators[name](builder, opcode, pc)
+                pc += 2
+                break
+            else:
+                # Left to the interpreter, which also raises on unknown ones
+                builder.exit('cpu.pc = {}'.format(pc),
+                             'return {} + interpret()'.format(builder.count))
+                length = 1
+                pc += 2
+                break
+
+        if builder.count == 0:
+            block = self.interpret
+        else:
+            block = self.compile_block(builder)
+            if builder.count + length > 1:
+                self.builders[address] = builder
+        covered.extend(range(segment, pc))
+        self.blocks[address] = block
+        self.block_lengths[address] = builder.count + length
+        self.block_covers[address] = covered
+        for covering in covered:
+            if self.block_owners[covering] is None:
+                self.block_owners[covering] = set()
+            self.block_owners[covering].add(address)
+        return block
+
+    def compile_block(self, builder, partial=False):
+        name, source = builder.source(partial)
+        namespace = {
+            'cpu': self,
+            'randint': self.rng.randint,
+            'interpret': self.interpret
+        }
+        code = self.compiled.get(source)
+        if code is None:
+            code = compile(source, '<block {}>'.format(hex(builder.address)),
+                           'exec')
+            self.compiled[source] = code
+            if len(self.compiled) > MAX_COMPILED:
+                self.compiled.popitem(last=False)
+        else:
+            self.compiled.move_to_end(source)
+        exec(code, namespace)
+        return namespace[name]
+
+    # Straight-line instructions, these mirror the handlers in cpu.py
+    # statement by statement so that VF ends up the same when x or y is F.
+
+    def emit_nothing(self, builder, opcode):
+        pass
+
+    def emit_clear_screen(self, builder, opcode):
+        builder.emit('cpu.display.clear_display()')
+
+    def emit_set_reg_to_val(self, builder, opcode):
+        builder.emit('{} = {}'.format(
+            builder.write((opcode & 0xF00) >> 8), opcode & 0xFF))
+
+    def emit_add_to_reg(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        builder.emit('{} += {}'.format(vx, opcode & 0xFF),
+                     'if {} > 0xFF:'.format(vx),
+                     '    {} %= 0x100'.format(vx))
+
+    def emit_set_reg_to_reg(self, builder, opcode):
+        builder.emit('{} = {}'.format(
+            builder.write((opcode & 0xF00) >> 8),
+            builder.read((opcode & 0xF0) >> 4)))
+
+    def emit_bitwise(self, operator):
+        def emit(builder, opcode):
+            builder.emit('{} {}= {}'.format(
+                builder.write((opcode & 0xF00) >> 8),
+                operator,
+                builder.read((opcode & 0xF0) >> 4)))
+        return emit
+
+    def emit_add_reg_to_reg(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vy = builder.read((opcode & 0xF0) >> 4)
+        vf = builder.write(0xF)
+        builder.emit('s = {} + {}'.format(vx, vy),
+                     'if s > 0xFF:',
+                     '    {} = 1'.format(vf),
+                     '    {} = s & 0xFF'.format(vx),
+                     'else:',
+                     '    {} = 0'.format(vf),
+                     '    {} = s'.format(vx))
+
+    def emit_sub_reg_from_reg(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vy = builder.read((opcode & 0xF0) >> 4)
+        vf = builder.write(0xF)
+        builder.emit('if {} > {}:'.format(vx, vy),
+                     '    {} = 1'.format(vf),
+                     '    {} -= {}'.format(vx, vy),
+                     'else:',
+                     '    {} = 0'.format(vf),
+                     '    {} = 256 + {} - {}'.format(vx, vx, vy))
+
+    def emit_subn_reg_from_reg(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vy = builder.read((opcode & 0xF0) >> 4)
+        vf = builder.write(0xF)
+        builder.emit('if {} > {}:'.format(vy, vx),
+                     '    {} = 1'.format(vf),
+                     '    {} = {} - {}'.format(vx, vy, vx),
+                     'else:',
+                     '    {} = 0'.format(vf),
+                     '    {} = 256 + {} - {}'.format(vx, vy, vx))
+
+    def emit_right_shift(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vf = builder.write(0xF)
+        builder.emit('{} = {} & 0b1'.format(vf, vx),
+                     '{} = {} >> 1'.format(vx, vx))
+
+    def emit_right_shift_quirk(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vy = builder.read((opcode & 0xF0) >> 4)
+        vf = builder.write(0xF)
+        builder.emit('{} = {} & 0b1'.format(vf, vy),
+                     '{} = {} >> 1'.format(vx, vy))
+
+    def emit_left_shift(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vf = builder.write(0xF)
+        builder.emit('{} = {} & 0x80'.format(vf, vx),
+                     '{} = {} << 1'.format(vx, vx))
+
+    def emit_left_shift_quirk(self, builder, opcode):
+        vx = builder.write((opcode & 0xF00) >> 8)
+        vy = builder.read((opcode & 0xF0) >> 4)
+        vf = builder.write(0xF)
+        builder.emit('{} = {} & 0x80'.format(vf, vy),
+                     '{} = {} << 1'.format(vx, vy))
+
+    def emit_set_I_to_address(self, builder, opcode):
+        builder.emit('{} = {}'.format(builder.write_I(), opcode & 0xFFF))
+
+    def emit_generate_random_number(self, builder, opcode):
+        builder.emit('{} = randint(0, 0xFF) & {}'.format(
+            builder.write((opcode & 0xF00) >> 8), opcode & 0xFF))
+
+    def emit_set_reg_to_delay_timer(self, builder, opcode):
+        builder.emit('{} = cpu.delay_timer'.format(
+            builder.write((opcode & 0xF00) >> 8)))
+
+    def emit_set_delay_timer_to_reg(self, builder, opcode):
+        builder.emit('cpu.delay_timer = {}'.format(
+            builder.read((opcode & 0xF00) >> 8)))
+
+    def emit_set_sound_timer_to_reg(self, builder, opcode):
+        builder.emit('cpu.sound_timer = {}'.format(
+            builder.read((opcode & 0xF00) >> 8)))
+
+    def emit_add_reg_to_I(self, builder, opcode):
+        vx = builder.read((opcode & 0xF00) >> 8)
+        i = builder.write_I()
+        builder.emit('{} = {} + {}'.format(i, vx, i),
+                     'if {} >= 0x10000:'.format(i),
+                     '    {} %= 0x10000'.format(i))
+
+    def emit_load_sprite_from_memory(self, builder, opcode):
+        builder.emit('{} = {} * 5'.format(
+            builder.write_I(), builder.read((opcode & 0xF00) >> 8)))
+
+    def emit_load_mem_to_registers(self, builder, opcode):
+        register = (opcode & 0xF00) >> 8
+        builder.uses_memory = True
+        i = builder.read_I()
+        self.emit_bounds_check(builder, opcode, register + 1)
+        for x in range(register + 1):
+            builder.emit('{} = M[{} + {}]'.format(builder.write(x), i, x))
+        if self.lookup_handler(opcode).__name__.endswith('_quirk'):
+            builder.emit('{} += {}'.format(builder.write_I(), register + 1))
+
+    def emit_store(self, builder, opcode):
+        """
+            Fx33 and Fx55 write memory and drop the blocks covering it. The
+            block stops right after them when it was one of those, the code
+            that comes next may have changed.
+        """
+        handler = self.lookup_handler(opcode)
+        register = (opcode & 0xF00) >> 8
+        pc = builder.pc
+        builder.uses_memory = True
+        i = builder.read_I()
+        if handler.__name__ == 'bin_coded_dec':
+            value = builder.read(register)
+            length = 3
+            values = '({0} // 100 & 0xFF, {0} % 100 // 10, {0} % 10)'.format(
+                value)
+        else:
+            length = register + 1
+            values = '({},)'.format(', '.join(
+                '{} & 0xFF'.format(builder.read(x)) for x in range(length)))
+        self.emit_bounds_check(builder, opcode, length)
+        builder.emit('M[{0}:{0} + {1}] = bytes({2})'.format(i, length, values),
+                     'cpu.invalidate_code({}, {})'.format(i, length))
+        if handler.__name__.endswith('_quirk'):
+            builder.emit('{} += {}'.format(builder.write_I(), length))
+        builder.emit('if cpu.blocks[{}] is None:'.format(builder.address))
+        builder.emit(*builder.write_back('    '))
+        builder.emit('    cpu.pc = {}'.format(pc + 2),
+                     '    return {}'.format(builder.count + 1))
+
+    def emit_draw(self, builder, opcode):
+        """
+            Dxyn runs its handler, which reads the registers and I and sets
+            VF, so they are written back before and VF is loaded after.
+        """
+        builder.emit(*builder.write_back())
+        builder.emit('cpu.draw_pixel_to_display({}, {}, {})'.format(
+            (opcode & 0xF00) >> 8, (opcode & 0xF0) >> 4, opcode & 0xF))
+        builder.emit('{} = R[15]'.format(builder.write(15)))
+
+    def emit_bounds_check(self, builder, opcode, length):
+        """
+            Past the end of memory the handler runs instead, with the state
+            the interpreter would have, and raises the IndexError.
+        """
+        builder.emit('if {} + {} > {}:'.format(
+            builder.read_I(), length, len(self.memory)))
+        builder.emit(*builder.write_back('    '))
+        builder.emit(
+            '    cpu.pc = {}'.format(builder.pc),
+            '    cpu.{}({})'.format(self.lookup_handler(opcode).__name__,
+                                    (opcode & 0xF00) >> 8))
+
+    # Instructions that end a block, they have to set cpu.pc and return
+
+    def emit_jmp_to_addr(self, builder, opcode, pc):
+        builder.exit('cpu.pc = {}'.format(opcode & 0xFFF),
+                     'return {}'.format(builder.count))
+
+    def emit_call_subroutine(self, builder, opcode, pc):
+        builder.exit('cpu.stack_pointer += 1',
+                     'cpu.stack.append({})'.format(pc),
+                     'cpu.pc = {}'.format(opcode & 0xFFF),
+                     'return {}'.format(builder.count))
+
+    def emit_ret_from_subroutine(self, builder, opcode, pc):
+        # pc is set first so it points at the 00EE if the stack is empty
+        builder.exit('cpu.pc = {}'.format(pc),
+                     'pc = cpu.stack[cpu.stack_pointer]',
+                     'cpu.stack.pop()',
+                     'cpu.stack_pointer -= 1',
+                     'cpu.pc = pc + 2',
+                     'return {}'.format(builder.count))
+
+    def emit_jmp_to_val_plus_v0(self, builder, opcode, pc):
+        # The interpreter doesn't counteract the pc increment for Bnnn
+        builder.exit('cpu.pc = {} + {} + 2'.format(
+                        opcode & 0xFFF, builder.read(0)),
+                     'return {}'.format(builder.count))
+
+    def emit_skip_val(self, operator):
+        def emit(builder, opcode, pc):
+            builder.exit(
+                'cpu.pc = {} if {} {} {} else {}'.format(
+                    pc + 4,
+                    builder.read((opcode & 0xF00) >> 8),
+                    operator,
+                    opcode & 0xFF,
+                    pc + 2),
+                'return {}'.format(builder.count))
+        return emit
+
+    def emit_skip_reg(self, operator):
+        def emit(builder, opcode, pc):
+            builder.exit(
+                'cpu.pc = {} if {} {} {} else {}'.format(
+                    pc + 4,
+                    builder.read((opcode & 0xF00) >> 8),
+                    operator,
+                    builder.read((opcode & 0xF0) >> 4),
+                    pc + 2),
+                'return {}'.format(builder.count))
+        return emit
@@ -0,0 +1,473 @@
+"""
+    Runs many CHIP-8 machines in lockstep with NumPy, for fuzzing and agents
+    that run the same ROM thousands of times with different keys and seeds.
+    Every machine is a row of the arrays, a step executes one instruction on
+    all of them with one vectorized operation per opcode family in use.
+
+        machines = VectorCPU(1000, 'rom.ch8', seeds=range(1000))
+        machines.keys[:, 5] = True
+        machines.run_ticks(60)
+
+    The semantics are the ones of CPU's handlers, quirks included, so
+    registers are int64 and not uint8: 8xy5, 8xy7 and 8xyE don't wrap their
+    results there either. Values that outgrow 64 bits or go negative and are
+    then used as coordinates aren't supported.
+
+    NumPy is optional, only this module needs it.
+"""
+from collections import deque
+import random
+import config
+from ram import RAM
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+class VectorCPU:
+    def __init__(self, count, rom=None, seeds=None, mem_size=4096,
+                 offset=0x200, width=64, height=32):
+        if np is None:
+            raise ImportError("VectorCPU needs numpy")
+        if width > 64:
+            raise ValueError("Rows are stored in 64 bits")
+        self.count = count
+        self.mem_size = mem_size
+        self.offset = offset
+        self.width = width
+        self.height = height
+        self.full_row = np.uint64((1 << width) - 1)
+
+        self.registers = np.zeros((count, 16), np.int64)
+        self.memory = np.zeros((count, mem_size), np.uint8)
+        self.pc = np.full(count, offset, np.int64)
+        self.I = np.zeros(count, np.int64)
+        self.delay_timer = np.zeros(count, np.int64)
+        self.sound_timer = np.zeros(count, np.int64)
+        # The CPU's deque of 16 entries: its length and the stack pointer
+        self.stack = np.zeros((count, 16), np.int64)
+        self.stack_depth = np.zeros(count, np.int64)
+        self.stack_pointer = np.full(count, -1, np.int64)
+        self.opcode = np.zeros(count, np.int64)
+        self.rows = np.zeros((count, height), np.uint64)
+        # Held keys, set these between steps
+        self.keys = np.zeros((count, 16), bool)
+        # Keys as the previous run saw them and the ones that went down
+        # since, which Fx0A waits for like KeyState.pressed
+        self.previous_keys = np.zeros((count, 16), bool)
+        self.pressed = np.zeros((count, 16), bool)
+        self.exited = np.zeros(count, bool)
+        # Machines where the CPU would have raised stop executing
+        self.crashed = np.zeros(count, bool)
+        self.active = np.arange(count)
+        self.rngs = [random.Random(seed) for seed in
+                     (seeds if seeds is not None else [None] * count)]
+        if len(self.rngs) != count:
+            raise ValueError("There has to be a seed for every machine")
+
+        # All the machines share the clock
+        self.cycles = 0
+        self.cycles_per_tick = config.cycles_per_tick
+        self.next_tick = self.cycles_per_tick
+
+        self.shift_quirk = config.shift_quirk
+        self.load_quirk = config.load_quirk
+        self.families = [
+            self.zero_opcodes, self.jmp_to_addr, self.call_subroutine,
+            self.branch_if_equal_val, self.branch_if_not_equal_val,
+            self.branch_if_equal_reg, self.set_reg_to_val, self.add_to_reg,
+            self.logical_operations, self.skip_if_regs_not_equal,
+            self.set_I_to_address, self.jmp_to_val_plus_v0,
+            self.generate_random_number, self.draw_pixel_to_display,
+            self.input_handler, self.other_operations]
+        self.logical_operation_lookup = {
+            0x0: self.set_reg_to_reg,
+            0x1: self.bitwise_or,
+            0x2: self.bitwise_and,
+            0x3: self.bitwise_xor,
+            0x4: self.add_reg_to_reg,
+            0x5: self.sub_reg_from_reg,
+            0x6: self.right_shift,
+            0x7: self.subn_reg_from_reg,
+            0xE: self.left_shift
+        }
+        self.other_operation_lookup = {
+            0x07: self.set_reg_to_delay_timer,
+            0x0A: self.wait_for_keypress,
+            0x15: self.set_delay_timer_to_reg,
+            0x18: self.set_sound_timer_to_reg,
+            0x1E: self.add_reg_to_I,
+            0x29: self.load_sprite_from_memory,
+            0x33: self.bin_coded_dec,
+            0x55: self.load_registers_in_memory,
+            0x65: self.load_mem_to_registers
+        }
+
+        fontset = RAM.fontset
+        self.memory[:, :len(fontset)] = fontset
+        if rom is not None:
+            self.load_rom(rom)
+
+    def load_rom(self, filename):
+        with open(filename, 'rb') as cart:
+            rom = np.frombuffer(cart.read(), np.uint8)
+        if self.offset + len(rom) > self.mem_size:
+            raise ValueError("{} doesn't fit in memory".format(filename))
+        self.memory[:, self.offset:self.offset + len(rom)] = rom
+
+    def crash(self, machines):
+        if len(machines):
+            self.crashed[machines] = True
+            self.active = np.flatnonzero(~self.crashed)
+
+    def step(self):
+        """
+            Executes one instruction on every machine that didn't crash.
+        """
+        active = self.active
+        pc = self.pc[active]
+        outside = (pc < 0) | (pc >= self.mem_size - 1)
+        if outside.any():
+            self.crash(active[outside])
+            active = self.active
+            pc = self.pc[active]
+        opcode = self.memory[active, pc].astype(np.int64) << 8 \
+            | self.memory[active, pc + 1]
+        self.opcode[active] = opcode
+        family = opcode >> 12
+        present = np.flatnonzero(np.bincount(family, minlength=16))
+        if len(present) == 1:
+            self.families[present[0]](active, opcode)
+        else:
+            for operation in present:
+                selected = family == operation
+                self.families[operation](active[selected], opcode[selected])
+        if len(self.active) != len(active):
+            active = active[~self.crashed[active]]
+        self.pc[active] += 2
+
+    def update_timers(self):
+        active = self.active
+        self.delay_timer[active] -= self.delay_timer[active] > 0
+        self.sound_timer[active] -= self.sound_timer[active] > 0
+
+    def run_cycles(self, count):
+        """
+            Executes count instructions on every machine, ticking the timers
+            every cycles_per_tick of them like CPU.run_cycles. Every call is
+            a frame of the keypad: Fx0A sees the keys that went down since
+            the previous one.
+        """
+        self.pressed = self.keys & ~self.previous_keys
+        self.previous_keys = self.keys.copy()
+        for _ in range(count):
+            self.step()
+            self.cycles += 1
+            if self.cycles >= self.next_tick:
+                self.update_timers()
+                self.next_tick += self.cycles_per_tick
+        return count
+
+    def run_ticks(self, ticks):
+        if ticks <= 0:
+            return 0
+        return self.run_cycles(
+            self.next_tick - self.cycles
+            + (ticks - 1) * self.cycles_per_tick)
+
+    def export(self, machine, cpu):
+        """
+            Copies the state of one machine into a CPU, to look at it with
+            the usual tools or keep running it on its own.
+        """
+        depth = int(self.stack_depth[machine])
+        cpu.registers[:] = self.registers[machine].tolist()
+        cpu.memory[:] = self.memory[machine].tobytes()
+        cpu.pc = int(self.pc[machine])
+        cpu.I = int(self.I[machine])
+        cpu.delay_timer = int(self.delay_timer[machine])
+        cpu.sound_timer = int(self.sound_timer[machine])
+        cpu.stack = deque(self.stack[machine, :depth].tolist(), maxlen=16)
+        cpu.stack_pointer = int(self.stack_pointer[machine])
+        cpu.opcode = int(self.opcode[machine])
+        cpu.exited = bool(self.exited[machine])
+        cpu.cycles = self.cycles
+        cpu.cycles_per_tick = self.cycles_per_tick
+        cpu.next_tick = self.next_tick
+        cpu.rng.setstate(self.rngs[machine].getstate())
+        cpu.display.load_rows(self.rows[machine].tolist())
+        cpu.invalidate_code(0, len(cpu.memory))
+
+    # The handlers get the machines executing them and their opcodes
+
+    def zero_opcodes(self, machines, opcode):
+        clear = machines[opcode == 0x00E0]
+        if len(clear):
+            self.rows[clear] = 0
+        returning = machines[opcode == 0x00EE]
+        if len(returning):
+            self.ret_from_subroutine(returning)
+        exiting = machines[opcode == 0x00FD]
+        if len(exiting):
+            self.exited[exiting] = True
+            self.pc[exiting] -= 2
+
+    def ret_from_subroutine(self, machines):
+        depth = self.stack_depth[machines]
+        # The CPU's stack[stack_pointer] raises past an overflow
+        valid = (depth > 0) & (self.stack_pointer[machines] == depth - 1)
+        self.crash(machines[~valid])
+        machines = machines[valid]
+        self.pc[machines] = self.stack[machines, depth[valid] - 1]
+        self.stack_depth[machines] -= 1
+        self.stack_pointer[machines] -= 1
+
+    def jmp_to_addr(self, machines, opcode):
+        self.pc[machines] = (opcode & 0xFFF) - 2
+
+    def call_subroutine(self, machines, opcode):
+        full = self.stack_depth[machines] == 16
+        if full.any():
+            # The deque drops its oldest entry
+            dropping = machines[full]
+            self.stack[dropping, :-1] = self.stack[dropping, 1:]
+        self.stack_depth[machines[~full]] += 1
+        self.stack[machines, self.stack_depth[machines] - 1] = \
+            self.pc[machines]
+        self.stack_pointer[machines] += 1
+        self.pc[machines] = (opcode & 0xFFF) - 2
+
+    def skip(self, machines, condition):
+        self.pc[machines[condition]] += 2
+
+    def branch_if_equal_val(self, machines, opcode):
+        self.skip(machines, self.registers[machines, (opcode >> 8) & 0xF]
+                  == opcode & 0xFF)
+
+    def branch_if_not_equal_val(self, machines, opcode):
+        self.skip(machines, self.registers[machines, (opcode >> 8) & 0xF]
+                  != opcode & 0xFF)
+
+    def branch_if_equal_reg(self, machines, opcode):
+        self.skip(machines, self.registers[machines, (opcode >> 8) & 0xF]
+                  == self.registers[machines, (opcode >> 4) & 0xF])
+
+    def skip_if_regs_not_equal(self, machines, opcode):
+        self.skip(machines, self.registers[machines, (opcode >> 8) & 0xF]
+                  != self.registers[machines, (opcode >> 4) & 0xF])
+
+    def set_reg_to_val(self, machines, opcode):
+        self.registers[machines, (opcode >> 8) & 0xF] = opcode & 0xFF
+
+    def add_to_reg(self, machines, opcode):
+        x = (opcode >> 8) & 0xF
+        total = self.registers[machines, x] + (opcode & 0xFF)
+        self.registers[machines, x] = np.where(
+            total > 0xFF, total % 0x100, total)
+
+    def logical_operations(self, machines, opcode):
+        operations = opcode & 0xF
+        for operation in np.flatnonzero(np.bincount(operations)):
+            selected = operations == operation
+            handler = self.logical_operation_lookup.get(operation)
+            if handler is None:
+                self.crash(machines[selected])
+                continue
+            chosen = machines[selected]
+            handler(chosen,
+                    (opcode[selected] >> 8) & 0xF,
+                    (opcode[selected] >> 4) & 0xF)
+
+    # The 8xyn operations get the x and y of every machine. VF is written
+    # before the result and the result reads the registers again, so VF as
+    # x or y behaves like in CPU.
+
+    def set_reg_to_reg(self, machines, x, y):
+        self.registers[machines, x] = self.registers[machines, y]
+
+    def bitwise_or(self, machines, x, y):
+        self.registers[machines, x] = \
+            self.registers[machines, x] | self.registers[machines, y]
+
+    def bitwise_and(self, machines, x, y):
+        self.registers[machines, x] = \
+            self.registers[machines, x] & self.registers[machines, y]
+
+    def bitwise_xor(self, machines, x, y):
+        self.registers[machines, x] = \
+            self.registers[machines, x] ^ self.registers[machines, y]
+
+    def add_reg_to_reg(self, machines, x, y):
+        total = self.registers[machines, x] + self.registers[machines, y]
+        carry = total > 0xFF
+        self.registers[machines, 0xF] = carry
+        self.registers[machines, x] = np.where(carry, total & 0xFF, total)
+
+    def sub_reg_from_reg(self, machines, x, y):
+        no_borrow = self.registers[machines, x] > self.registers[machines, y]
+        self.registers[machines, 0xF] = no_borrow
+        difference = self.registers[machines, x] - self.registers[machines, y]
+        self.registers[machines, x] = np.where(
+            no_borrow, difference, 256 + difference)
+
+    def subn_reg_from_reg(self, machines, x, y):
+        no_borrow = self.registers[machines, y] > self.registers[machines, x]
+        self.registers[machines, 0xF] = no_borrow
+        difference = self.registers[machines, y] - self.registers[machines, x]
+        self.registers[machines, x] = np.where(
+            no_borrow, difference, 256 + difference)
+
+    def right_shift(self, machines, x, y):
+        source = y if self.shift_quirk else x
+        self.registers[machines, 0xF] = self.registers[machines, source] & 1
+        self.registers[machines, x] = self.registers[machines, source] >> 1
+
+    def left_shift(self, machines, x, y):
+        source = y if self.shift_quirk else x
+        self.registers[machines, 0xF] = \
+            self.registers[machines, source] & 0x80
+        self.registers[machines, x] = self.registers[machines, source] << 1
+
+    def set_I_to_address(self, machines, opcode):
+        self.I[machines] = opcode & 0xFFF
+
+    def jmp_to_val_plus_v0(self, machines, opcode):
+        # Like CPU this doesn't counteract the pc increment
+        self.pc[machines] = (opcode & 0xFFF) + self.registers[machines, 0]
+
+    def generate_random_number(self, machines, opcode):
+        # Every machine draws from its own generator, the same way CPU does
+        values = np.array(
+            [self.rngs[machine].randint(0, 0xFF) for machine in machines],
+            np.int64)
+        self.registers[machines, (opcode >> 8) & 0xF] = values & opcode & 0xFF
+
+    def draw_pixel_to_display(self, machines, opcode):
+        registers = self.registers
+        x = registers[machines, (opcode >> 8) & 0xF]
+        y = registers[machines, (opcode >> 4) & 0xF]
+        height = opcode & 0xF
+        registers[machines, 0xF] = 0
+        x = np.where(x >= self.width, x % self.width, x)
+        y = np.where(y >= self.height, y % self.height, y)
+        I = self.I[machines]
+        negative = I < 0
+        if negative.any():
+            self.crash(machines[negative])
+            keep = ~negative
+            machines, x, y, height, I = \
+                machines[keep], x[keep], y[keep], height[keep], I[keep]
+        # The sprite is cut short at the end of memory
+        height = np.minimum(height, np.maximum(self.mem_size - I, 0))
+
+        shift = self.width - 8 - x
+        wraps = shift < 0
+        left = np.where(wraps, self.width + shift, shift).astype(np.uint64)
+        right = np.where(wraps, -shift, 0).astype(np.uint64)
+        collision = np.zeros(len(machines), bool)
+        for line in range(int(height.max()) if len(height) else 0):
+            drawing = line < height
+            chosen = machines[drawing]
+            byte = self.memory[chosen, I[drawing] + line].astype(np.uint64)
+            bits = byte << left[drawing]
+            bits = np.where(
+                wraps[drawing], bits | (byte >> right[drawing]), bits) \
+                & self.full_row
+            row_y = (y[drawing] + line) % self.height
+            row = self.rows[chosen, row_y]
+            collision[drawing] |= (row & bits) != 0
+            self.rows[chosen, row_y] = row ^ bits
+        registers[machines[collision], 0xF] = 1
+
+    def input_handler(self, machines, opcode):
+        low = opcode & 0xFF
+        key = self.registers[machines, (opcode >> 8) & 0xF]
+        valid = (key >= 0) & (key < 16)
+        pressed = np.zeros(len(machines), bool)
+        pressed[valid] = self.keys[machines[valid], key[valid]]
+        self.skip(machines, (low == 0x9E) & pressed)
+        self.skip(machines, (low == 0xA1) & ~pressed)
+
+    def other_operations(self, machines, opcode):
+        operations = opcode & 0xFF
+        for operation in np.flatnonzero(np.bincount(operations)):
+            selected = operations == operation
+            handler = self.other_operation_lookup.get(operation)
+            if handler is None:
+                self.crash(machines[selected])
+                continue
+            handler(machines[selected], (opcode[selected] >> 8) & 0xF)
+
+    # The Fxnn operations get the x of every machine
+
+    def set_reg_to_delay_timer(self, machines, x):
+        self.registers[machines, x] = self.delay_timer[machines]
+
+    def wait_for_keypress(self, machines, x):
+        keys = self.pressed[machines]
+        pressed = keys.any(axis=1)
+        # The lowest key that went down, which is used up, otherwise run
+        # Fx0A again
+        waited = machines[pressed]
+        key = keys[pressed].argmax(axis=1)
+        self.registers[waited, x[pressed]] = key
+        self.pressed[waited, key] = False
+        self.pc[machines[~pressed]] -= 2
+
+    def set_delay_timer_to_reg(self, machines, x):
+        self.delay_timer[machines] = self.registers[machines, x]
+
+    def set_sound_timer_to_reg(self, machines, x):
+        self.sound_timer[machines] = self.registers[machines, x]
+
+    def add_reg_to_I(self, machines, x):
+        total = self.registers[machines, x] + self.I[machines]
+        self.I[machines] = np.where(total >= 0x10000, total % 0x10000, total)
+
+    def load_sprite_from_memory(self, machines, x):
+        self.I[machines] = self.registers[machines, x] * 5
+
+    def in_memory(self, machines, length):
+        """
+            Crashes the machines where memory[I:I + length] doesn't fit and
+            returns the others with their masks.
+        """
+        I = self.I[machines]
+        fits = (I >= 0) & (I + length <= self.mem_size)
+        self.crash(machines[~fits])
+        return fits
+
+    def bin_coded_dec(self, machines, x):
+        fits = self.in_memory(machines, 3)
+        machines = machines[fits]
+        value = self.registers[machines, x[fits]]
+        I = self.I[machines]
+        self.memory[machines, I] = (value // 100) & 0xFF
+        self.memory[machines, I + 1] = value % 100 // 10
+        self.memory[machines, I + 2] = value % 10
+
+    def load_registers_in_memory(self, machines, x):
+        fits = self.in_memory(machines, x + 1)
+        machines = machines[fits]
+        x = x[fits]
+        I = self.I[machines]
+        for register in range(int(x.max()) + 1 if len(x) else 0):
+            storing = register <= x
+            self.memory[machines[storing], I[storing] + register] = \
+                self.registers[machines[storing], register] & 0xFF
+        if self.load_quirk:
+            self.I[machines] += x + 1
+
+    def load_mem_to_registers(self, machines, x):
+        fits = self.in_memory(machines, x + 1)
+        machines = machines[fits]
+        x = x[fits]
+        I = self.I[machines]
+        for register in range(int(x.max()) + 1 if len(x) else 0):
+            loading = register <= x
+            self.registers[machines[loading], register] = \
+                self.memory[machines[loading], I[loading] + register]
+        if self.load_quirk:
+            self.I[machines] += x + 1